@@ -21,30 +21,37 @@ ASNR-MICCAI-BraTS2023-GLI-Challenge-TrainingData
 3. 通过三次插值将像素调整为224*224
 
 """
+import functools
 import os
 import numpy as np
 import torch
 import random
 import SimpleITK as sitk
 from torch.utils.data import Dataset, DataLoader
-from mask_generator import random_masked_area
+from mask_generator import random_masked_area, random_masked_channels, random_block_mask
 import pandas as pd
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from mask_generator.masker import random_masked_channels
+from mask_generator.masker import MASK_TRANSPORTS, masks_to_plane
+from mask_generator.mask_bank import MaskBank
+from datasets.cache import VolumeCache
+from datasets.packed_store import PackedStore
+from datasets.shared_cache import SharedVolumeCache
+from datasets.loader_tuning import tune_dataloader
+from datasets.manifest import DatasetManifest
+from datasets.sampler import InformativeSliceSampler, load_foreground_index
+from datasets.readers import get_reader, select_fastest_reader
+from datasets.normalization import normalize, VolumeStatsIndex
+
+# 四个模态（序列）的文件后缀，同时也是拼接时的顺序
+MODALITIES = ('t1c', 't1n', 't2w', 't2f')
 
 
 def read_image(path):
     return sitk.GetArrayFromImage(sitk.ReadImage(path))
 
 
-def normalize(image):
-    max_val = np.percentile(image, 99)
-    image = np.clip(image, 0, max_val)
-    image = image / max_val
-    return image
-
-
 def resize_and_crop(image, slice_deep=128, slice_size=192):
     """
     从图像中均匀采样多个切片，并返回包含这些切片的新图像。
@@ -83,11 +90,75 @@ def random_flip(image, action):
     return image
 
 
+def modality_slots(combined_image, method='plane'):
+    """
+    返回每个模态在拼接图像中所在位置的视图。
+    :param combined_image: 'plane' 形状为 (slice_num, 2*height, 2*width)，顺序为左上t1c、右上t1n、左下t2w、右下t2f；
+                           'channels' 形状为 (slice_num, 4, height, width)
+    :return: 按 MODALITIES 顺序排列的视图，每个形状为 (slice_num, height, width)
+    """
+    if method == 'plane':
+        h, w = combined_image.shape[1] // 2, combined_image.shape[2] // 2
+        return [combined_image[:, (i // 2) * h:(i // 2 + 1) * h, (i % 2) * w:(i % 2 + 1) * w] for i in range(4)]
+    elif method == 'channels':
+        return [combined_image[:, i] for i in range(4)]
+    raise ValueError(f"Invalid concat method: {method}")
+
+
+def concat_modalities(volumes, method='plane', flip_action=0, dtype=np.float32):
+    """
+    拼接四个模态的图像。预先分配输出数组，每个模态翻转后直接写入对应的位置，不产生中间数组。
+    :param volumes: 按 MODALITIES 顺序排列的图像，每个形状为 (slice_num, height, width)
+    :param method: 'plane' 拼接为 (slice_num, 2*height, 2*width)，顺序为左上t1c、右上t1n、左下t2w、右下t2f；
+                   'channels' 堆叠为 (slice_num, 4, height, width)
+    :param flip_action: 翻转操作，见 random_flip，四个模态使用相同的操作
+    :param dtype: 输出精度
+    """
+    slice_num, height, width = volumes[0].shape
+    if method == 'plane':
+        combined_image = np.empty((slice_num, 2 * height, 2 * width), dtype=dtype)
+    elif method == 'channels':
+        combined_image = np.empty((slice_num, 4, height, width), dtype=dtype)
+    else:
+        raise ValueError(f"Invalid concat method: {method}")
+    for slot, volume in zip(modality_slots(combined_image, method), volumes):
+        np.copyto(slot, random_flip(volume, flip_action), casting='same_kind')
+    return combined_image
+
+
 class Dataset_brats(Dataset):
     def __init__(self, root_dir, slice_deep, slice_size=192, mask_kernel_size=12, binary_mask='1111', mask_rate=0.5,
-                 mode='train', concat_method='plane', is_random=False):
+                 mode='train', concat_method='plane', is_random=False, cache_dir=None, cache_dtype='float32',
+                 list_dir="data/list/pre-test-50", packed_file=None, reader='sitk', reader_index_dir=None,
+                 stats_file=None, norm_method='partition', norm_dtype='float32', decode_threads=0,
+                 sample_dtype='float32', mask_transport='dense', mask_bank=None, shared_cache_mb=0, worker_flip=True,
+                 manifest=None):
         """
         初始化函数，列出所有患者的数据目录。
+        :param cache_dir: 预处理结果的缓存目录，为 None 时不使用缓存
+        :param cache_dtype: 缓存的存储精度，'float32' 或 'float16'
+        :param list_dir: 数据划分目录，包含 train.csv、valid.csv、test.csv
+        :param packed_file: 打包后的单文件数据（见 utils/pack_dataset.py），为 None 时从原始 .nii.gz 读取
+        :param reader: NIfTI 读取后端，见 datasets/readers.py；'auto' 时在第一个患者的数据上测量并选择最快的后端。
+                       'sitk' 以外的后端只读取剪裁区域，归一化的百分位数也只在剪裁区域上计算
+        :param reader_index_dir: indexed_gzip 后端保存 gzip 索引的目录
+        :param stats_file: 统计索引（见 utils/build_stats_index.py），提供完整图像的百分位数，不再重复计算
+        :param norm_method: 没有统计索引时百分位数的计算方法，'numpy'、'partition' 或 'histogram'
+        :param norm_dtype: 归一化的计算精度，'float64' 或 'float32'
+        :param decode_threads: 每个 worker 内并发读取四个模态的线程数量，0 或 1 时依次读取。
+                               gzip 解压和 SimpleITK 都会释放 GIL，四个模态可以并行处理
+        :param sample_dtype: 返回样本的精度，'float32' 或 'float16'，float16 可以减少一半 worker 到主进程的共享内存传输
+        :param mask_transport: 'dense' 返回遮蔽后图像和原始图像；'block' 返回块级别的布尔掩码和原始图像，
+                               掩码在设备上展开（见 utils.convert_shape.iter_step_batches），不支持 is_random；
+                               'device' 只返回原始图像（第一项为空的占位张量），掩码在设备上生成
+        :param mask_bank: 预先生成的掩码库（见 utils/build_mask_bank.py），为 None 时逐个样本生成掩码。
+                          训练时随机选择掩码，其余模式按样本索引选择固定的掩码
+        :param shared_cache_mb: 跨 worker 共享的内存缓存大小（MB），0 时不使用。缓存由主进程中的 Dataset 创建，
+                                所有 worker 共享，epoch 之间保留，超出预算时替换最近最少使用的患者。
+                                每个数据集各自创建缓存，大小不超过全部患者所需的空间
+        :param worker_flip: 是否在 DataLoader worker 中随机翻转，使用设备上的数据增强（见 training/augmentation.py）时关闭
+        :param manifest: 数据集清单（见 utils/build_manifest.py），初始化时检查划分中所有患者的文件，缺失或损坏时报错；
+                         原始文件的内容指纹加入预处理缓存的文件名，文件变化后对应的缓存项失效
         """
         self.mode = mode
         self.concat_method = concat_method
@@ -98,8 +169,32 @@ class Dataset_brats(Dataset):
         self.binary_mask = binary_mask
         self.mask_rate = mask_rate
         self.slice_deep = slice_deep
-        self.list_dir = "data/list/pre-test-50"
+        self.list_dir = list_dir
         self.mask_random = is_random
+        self.worker_flip = worker_flip
+        if mask_transport not in MASK_TRANSPORTS:
+            raise ValueError(f"Invalid mask transport: {mask_transport}. Expected one of: {MASK_TRANSPORTS}")
+        if mask_transport == 'block' and is_random:
+            raise ValueError("mask_transport='block' does not support is_random, the mask kernel size must be fixed")
+        self.mask_transport = mask_transport
+        self.mask_bank = None
+        if mask_bank is not None:
+            if mask_transport == 'device':
+                raise ValueError("mask_bank cannot be used with mask_transport='device'")
+            self.mask_bank = MaskBank(mask_bank)
+            self.mask_bank.check(slice_size, mask_kernel_size, binary_mask, mask_rate, is_random)
+        # 归一化使用的百分位数
+        self.percentile = 99
+        self.norm_method = norm_method
+        self.norm_dtype = np.dtype(norm_dtype)
+        self.stats = VolumeStatsIndex(stats_file, self.percentile) if stats_file is not None else None
+        self.decode_threads = decode_threads
+        if sample_dtype not in ('float32', 'float16'):
+            raise ValueError(f"Unsupported sample dtype: {sample_dtype}. Expected 'float32' or 'float16'")
+        self.sample_dtype = np.dtype(sample_dtype)
+        # 线程池在每个 worker 进程中第一次使用时创建
+        self.pool = None
+        self.pool_pid = None
 
         # 根据模式选择对应的csv文件
         if self.mode == 'train':
@@ -115,6 +210,55 @@ class Dataset_brats(Dataset):
         df = pd.read_csv(csv_file, header=None)
         self.patients = [os.path.join('data/raw', self.root_dir, name) for name in df.iloc[:, 0].tolist()]
 
+        self.manifest = None
+        if manifest is not None:
+            self.manifest = DatasetManifest(manifest)
+            problems = self.manifest.problems([os.path.basename(patient) for patient in self.patients], MODALITIES)
+            if problems:
+                details = '; '.join(f"{patient} {modality}: {problem}" for patient, modality, problem in problems[:10])
+                raise ValueError(f"{len(problems)} files of the {self.mode} split are missing or unreadable "
+                                 f"according to {manifest}: {details}")
+
+        if reader == 'auto':
+            # 没有统计索引时只能选择读取完整图像的后端（sitk），否则不同划分、不同机器的归一化结果可能不同；
+            # 有统计索引时所有后端的归一化结果相同
+            sample_paths = [self.modality_path(self.patients[0], modality) for modality in MODALITIES]
+            reader = select_fastest_reader(sample_paths, slice_deep, slice_size,
+                                           full_volume=None if self.stats is not None else True)
+        self.reader = get_reader(reader, index_dir=reader_index_dir) if reader == 'indexed_gzip' else get_reader(reader)
+        # 只读取剪裁区域且没有统计索引时，百分位数在剪裁区域上计算
+        self.norm_scope = 'volume' if self.reader.full_volume or self.stats is not None else 'slab'
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = VolumeCache(cache_dir, slice_deep, slice_size, percentile=self.percentile, dtype=cache_dtype,
+                                     scope=self.norm_scope, method=norm_method, norm_dtype=self.norm_dtype)
+        self.store = None
+        if packed_file is not None:
+            self.store = PackedStore(packed_file)
+            if (self.store.slice_deep, self.store.slice_size, tuple(self.store.modalities)) != \
+                    (slice_deep, slice_size, MODALITIES):
+                raise ValueError(f"Packed file {packed_file} was built with slice_deep={self.store.slice_deep}, "
+                                 f"slice_size={self.store.slice_size}, expected {slice_deep}, {slice_size}")
+            expected = dict(self.normalization(), percentile=self.percentile)
+            if self.store.normalization != expected:
+                raise ValueError(f"Packed file {packed_file} was normalized with {self.store.normalization}, "
+                                 f"expected {expected}; rebuild it with utils/pack_dataset.py using the same reader, "
+                                 f"stats_file, norm_method and norm_dtype")
+        self.shared_cache = None
+        if shared_cache_mb:
+            # 槽位数量不超过患者数量，验证集等较小的数据集只占用实际需要的共享内存
+            self.shared_cache = SharedVolumeCache(shared_cache_mb * 1024 ** 2, (slice_deep, slice_size, slice_size),
+                                                  len(MODALITIES), self.sample_dtype, max_entries=len(self.patients))
+            self.patient_index = {patient: i for i, patient in enumerate(self.patients)}
+
+    def normalization(self):
+        """
+        :return: 决定归一化结果的参数，记录在打包文件的索引中；使用统计索引时百分位数的计算方法不起作用
+        """
+        return {'norm_scope': self.norm_scope, 'norm_method': None if self.stats is not None else self.norm_method,
+                'norm_dtype': str(self.norm_dtype), 'stats': self.stats is not None}
+
     def __len__(self):
         return len(self.patients)
 
@@ -125,69 +269,240 @@ class Dataset_brats(Dataset):
         patient_path = self.patients[idx]
         # 预处理并拼接图像
         combined_image = self.preprocess_directory(patient_path, self.concat_method)
+        return self.apply_mask(combined_image, idx * self.slice_deep)
+
+    def apply_mask(self, combined_image, bank_start=None):
+        """
+        为拼接后的图像生成遮蔽掩码。
+        :param combined_image: 拼接后的图像，形状为 (slice_num, 4, H, W) 或 (slice_num, 2H, 2W)
+        :param bank_start: 使用掩码库时，非训练模式下第一个切片的掩码索引
+        :return: 遮蔽后图像X和原始图像y；mask_transport='block' 时X为块级别掩码 (slice_num, 4, grid, grid)，
+                 'device' 时X为空的占位张量
+        """
+        if self.mask_transport == 'device':
+            return torch.empty(0, dtype=torch.bool), torch.from_numpy(combined_image)
+        if self.mask_bank is not None:
+            indices = self.mask_bank.indices(combined_image.shape[0], None if self.mode == 'train' else bank_start)
+        if self.mask_transport == 'block':
+            if self.mask_bank is not None:
+                block_mask = self.mask_bank.block(indices)
+            else:
+                block_mask = random_block_mask(combined_image.shape[0], self.slice_size // self.mask_kernel_size,
+                                               self.binary_mask, self.mask_rate)
+            return torch.from_numpy(block_mask), torch.from_numpy(combined_image)
+
         start = time.time()
         # 生成遮蔽掩码
-        if self.concat_method == 'plane':
+        if self.mask_bank is not None:
+            masked_image = self.mask_bank.dense(indices)
+            if self.concat_method == 'plane':
+                masked_image = masks_to_plane(masked_image)
+        elif self.concat_method == 'plane':
             masked_image = random_masked_area(combined_image, self.mask_kernel_size, self.slice_size, self.binary_mask,
-                                              self.mask_rate)
+                                              self.mask_rate, self.mask_random)
         elif self.concat_method == 'channels':
             masked_image = random_masked_channels(combined_image, self.mask_kernel_size, self.slice_size,
                                                   self.binary_mask, self.mask_rate, self.mask_random)
         end = time.time()
         # print(f"mask time: {end - start:.4f}")
-        # 生成遮蔽后图像
+        # 生成遮蔽后图像，直接输出为样本精度
         # masked_result = np.where(masked_image == 1, combined_image, -1)
-        masked_result = combined_image * masked_image
+        masked_result = np.multiply(combined_image, masked_image, out=np.empty_like(combined_image), casting='unsafe')
 
         # 返回遮蔽后图像X和原始图像y
-        # Convert numpy array to torch tensor
-        return torch.tensor(masked_result, dtype=torch.float32), torch.tensor(combined_image, dtype=torch.float32)
+        # torch.from_numpy 与 numpy 数组共享内存，不再复制
+        return torch.from_numpy(masked_result), torch.from_numpy(combined_image)
+
+    def slice_sample(self, volumes, idx):
+        """
+        将一个切片的四个模态组成一个样本，切片级数据集使用。
+        :param volumes: 按 MODALITIES 顺序排列的图像，每个形状为 (1, slice_size, slice_size)
+        :param idx: 切片的全局索引 患者 * slice_deep + 切片，用于选择掩码库中固定的掩码
+        :return: 遮蔽后图像X和原始图像y，'channels' 为 (4, H, W)，'plane' 为 (1, 2H, 2W)；
+                 mask_transport='block' 时X为块级别掩码 (4, grid, grid)，'device' 时X为空的占位张量
+        """
+        # 每个切片独立决定翻转操作，四个模态保持一致
+        flip_action = random.choice([0, 1, 2]) if self.worker_flip else 0
+        combined_image = concat_modalities(volumes, self.concat_method, flip_action, self.sample_dtype)
+        masked_image, original_image = self.apply_mask(combined_image, idx)
+        if self.concat_method == 'channels':
+            # 去除长度为1的切片维度，(1, 4, H, W) -> (4, H, W)
+            original_image = original_image[0]
+            if self.mask_transport != 'device':
+                masked_image = masked_image[0]
+        elif self.mask_transport == 'block':
+            # 'plane' 的原始图像保留切片维度作为单通道 (1, 2H, 2W)，块级别掩码 (1, 4, grid, grid) -> (4, grid, grid)
+            masked_image = masked_image[0]
+        return masked_image, original_image
 
     def preprocess_directory(self, directory, method='plane'):
         """
         处理指定目录下的所有图像，返回预处理和拼接后的图像。
         """
-        # 读取图像
-        # seg = self.read_image(os.path.join(directory, f"{os.path.basename(directory)}-seg.nii.gz"))
-        t1c = read_image(os.path.join(directory, f"{os.path.basename(directory)}-t1c.nii.gz"))
-        t1n = read_image(os.path.join(directory, f"{os.path.basename(directory)}-t1n.nii.gz"))
-        t2w = read_image(os.path.join(directory, f"{os.path.basename(directory)}-t2w.nii.gz"))
-        t2f = read_image(os.path.join(directory, f"{os.path.basename(directory)}-t2f.nii.gz"))
-
-        # 归一化、剪裁、随机翻转和拼接
-        t1c = resize_and_crop(normalize(t1c), slice_deep=self.slice_deep, slice_size=self.slice_size)
-        t1n = resize_and_crop(normalize(t1n), slice_deep=self.slice_deep, slice_size=self.slice_size)
-        t2w = resize_and_crop(normalize(t2w), slice_deep=self.slice_deep, slice_size=self.slice_size)
-        t2f = resize_and_crop(normalize(t2f), slice_deep=self.slice_deep, slice_size=self.slice_size)
+        # 读取归一化、剪裁后的图像
+        volumes = self.load_patient(directory)
 
         # 决定一个随机翻转操作并应用到所有图像
-        flip_action = random.choice([0, 1, 2])  # 从三种操作中随机选择
-        t1c = random_flip(t1c, flip_action)
-        t1n = random_flip(t1n, flip_action)
-        t2w = random_flip(t2w, flip_action)
-        t2f = random_flip(t2f, flip_action)
+        flip_action = random.choice([0, 1, 2]) if self.worker_flip else 0  # 从三种操作中随机选择
+        return concat_modalities(volumes, method, flip_action, self.sample_dtype)
+
+    @staticmethod
+    def modality_path(directory, modality):
+        return os.path.join(directory, f"{os.path.basename(directory)}-{modality}.nii.gz")
+
+    def load_patient(self, directory):
+        """
+        读取一个患者全部模态归一化、剪裁后的图像。使用共享内存缓存时优先从缓存中读取，未命中时读取后写入缓存。
+        :return: 按 MODALITIES 顺序排列的图像列表
+        """
+        if self.shared_cache is None:
+            return self.read_patient(directory)
+        key = self.patient_index[directory]
+        volumes = self.shared_cache.get(key)
+        if volumes is None:
+            volumes = self.read_patient(directory)
+            self.shared_cache.put(key, volumes)
+        return volumes
 
-        combined_image = []
-        # 合并图像
-        if method == 'plane':
-            top_row = np.concatenate((t1c, t1n), axis=2)  # 横向拼接
-            bottom_row = np.concatenate((t2w, t2f), axis=2)
-            combined_image = np.concatenate((top_row, bottom_row), axis=1)  # 纵向拼接
-        elif method == 'channels':
-            combined_image = np.stack((t1c, t1n, t2w, t2f), axis=1)
+    def read_patient(self, directory):
+        """
+        从打包文件、磁盘缓存或原始 .nii.gz 读取一个患者的全部模态。
+        """
+        if self.store is not None:
+            return self.store.read_patient(os.path.basename(directory))
+        if self.decode_threads > 1:
+            return list(self.get_pool().map(lambda modality: self.load_modality(directory, modality), MODALITIES))
+        return [self.load_modality(directory, modality) for modality in MODALITIES]
 
-        return combined_image
+    def get_pool(self):
+        """
+        获取当前进程的线程池。DataLoader 以 fork 方式创建 worker 时会复制主进程中的对象，但不会复制线程，
+        因此按进程号判断线程池是否属于当前进程。
+        """
+        if self.pool is None or self.pool_pid != os.getpid():
+            self.pool = ThreadPoolExecutor(max_workers=self.decode_threads)
+            self.pool_pid = os.getpid()
+        return self.pool
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['pool_pid'] = None
+        return state
+
+    def load_modality(self, directory, modality):
+        """
+        读取单个模态并完成归一化和剪裁。启用缓存时优先从缓存中映射读取，未命中时计算并写入缓存。
+        :param directory: 患者数据目录
+        :param modality: 模态名称，见 MODALITIES
+        :return: 形状为 (slice_deep, slice_size, slice_size) 的图像
+        """
+        fingerprint = self.manifest.fingerprint(os.path.basename(directory), modality) \
+            if self.manifest is not None else None
+        if self.cache is not None:
+            volume = self.cache.load(directory, modality, fingerprint)
+            if volume is not None:
+                return volume
+
+        # seg = read_image(self.modality_path(directory, 'seg'))
+        path = self.modality_path(directory, modality)
+        max_val = self.stats.max_val(os.path.basename(directory), modality) if self.stats is not None else None
+        if max_val is not None:
+            # 已知完整图像的百分位数，只需读取并归一化剪裁区域
+            volume = normalize(self.reader.read_slab(path, self.slice_deep, self.slice_size), max_val=max_val,
+                               dtype=self.norm_dtype)
+        elif self.norm_scope == 'volume':
+            volume = resize_and_crop(normalize(self.reader.read(path), self.percentile, method=self.norm_method,
+                                               dtype=self.norm_dtype),
+                                     slice_deep=self.slice_deep, slice_size=self.slice_size)
+        else:
+            volume = normalize(self.reader.read_slab(path, self.slice_deep, self.slice_size), self.percentile,
+                               method=self.norm_method, dtype=self.norm_dtype)
+
+        if self.cache is not None:
+            volume = self.cache.save(directory, modality, volume, fingerprint)
+        return volume
 
 
 def get_brats_dataloader(root_dir, batch_size=1, slice_deep=16,
                          slice_size=192, num_workers=1, mask_kernel_size=12,
-                         binary_mask='1111', mask_rate=0.5, mode='train', concat_method='plane', is_random=False):
+                         binary_mask='1111', mask_rate=0.5, mode='train', concat_method='plane', is_random=False,
+                         cache_dir=None, cache_dtype='float32', list_dir="data/list/pre-test-50", packed_file=None,
+                         level='patient', reader='sitk', reader_index_dir=None,
+                         stats_file=None, norm_method='partition', norm_dtype='float32', decode_threads=0,
+                         sample_dtype='float32', mask_transport='dense', mask_bank=None, shared_cache_mb=0,
+                         foreground_index=None, foreground_threshold=0.01, empty_weight=0.0, shuffle_buffer=256,
+                         worker_flip=True, persistent_workers=False, prefetch_factor=None, tune_batches=8,
+                         manifest=None):
+    """
+    :param num_workers: DataLoader worker 数量；'auto' 时预热测量，选择样本/秒最高的 worker 数量和预取深度
+                        （见 datasets/loader_tuning.py）
+    :param persistent_workers: epoch 之间保留 worker，不再每个 epoch 重新创建
+    :param prefetch_factor: 每个 worker 预先读取的 batch 数量，为 None 时使用 DataLoader 的默认值；num_workers='auto' 时自动选择
+    :param tune_batches: num_workers='auto' 时每组参数计时读取的 batch 数量
+    :param decode_threads: 每个 worker 内读取四个模态的线程数量，'auto' 时根据 CPU 核数和 num_workers 分配，
+                           保证 worker 数量 * 线程数量不超过 CPU 核数
+    :param level: 'patient' 每个样本为一个患者的全部切片；'slice' 每个样本为一个切片，此时 batch_size 即每个 step 的切片数量；
+                  'stream' 与 'slice' 相同，但以 IterableDataset 流式读取患者，不需要缓存或打包文件
+    :param shuffle_buffer: 'stream' 的随机缓冲区大小（切片数量）
+    :param foreground_index: 前景索引文件（见 utils/build_foreground_index.py），仅切片级数据集使用，
+                             使用 InformativeSliceSampler 跳过或降低空切片的采样权重
+    :param foreground_threshold: 前景比例低于该值的切片视为空切片
+    :param empty_weight: 空切片的相对采样权重，0 时跳过
+    :param worker_flip: 是否在 worker 中随机翻转，见 Dataset_brats
+    :param manifest: 数据集清单，见 Dataset_brats
+    """
     is_shuffle = False
     if mode == 'train':
         is_shuffle = True
-    dataset = Dataset_brats(root_dir=root_dir, slice_deep=slice_deep, slice_size=slice_size,
+    auto_threads = decode_threads == 'auto'
+    if auto_threads:
+        # num_workers 也为 'auto' 时先按一个 worker 分配，选定 worker 数量后重新分配
+        decode_threads = decode_thread_count(1 if num_workers == 'auto' else num_workers)
+    if level == 'patient':
+        dataset_class = Dataset_brats
+    elif level == 'slice':
+        # 避免循环导入
+        from datasets.BraTsData_slice import Dataset_brats_slice
+        dataset_class = Dataset_brats_slice
+    elif level == 'stream':
+        from datasets.BraTsData_stream import Dataset_brats_stream
+        dataset_class = functools.partial(Dataset_brats_stream, shuffle_buffer=shuffle_buffer)
+        # IterableDataset 由数据集自身打乱顺序
+        is_shuffle = False
+    else:
+        raise ValueError(f"Invalid level: {level}. Expected one of: 'patient', 'slice', 'stream'")
+    dataset = dataset_class(root_dir=root_dir, slice_deep=slice_deep, slice_size=slice_size,
                             binary_mask=binary_mask, mask_kernel_size=mask_kernel_size, mask_rate=mask_rate,
-                            mode=mode, concat_method=concat_method, is_random=is_random)
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=is_shuffle,
-                            num_workers=num_workers, pin_memory=True)
+                            mode=mode, concat_method=concat_method, is_random=is_random,
+                            cache_dir=cache_dir, cache_dtype=cache_dtype, list_dir=list_dir, packed_file=packed_file,
+                            reader=reader, reader_index_dir=reader_index_dir,
+                            stats_file=stats_file, norm_method=norm_method, norm_dtype=norm_dtype,
+                            decode_threads=decode_threads, sample_dtype=sample_dtype, mask_transport=mask_transport,
+                            mask_bank=mask_bank, shared_cache_mb=shared_cache_mb, worker_flip=worker_flip,
+                            manifest=manifest)
+    sampler = None
+    if foreground_index is not None:
+        if level != 'slice':
+            raise ValueError("foreground_index requires level='slice'")
+        foreground = load_foreground_index(foreground_index, dataset.patients, slice_deep)
+        sampler = InformativeSliceSampler(foreground, foreground_threshold, empty_weight, shuffle=is_shuffle)
+        is_shuffle = False
+    loader_kwargs = dict(batch_size=batch_size, shuffle=is_shuffle, sampler=sampler, pin_memory=True)
+    if num_workers == 'auto':
+        num_workers, prefetch_factor = tune_dataloader(dataset, tune_batches, **loader_kwargs)
+        if auto_threads:
+            dataset.decode_threads = decode_thread_count(num_workers)
+    if num_workers == 0:
+        # 不使用 worker 时 DataLoader 不接受这两个参数
+        persistent_workers, prefetch_factor = False, None
+    dataloader = DataLoader(dataset, num_workers=num_workers, persistent_workers=persistent_workers,
+                            prefetch_factor=prefetch_factor, **loader_kwargs)
     return dataloader
+
+
+def decode_thread_count(num_workers):
+    """
+    根据 CPU 核数和 worker 数量分配每个 worker 内的读取线程数量，保证 worker 数量 * 线程数量不超过 CPU 核数。
+    """
+    return max(1, min(len(MODALITIES), (os.cpu_count() or 1) // max(1, num_workers)))
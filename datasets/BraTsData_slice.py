@@ -0,0 +1,55 @@
+"""
+切片级数据集
+以 (患者, 切片) 为索引，每个样本是一个切片的四个模态，DataLoader 的一个 batch 即为训练的一个 step，
+同一个 step 中可以包含来自不同患者的切片。
+切片从预处理缓存的内存映射文件或打包文件中读取，不需要把整个患者的数据读入内存，
+因此必须设置 cache_dir、packed_file 或 shared_cache_mb 之一。
+"""
+import os
+
+import numpy as np
+
+from datasets.BraTsData_person import Dataset_brats, MODALITIES
+
+
+class Dataset_brats_slice(Dataset_brats):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.cache is None and self.store is None and self.shared_cache is None:
+            raise ValueError("Slice-level dataset requires cache_dir, packed_file or shared_cache_mb")
+        # 每个 worker 内缓存已打开的内存映射，避免重复打开文件
+        self.volumes = {}
+
+    def __len__(self):
+        return len(self.patients) * self.slice_deep
+
+    def __getitem__(self, idx):
+        """
+        根据索引idx获取一个切片。
+        :return: 遮蔽后图像X和原始图像y，'channels' 为 (4, H, W)，'plane' 为 (1, 2H, 2W)；
+                 mask_transport='block' 时X为块级别掩码 (4, grid, grid)，'device' 时X为空的占位张量
+        """
+        patient_index, slice_index = divmod(idx, self.slice_deep)
+        volumes = self.load_slice(patient_index, slice_index)
+        return self.slice_sample(volumes, idx)
+
+    def load_slice(self, patient_index, slice_index):
+        """
+        读取一个切片的四个模态。
+        :return: 按 MODALITIES 顺序排列的图像，每个形状为 (1, slice_size, slice_size)
+        """
+        patient_path = self.patients[patient_index]
+        if self.shared_cache is not None:
+            volumes = self.shared_cache.get(patient_index, slice(slice_index, slice_index + 1))
+            if volumes is None:
+                # 未命中时读取整个患者并写入共享内存缓存，同一患者的其他切片随后都会命中
+                volumes = [volume[slice_index:slice_index + 1] for volume in self.load_patient(patient_path)]
+            return volumes
+        if self.store is not None:
+            name = os.path.basename(patient_path)
+            return [self.store.read_slice(name, slice_index, modality)[np.newaxis] for modality in MODALITIES]
+
+        if patient_index not in self.volumes:
+            # 第一次读取该患者时填充缓存，之后均为内存映射
+            self.volumes[patient_index] = self.load_patient(patient_path)
+        return [volume[slice_index:slice_index + 1] for volume in self.volumes[patient_index]]
@@ -0,0 +1,72 @@
+"""
+流式切片数据集
+不需要任何预处理（缓存、打包文件）即可运行，适用于缓存放不下的完整训练集。
+- 每个 epoch 所有 worker 使用相同的患者顺序，按 worker 编号交错分片，每个患者只由一个 worker 读取
+- 读取一个患者后逐个切片组成样本，放入大小固定的随机缓冲区，缓冲区满后随机取出一个样本，
+  DataLoader 按 step_slice 组成的 batch 因此混合了多个患者的切片
+- 内存占用为一个患者的图像加上缓冲区中的样本，缓冲区大小与 slice_deep 无关
+非训练模式不打乱，按患者、切片的顺序依次输出。
+"""
+import random
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+from datasets.BraTsData_person import Dataset_brats
+
+
+class Dataset_brats_stream(Dataset_brats, IterableDataset):
+    def __init__(self, *args, shuffle_buffer=256, **kwargs):
+        """
+        :param shuffle_buffer: 随机缓冲区中的样本数量
+        其余参数与 Dataset_brats 相同
+        """
+        super().__init__(*args, **kwargs)
+        self.shuffle = self.mode == 'train'
+        self.shuffle_buffer = shuffle_buffer
+        # 当前进程中的迭代次数，persistent_workers 时 worker 的种子不再变化，由迭代次数区分不同的 epoch
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.patients) * self.slice_deep
+
+    def patient_order(self):
+        """
+        当前 worker 负责的患者索引。
+        DataLoader 每个 epoch 为 worker 生成的种子为 base_seed + worker_id，所有 worker 由 base_seed 得到相同的患者顺序。
+        persistent_workers 时各 worker 的迭代次数相同，与 base_seed 一起决定每个 epoch 的顺序。
+        """
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        order = np.arange(len(self.patients))
+        if self.shuffle:
+            base_seed = random.getrandbits(64) if worker_info is None else worker_info.seed - worker_info.id
+            order = np.random.default_rng((base_seed, self.epoch)).permutation(order)
+        return order[worker_id::num_workers]
+
+    def iter_slices(self):
+        """
+        依次读取当前 worker 负责的患者，逐个切片生成样本。
+        """
+        for patient_index in self.patient_order():
+            volumes = self.load_patient(self.patients[patient_index])
+            for slice_index in range(self.slice_deep):
+                yield self.slice_sample([volume[slice_index:slice_index + 1] for volume in volumes],
+                                        patient_index * self.slice_deep + slice_index)
+
+    def __iter__(self):
+        self.epoch += 1
+        if not self.shuffle:
+            yield from self.iter_slices()
+            return
+
+        buffer = []
+        for sample in self.iter_slices():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            index = random.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = sample
+        random.shuffle(buffer)
+        yield from buffer
@@ -0,0 +1,83 @@
+"""
+预处理结果的磁盘缓存
+每个患者、每个模态的归一化+剪裁后的体数据保存为一个 .npy 文件，后续 epoch 通过 np.load(mmap_mode='r') 直接映射读取，
+省去 .nii.gz 解压、归一化和剪裁的重复计算。
+缓存目录结构如下
+cache_dir
+|--96_192_p99_n32_float32            (由 slice_deep、slice_size、归一化设置和存储精度组成的缓存键，
+|     |                                 n32 / n64 为归一化的计算精度 float32 / float64，
+|     |                                 只在剪裁区域上计算百分位数时为 96_192_p99_slab_n32_float32，
+|     |                                 使用直方图估计百分位数时为 96_192_p99_hist_n32_float32)
+|     |--BraTS-GLI-00000-000
+|     |     |--t1c.npy
+|     |     |--t1n.npy
+|     |     |--t2w.npy
+|     |     |--t2f.npy
+...
+使用数据集清单（见 datasets/manifest.py）时文件名包含原始文件的内容指纹，例如 t1c.3f2a9c0d1e4b5a67.npy，
+原始文件变化后旧的缓存项不再命中，写入新的缓存项时删除同一模态的旧文件。
+"""
+import glob
+import os
+import uuid
+
+import numpy as np
+
+
+class VolumeCache:
+    def __init__(self, cache_dir, slice_deep, slice_size, percentile=99, dtype='float32', scope='volume',
+                 method='partition', norm_dtype='float32'):
+        """
+        初始化缓存，缓存键由剪裁参数和归一化设置决定，任意参数变化都会使用新的子目录。
+        :param cache_dir: 缓存根目录
+        :param slice_deep: 剪裁后的切片数量
+        :param slice_size: 剪裁后的高度、宽度
+        :param percentile: 归一化使用的百分位数
+        :param dtype: 存储精度，'float32' 或 'float16'
+        :param scope: 归一化百分位数的计算范围，'volume' 为完整图像，'slab' 为剪裁区域
+        :param method: 百分位数的计算方法，近似方法 'histogram' 使用单独的缓存键
+        :param norm_dtype: 归一化的计算精度，'float32' 或 'float64'
+        """
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"Unsupported cache dtype: {dtype}. Expected 'float32' or 'float16'")
+        self.dtype = np.dtype(dtype)
+        scope_tag = '' if scope == 'volume' else f"_{scope}"
+        method_tag = '_hist' if method == 'histogram' else ''
+        norm_tag = f"_n{np.dtype(norm_dtype).itemsize * 8}"
+        self.key = f"{slice_deep}_{slice_size}_p{percentile}{scope_tag}{method_tag}{norm_tag}_{dtype}"
+        self.root = os.path.join(cache_dir, self.key)
+
+    def entry_path(self, patient_path, modality, fingerprint=None):
+        name = f"{modality}.{fingerprint[:16]}.npy" if fingerprint else f"{modality}.npy"
+        return os.path.join(self.root, os.path.basename(patient_path), name)
+
+    def load(self, patient_path, modality, fingerprint=None):
+        """
+        读取缓存项，未命中时返回 None。
+        :param fingerprint: 原始文件的内容指纹，为 None 时不检查
+        :return: 只读的内存映射数组
+        """
+        try:
+            return np.load(self.entry_path(patient_path, modality, fingerprint), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+    def save(self, patient_path, modality, volume, fingerprint=None):
+        """
+        写入缓存项。先写入临时文件再原子替换，多个 DataLoader worker 同时写入同一项时也不会读到不完整的文件。
+        :return: 写入后的内存映射数组
+        """
+        path = self.entry_path(patient_path, modality, fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(volume, dtype=self.dtype))
+        os.replace(tmp_path, path)
+        if fingerprint:
+            # 原始文件变化前的缓存项已经失效
+            for stale in glob.glob(os.path.join(os.path.dirname(path), f"{modality}.*.npy")):
+                if stale != path and not stale.endswith('.tmp.npy'):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+        return np.load(path, mmap_mode='r')
@@ -0,0 +1,127 @@
+"""
+DataLoader 参数的自动选择
+num_workers='auto' 时在当前机器和当前缓存状态下做一次短暂的预热测量，选择样本/秒最高的 worker 数量和预取深度。
+- 先以 prefetch_factor=2 依次测量 1、2、4 ... 个 worker（不超过 CPU 核数），吞吐量提升不足 min_gain 时停止增加
+- 再测量 num_workers=0（在主进程中读取），比选出的 worker 数量高出 min_gain 时使用 0（例如单核机器）
+- 最后对选出的 worker 数量测量不同的 prefetch_factor
+所有候选读取同一组固定的样本（按数据集的采样方式预先选出，按相同的顺序读取），
+测量前先不计时地完整读取一次，填充磁盘缓存和共享内存缓存，各候选的比较不受读取了哪些患者、缓存是否命中的影响。
+每个候选丢弃第一个 batch（包含创建 worker 的时间），之后计时读取 tune_batches 个 batch。
+IterableDataset（'stream'）不能按索引读取，直接测量完整的数据集。
+"""
+import os
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader, IterableDataset, Subset
+
+
+def worker_candidates(max_workers=None):
+    """
+    :return: 1、2、4 ... 直到 max_workers（默认 CPU 核数），包含 max_workers 本身；0 由 tune_dataloader 单独测量
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    candidates = []
+    num = 1
+    while num < max_workers:
+        candidates.append(num)
+        num *= 2
+    candidates.append(max_workers)
+    return candidates
+
+
+def measure_throughput(dataset, num_workers, prefetch_factor, tune_batches=8, **loader_kwargs):
+    """
+    测量一组 DataLoader 参数的吞吐量。
+    :param loader_kwargs: 传递给 DataLoader 的其余参数（batch_size、shuffle、sampler 等）
+    :return: 样本/秒，数据不足两个 batch 时返回 0
+    """
+    # 不使用 worker 时 DataLoader 不接受 prefetch_factor
+    loader = DataLoader(dataset, num_workers=num_workers, prefetch_factor=prefetch_factor if num_workers else None,
+                        **loader_kwargs)
+    # worker 数量较多时首批 batch 几乎同时到达，至少读取每个 worker 两个 batch
+    num_batches = max(tune_batches, 2 * num_workers)
+    samples = 0
+    start = None
+    for i, (_, original_images) in enumerate(loader):
+        if i == 0:
+            start = time.perf_counter()
+            continue
+        samples += original_images.shape[0]
+        if i >= num_batches:
+            break
+    elapsed = time.perf_counter() - start if start is not None else 0
+    # 提前结束迭代，关闭 worker
+    del loader
+    return samples / elapsed if samples and elapsed > 0 else 0.0
+
+
+def tuning_subset(dataset, num_samples, sampler=None, shuffle=False, seed=0):
+    """
+    选出所有候选共同读取的固定样本。
+    :param num_samples: 样本数量，不超过数据集（或采样器）的样本数量
+    :param sampler: 数据集使用的采样器，不为 None 时取其一个 epoch 的前 num_samples 个索引
+    :param shuffle: 没有采样器时是否随机选择样本，与训练时读取的患者分布一致
+    :return: torch.utils.data.Subset
+    """
+    if sampler is not None:
+        indices = list(sampler)[:num_samples]
+    elif shuffle:
+        indices = np.random.default_rng(seed).permutation(len(dataset))[:num_samples].tolist()
+    else:
+        indices = list(range(min(num_samples, len(dataset))))
+    return Subset(dataset, indices)
+
+
+def tune_dataloader(dataset, tune_batches=8, max_workers=None, prefetch_factors=(2, 4, 8), min_gain=0.05,
+                    log=print, **loader_kwargs):
+    """
+    预热测量并选择 worker 数量和预取深度。
+    :param dataset: 数据集
+    :param tune_batches: 每个候选计时读取的 batch 数量
+    :param max_workers: worker 数量的上限，默认为 CPU 核数
+    :param prefetch_factors: 预取深度的候选
+    :param min_gain: 增加 worker 后吞吐量的相对提升低于该值时停止增加
+    :param log: 输出每个候选测量结果的函数，为 None 时不输出
+    :return: (num_workers, prefetch_factor)
+    """
+    candidates = worker_candidates(max_workers)
+    warmup_batches = tune_batches
+    if not isinstance(dataset, IterableDataset):
+        # 覆盖最大候选读取的 batch 数量（丢弃的第一个 batch 加上计时的 batch），按固定顺序读取
+        batch_size = loader_kwargs.get('batch_size') or 1
+        num_batches = max(tune_batches, 2 * candidates[-1]) + 1
+        dataset = tuning_subset(dataset, num_batches * batch_size, loader_kwargs.get('sampler'),
+                                loader_kwargs.get('shuffle', False))
+        loader_kwargs = dict(loader_kwargs, shuffle=False, sampler=None)
+        warmup_batches = num_batches
+
+    def measure(num_workers, prefetch_factor):
+        throughput = measure_throughput(dataset, num_workers, prefetch_factor, tune_batches, **loader_kwargs)
+        if log is not None:
+            log(f"DataLoader warm-up: num_workers={num_workers}, prefetch_factor={prefetch_factor}: "
+                f"{throughput:.1f} samples/s")
+        return throughput
+
+    # 第一次读取会填充缓存，不计入比较
+    measure_throughput(dataset, 0, None, warmup_batches, **loader_kwargs)
+    best_workers, best_throughput = None, 0.0
+    for num_workers in candidates:
+        throughput = measure(num_workers, 2)
+        if best_workers is not None and throughput < best_throughput * (1 + min_gain):
+            break
+        best_workers, best_throughput = num_workers, throughput
+
+    # 主进程读取没有进程间传输的开销，CPU 核数很少时可能更快
+    throughput = measure(0, None)
+    if throughput > best_throughput * (1 + min_gain):
+        return 0, None
+
+    best_prefetch = 2
+    for prefetch_factor in prefetch_factors:
+        if prefetch_factor == 2:
+            continue
+        throughput = measure(best_workers, prefetch_factor)
+        if throughput > best_throughput * (1 + min_gain):
+            best_prefetch, best_throughput = prefetch_factor, throughput
+    return best_workers, best_prefetch
@@ -0,0 +1,177 @@
+"""
+数据集清单
+扫描 data/raw/<数据集目录> 下所有患者，每个患者、每个文件（四个模态和分割掩码）记录一行，保存为 csv 或 parquet 列式文件：
+patient, modality, path, exists, size, mtime_ns, shape, spacing, dtype, min, max, mean, std, foreground,
+percentile, max_val, fingerprint, error
+- fingerprint: .nii.gz 文件内容的 blake2b 摘要（128 位），文件内容变化时改变，与修改时间无关
+- error: 文件缺失或无法解码时的错误信息，正常时为空
+- 按进程池并行扫描；已有清单时只重新读取大小或修改时间变化的文件
+划分文件（train.csv 等）中的患者名即清单中的 patient 列。Dataset_brats 使用清单时在开始训练前检查缺失或损坏的文件，
+并将指纹加入预处理缓存的文件名，原始文件变化后只有对应的缓存项失效。
+"""
+import hashlib
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+
+from datasets.normalization import compute_percentile
+
+MANIFEST_COLUMNS = ('patient', 'modality', 'path', 'exists', 'size', 'mtime_ns', 'shape', 'spacing', 'dtype',
+                    'min', 'max', 'mean', 'std', 'foreground', 'percentile', 'max_val', 'fingerprint', 'error')
+
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    """
+    计算文件内容的 blake2b 摘要，同时检查 gzip 数据流是否完整。
+    SimpleITK 读取截断的 .nii.gz 时不会报错，缺少的部分填充为 0，因此需要单独检查。
+    :return: (摘要, 解压后的字节数, gzip 数据流是否完整)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    decompressor = zlib.decompressobj(wbits=31)
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            while chunk:
+                size += len(decompressor.decompress(chunk))
+                # 多个 gzip 成员首尾相接时继续解压下一个成员
+                chunk = decompressor.unused_data if decompressor.eof else b''
+                if chunk:
+                    decompressor = zlib.decompressobj(wbits=31)
+    return digest.hexdigest(), size, decompressor.eof
+
+
+def _scan_file(directory, modality, percentile):
+    name = os.path.basename(directory)
+    path = os.path.join(directory, f"{name}-{modality}.nii.gz")
+    row = {'patient': name, 'modality': modality, 'path': path, 'exists': os.path.exists(path),
+           'percentile': percentile, 'error': ''}
+    if not row['exists']:
+        row['error'] = 'missing'
+        return row
+    stat = os.stat(path)
+    row.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    try:
+        row['fingerprint'], decompressed, complete = file_fingerprint(path)
+        if not complete:
+            raise EOFError("truncated gzip stream")
+        image = sitk.ReadImage(path)
+        array = sitk.GetArrayViewFromImage(image)
+        if decompressed < array.nbytes:
+            raise EOFError(f"{decompressed} bytes of image data, expected at least {array.nbytes}")
+        row.update(shape='x'.join(map(str, array.shape)),
+                   spacing='x'.join(f"{value:g}" for value in image.GetSpacing()[::-1]),
+                   dtype=str(array.dtype),
+                   min=float(array.min()), max=float(array.max()),
+                   mean=float(array.mean()), std=float(array.std()),
+                   foreground=int(np.count_nonzero(array > 0)),
+                   max_val=compute_percentile(array, percentile))
+    except Exception as e:
+        # gzip 截断、头信息损坏等
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def _scan_patient(args):
+    directory, modalities, percentile, previous = args
+    rows = []
+    for modality in modalities:
+        old = previous.get(modality)
+        path = os.path.join(directory, f"{os.path.basename(directory)}-{modality}.nii.gz")
+        if old is not None and not old['error'] and os.path.exists(path):
+            stat = os.stat(path)
+            if stat.st_size == old['size'] and stat.st_mtime_ns == old['mtime_ns']:
+                # 大小和修改时间都未变化，沿用之前的记录
+                rows.append(old)
+                continue
+        rows.append(_scan_file(directory, modality, percentile))
+    return rows
+
+
+def build_manifest(directories, output, modalities, percentile=99, workers=None, previous=None):
+    """
+    并行扫描所有患者并保存清单。
+    :param directories: 患者数据目录列表
+    :param output: 输出文件，扩展名为 .parquet 时保存为 parquet（需要 pyarrow），否则为 csv
+    :param modalities: 需要记录的文件，例如 MODALITIES + ['seg']
+    :param percentile: 记录的百分位数，与 Dataset_brats 的归一化一致
+    :param workers: 进程数量，为 None 时使用 CPU 核数
+    :param previous: 之前的清单文件，大小和修改时间未变化的文件不再重新读取
+    :return: 清单 DataFrame
+    """
+    old_rows = {}
+    if previous is not None and os.path.exists(previous):
+        for row in read_manifest(previous).to_dict('records'):
+            old_rows.setdefault(row['patient'], {})[row['modality']] = row
+    tasks = [(directory, modalities, percentile, old_rows.get(os.path.basename(directory), {}))
+             for directory in directories]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = [row for patient_rows in executor.map(_scan_patient, tasks, chunksize=4) for row in patient_rows]
+    df = pd.DataFrame(rows, columns=list(MANIFEST_COLUMNS))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if output.endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+    return df
+
+
+def manifest_path(manifest_dir, root_dir):
+    """
+    数据集目录对应的清单文件: 优先使用 <manifest_dir>/<root_dir>.parquet，其次为 .csv
+    """
+    for extension in ('.parquet', '.csv'):
+        path = os.path.join(manifest_dir, f"{root_dir}{extension}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No manifest for {root_dir} in {manifest_dir}, "
+                            f"run python utils/build_manifest.py --root {root_dir}")
+
+
+def read_manifest(path):
+    df = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path, keep_default_na=False)
+    # csv 中缺失的数值读取为空字符串
+    for column in ('size', 'mtime_ns', 'foreground'):
+        df[column] = pd.to_numeric(df[column], errors='coerce').fillna(-1).astype(np.int64)
+    df['error'] = df['error'].fillna('').astype(str)
+    df['fingerprint'] = df['fingerprint'].fillna('').astype(str)
+    return df
+
+
+class DatasetManifest:
+    def __init__(self, path):
+        """
+        读取 build_manifest 生成的清单。
+        """
+        self.path = path
+        df = read_manifest(path)
+        self.entries = {(row['patient'], row['modality']): row for row in df.to_dict('records')}
+
+    def get(self, patient, modality):
+        """
+        :return: 清单中的记录，不存在时返回 None
+        """
+        return self.entries.get((patient, modality))
+
+    def fingerprint(self, patient, modality):
+        entry = self.get(patient, modality)
+        return entry['fingerprint'] if entry is not None and entry['fingerprint'] else None
+
+    def problems(self, patients, modalities):
+        """
+        检查患者的文件是否都在清单中且可以正常读取。
+        :return: [(患者名, 模态, 问题)]，没有问题时为空列表
+        """
+        problems = []
+        for patient in patients:
+            for modality in modalities:
+                entry = self.get(patient, modality)
+                if entry is None:
+                    problems.append((patient, modality, 'not in manifest'))
+                elif entry['error']:
+                    problems.append((patient, modality, entry['error']))
+        return problems
@@ -0,0 +1,140 @@
+"""
+强度归一化
+将每个模态的强度裁剪到 [0, 第99百分位数] 并缩放到 [0, 1]。
+- 百分位数的计算方法:
+  numpy:      np.percentile，完整排序
+  partition:  np.partition 选择第 k 小的元素，结果与 np.percentile（线性插值）一致，复杂度为 O(n)
+  histogram:  直方图估计，只需遍历两次，结果为近似值
+- 统计索引: 每个患者、每个模态的百分位数、最小值、最大值和前景（>0）体素数量只计算一次，保存为 csv 文件，
+  Dataset_brats 直接读取保存的百分位数，不再重复计算。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import SimpleITK as sitk
+
+PERCENTILE_METHODS = ('numpy', 'partition', 'histogram')
+
+
+def percentile_partition(image, q):
+    """
+    使用 np.partition 计算百分位数，与 np.percentile 的线性插值结果一致。
+    """
+    values = np.ravel(image)
+    position = (values.size - 1) * q / 100
+    lower = int(np.floor(position))
+    upper = min(lower + 1, values.size - 1)
+    partitioned = np.partition(values, [lower, upper])
+    lower_value = float(partitioned[lower])
+    return lower_value + (float(partitioned[upper]) - lower_value) * (position - lower)
+
+
+def percentile_histogram(image, q, bins=4096):
+    """
+    使用直方图估计百分位数，误差不超过一个直方图区间的宽度。
+    """
+    values = np.ravel(image)
+    low, high = float(values.min()), float(values.max())
+    if low == high:
+        return low
+    counts, edges = np.histogram(values, bins=bins, range=(low, high))
+    cumulative = np.cumsum(counts)
+    target = q / 100 * values.size
+    index = min(int(np.searchsorted(cumulative, target)), bins - 1)
+    # 在区间内线性插值
+    previous = cumulative[index - 1] if index > 0 else 0
+    fraction = (target - previous) / counts[index] if counts[index] > 0 else 0.0
+    return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+
+
+def compute_percentile(image, q, method='partition'):
+    if method == 'numpy':
+        return np.percentile(image, q)
+    elif method == 'partition':
+        return percentile_partition(image, q)
+    elif method == 'histogram':
+        return percentile_histogram(image, q)
+    raise ValueError(f"Invalid percentile method: {method}. Expected one of: {PERCENTILE_METHODS}")
+
+
+def normalize(image, percentile=99, max_val=None, method='partition', dtype=np.float64):
+    """
+    归一化图像。
+    :param image: 输入图像
+    :param percentile: 裁剪使用的百分位数
+    :param max_val: 预先计算的百分位数值，为 None 时根据 method 计算
+    :param method: 百分位数的计算方法，见 PERCENTILE_METHODS
+    :param dtype: 计算和输出的精度，np.float32 可以减少一半的内存和计算量
+    :return: 归一化后的图像
+    """
+    image = np.asarray(image, dtype=dtype)
+    if max_val is None:
+        max_val = compute_percentile(image, percentile, method)
+    image = np.clip(image, 0, max_val)
+    image /= image.dtype.type(max_val)
+    return image
+
+
+def volume_statistics(image, percentile=99, method='partition'):
+    """
+    计算单个模态的统计量。
+    :return: {'max_val': 百分位数, 'min': 最小值, 'max': 最大值, 'foreground': 前景体素数量}
+    """
+    return {
+        'max_val': compute_percentile(image, percentile, method),
+        'min': float(image.min()),
+        'max': float(image.max()),
+        'foreground': int(np.count_nonzero(image > 0)),
+    }
+
+
+def _patient_statistics(args):
+    directory, modalities, percentile = args
+    name = os.path.basename(directory)
+    rows = []
+    for modality in modalities:
+        image = sitk.GetArrayFromImage(sitk.ReadImage(os.path.join(directory, f"{name}-{modality}.nii.gz")))
+        rows.append({'patient': name, 'modality': modality, 'percentile': percentile,
+                     **volume_statistics(image, percentile)})
+    return rows
+
+
+def build_stats_index(directories, output, modalities, percentile=99, workers=None):
+    """
+    计算所有患者完整图像的统计量并保存为 csv 文件。
+    :param directories: 患者数据目录列表
+    :param output: 输出文件
+    :param modalities: 模态列表
+    :param workers: 进程数量，为 None 时使用 CPU 核数
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_patient_statistics, [(d, modalities, percentile) for d in directories])
+        rows = [row for patient_rows in results for row in patient_rows]
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    pd.DataFrame(rows).to_csv(output, index=False)
+    return output
+
+
+class VolumeStatsIndex:
+    def __init__(self, path, percentile=99):
+        """
+        读取统计索引。
+        :param path: build_stats_index 生成的 csv 文件
+        :param percentile: Dataset 使用的百分位数，与索引中的不一致时报错
+        """
+        df = pd.read_csv(path)
+        if not (df['percentile'] == percentile).all():
+            raise ValueError(f"Stats index {path} was not computed with percentile={percentile}")
+        self.stats = {(row.patient, row.modality): row._asdict() for row in df.itertuples(index=False)}
+
+    def get(self, patient, modality):
+        """
+        :return: 统计量字典，索引中不存在时返回 None
+        """
+        return self.stats.get((patient, modality))
+
+    def max_val(self, patient, modality):
+        stats = self.get(patient, modality)
+        return None if stats is None else stats['max_val']
@@ -0,0 +1,162 @@
+"""
+单文件分块数据存储
+将一个数据划分（train/valid/test）中所有患者归一化、剪裁后的图像打包成一个文件，避免在共享存储上读取大量小的 .gz 文件。
+每个 (患者, 切片, 模态) 为一个独立压缩的数据块，任意切片的随机读取只需一次定位读取（os.pread）。
+文件结构如下
+|--文件头   MAGIC(8字节) + 索引偏移(8字节) + 索引长度(8字节)
+|--数据块   按 患者 -> 切片 -> 模态 的顺序依次存放的 zlib 压缩数据
+|--索引     JSON，记录剪裁和归一化参数、患者名称以及每个数据块的偏移和长度
+归一化参数（百分位数、范围 volume/slab、计算方法、计算精度、是否使用统计索引）与训练配置不一致时 Dataset_brats 报错。
+同一患者的所有数据块是连续存放的，读取整个患者同样只需一次读取。
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'3MSPACK1'
+HEADER = struct.Struct('<8sQQ')
+# 索引中记录的归一化参数
+NORMALIZATION_KEYS = ('percentile', 'norm_scope', 'norm_method', 'norm_dtype', 'stats')
+
+
+def packed_path(packed_dir, list_dir, mode):
+    """
+    根据划分目录和模式得到打包文件的路径，例如 data/packed/pre-test-50_train.pack
+    """
+    return os.path.join(packed_dir, f"{os.path.basename(os.path.normpath(list_dir))}_{mode}.pack")
+
+
+class PackedStoreWriter:
+    def __init__(self, path, slice_deep, slice_size, modalities, percentile=99, dtype='float32', level=1,
+                 norm_scope='volume', norm_method='partition', norm_dtype='float32', stats=False):
+        """
+        :param path: 输出文件路径
+        :param modalities: 模态顺序
+        :param percentile: 归一化使用的百分位数，仅记录在索引中
+        :param norm_scope: 百分位数的计算范围，'volume'（完整图像）或 'slab'（剪裁区域），仅记录在索引中
+        :param norm_method: 百分位数的计算方法，仅记录在索引中
+        :param norm_dtype: 归一化的计算精度，仅记录在索引中
+        :param stats: 是否使用统计索引提供的百分位数，仅记录在索引中
+        :param dtype: 存储精度，'float32' 或 'float16'
+        :param level: zlib 压缩等级，等级越低解压越快
+        """
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.level = level
+        self.index = {
+            'slice_deep': slice_deep,
+            'slice_size': slice_size,
+            'modalities': list(modalities),
+            'percentile': percentile,
+            'norm_scope': norm_scope,
+            'norm_method': norm_method,
+            'norm_dtype': str(np.dtype(norm_dtype)),
+            'stats': bool(stats),
+            'dtype': dtype,
+            'patients': [],
+            'offsets': [],
+            'lengths': [],
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(self.tmp_path, 'wb')
+        # 预留文件头，索引写完后回填
+        self.file.write(HEADER.pack(MAGIC, 0, 0))
+
+    def add_patient(self, name, volumes):
+        """
+        写入一个患者的数据。
+        :param name: 患者名称
+        :param volumes: 按模态顺序排列的图像，每个形状为 (slice_deep, slice_size, slice_size)
+        """
+        dtype = np.dtype(self.index['dtype'])
+        volumes = [np.asarray(v, dtype=dtype) for v in volumes]
+        for slice_index in range(self.index['slice_deep']):
+            for volume in volumes:
+                chunk = zlib.compress(np.ascontiguousarray(volume[slice_index]).tobytes(), self.level)
+                self.index['offsets'].append(self.file.tell())
+                self.index['lengths'].append(len(chunk))
+                self.file.write(chunk)
+        self.index['patients'].append(name)
+
+    def close(self):
+        index_offset = self.file.tell()
+        index_bytes = json.dumps(self.index).encode('utf-8')
+        self.file.write(index_bytes)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, index_offset, len(index_bytes)))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class PackedStore:
+    def __init__(self, path):
+        """
+        打开打包文件并读取索引。文件描述符在第一次读取时才打开，因此可以安全地传递给 DataLoader 的子进程。
+        """
+        self.path = path
+        self.fd = None
+        with open(path, 'rb') as f:
+            magic, index_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not a packed dataset file: {path}")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode('utf-8'))
+        self.slice_deep = index['slice_deep']
+        self.slice_size = index['slice_size']
+        self.modalities = index['modalities']
+        self.percentile = index['percentile']
+        # 旧版本的打包文件没有记录归一化参数，为 None
+        self.normalization = {key: index.get(key) for key in NORMALIZATION_KEYS}
+        self.dtype = np.dtype(index['dtype'])
+        self.patients = {name: i for i, name in enumerate(index['patients'])}
+        self.offsets = np.asarray(index['offsets'], dtype=np.int64)
+        self.lengths = np.asarray(index['lengths'], dtype=np.int64)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['fd'] = None
+        return state
+
+    def _pread(self, offset, length):
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        return os.pread(self.fd, int(length), int(offset))
+
+    def _chunk_id(self, patient, slice_index, modality_index):
+        return (self.patients[patient] * self.slice_deep + slice_index) * len(self.modalities) + modality_index
+
+    def _decode(self, data):
+        return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(self.slice_size, self.slice_size)
+
+    def read_slice(self, patient, slice_index, modality):
+        """
+        读取单个切片，一次定位读取。
+        :return: 形状为 (slice_size, slice_size) 的图像
+        """
+        chunk_id = self._chunk_id(patient, slice_index, self.modalities.index(modality))
+        return self._decode(self._pread(self.offsets[chunk_id], self.lengths[chunk_id]))
+
+    def read_patient(self, patient):
+        """
+        读取一个患者的全部模态，同一患者的数据块连续存放，只需一次读取。
+        :return: 按模态顺序排列的图像列表，每个形状为 (slice_deep, slice_size, slice_size)
+        """
+        first = self._chunk_id(patient, 0, 0)
+        last = first + self.slice_deep * len(self.modalities)
+        start = self.offsets[first]
+        data = memoryview(self._pread(start, self.offsets[last - 1] + self.lengths[last - 1] - start))
+
+        volumes = np.empty((len(self.modalities), self.slice_deep, self.slice_size, self.slice_size), dtype=self.dtype)
+        for chunk_id in range(first, last):
+            slice_index, modality_index = divmod(chunk_id - first, len(self.modalities))
+            begin = self.offsets[chunk_id] - start
+            volumes[modality_index, slice_index] = self._decode(data[begin:begin + self.lengths[chunk_id]])
+        return list(volumes)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,210 @@
+"""
+NIfTI 读取后端
+resize_and_crop 只保留中心 slice_deep 张切片和中心 slice_size*slice_size 的区域，大部分解码出来的体素都会被丢弃。
+这里的读取后端都可以只读取需要的区域（slab）：
+- sitk:          SimpleITK 读取完整图像后剪裁，与原来的 read_image 完全一致
+- sitk_region:   SimpleITK ImageFileReader 只提取需要的区域
+- nibabel:       nibabel 代理数组切片，gzip 只解压到区域结束的位置
+- indexed_gzip:  indexed_gzip 随机访问，只解压区域所在的数据，索引可以保存下来供后续 epoch 直接跳转
+所有后端返回的数组形状均为 (depth, height, width)，与 sitk.GetArrayFromImage 的顺序一致。
+benchmark_readers / select_fastest_reader 在当前机器上测量各后端的速度并选择最快的后端。
+只有 sitk 读取完整图像（full_volume），没有统计索引时其他后端的百分位数只能在剪裁区域上计算，归一化结果不同，
+因此自动选择只能在归一化范围相同的后端之间进行。
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import SimpleITK as sitk
+
+try:
+    import nibabel as nib
+except ImportError:
+    nib = None
+
+try:
+    import indexed_gzip as igzip
+except ImportError:
+    igzip = None
+
+
+def crop_region(shape, slice_deep, slice_size):
+    """
+    计算与 resize_and_crop 相同的剪裁区域。
+    :param shape: 图像形状 (depth, height, width)
+    :return: (start_d, end_d, start_h, end_h, start_w, end_w)
+    """
+    depth, height, width = shape
+    center_d = depth // 2
+    start_d = max(center_d - slice_deep // 2, 0)
+    # resize_and_crop 中高度和宽度使用相同的起点
+    start_size = max((height - slice_size) // 2, 0)
+    return (start_d, min(start_d + slice_deep, depth),
+            start_size, min(start_size + slice_size, height),
+            start_size, min(start_size + slice_size, width))
+
+
+class NiftiReader(ABC):
+    name = None
+    # 是否读取完整图像，决定没有统计索引时百分位数的计算范围
+    full_volume = False
+
+    def read(self, path):
+        """
+        读取完整图像。
+        """
+        return sitk.GetArrayFromImage(sitk.ReadImage(path))
+
+    @abstractmethod
+    def read_slab(self, path, slice_deep, slice_size):
+        """
+        只读取剪裁区域。
+        :return: 形状为 (slice_deep, slice_size, slice_size) 的图像
+        """
+
+
+class SitkReader(NiftiReader):
+    name = 'sitk'
+    full_volume = True
+
+    def read_slab(self, path, slice_deep, slice_size):
+        image = self.read(path)
+        start_d, end_d, start_h, end_h, start_w, end_w = crop_region(image.shape, slice_deep, slice_size)
+        return image[start_d:end_d, start_h:end_h, start_w:end_w]
+
+
+class SitkRegionReader(NiftiReader):
+    name = 'sitk_region'
+
+    def read_slab(self, path, slice_deep, slice_size):
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(path)
+        reader.ReadImageInformation()
+        # SimpleITK 的尺寸顺序为 (width, height, depth)
+        width, height, depth = reader.GetSize()
+        start_d, end_d, start_h, end_h, start_w, end_w = crop_region((depth, height, width), slice_deep, slice_size)
+        reader.SetExtractIndex([start_w, start_h, start_d])
+        reader.SetExtractSize([end_w - start_w, end_h - start_h, end_d - start_d])
+        return sitk.GetArrayFromImage(reader.Execute())
+
+
+class NibabelReader(NiftiReader):
+    name = 'nibabel'
+
+    def read_slab(self, path, slice_deep, slice_size):
+        proxy = nib.load(path).dataobj
+        # nibabel 的顺序为 (width, height, depth)
+        width, height, depth = proxy.shape[:3]
+        start_d, end_d, start_h, end_h, start_w, end_w = crop_region((depth, height, width), slice_deep, slice_size)
+        slab = np.asanyarray(proxy[start_w:end_w, start_h:end_h, start_d:end_d])
+        if slab.dtype.kind == 'f':
+            # 有 slope / inter 时 nibabel 缩放后为 float64，与其他后端一致保持 float32
+            slab = slab.astype(np.float32, copy=False)
+        return np.ascontiguousarray(slab.transpose(2, 1, 0))
+
+
+class IndexedGzipReader(NiftiReader):
+    name = 'indexed_gzip'
+
+    def __init__(self, index_dir=None, spacing=1024 * 1024):
+        """
+        :param index_dir: 保存 gzip 索引的目录，为 None 时不保存，每次打开文件都需要重新建立索引
+        :param spacing: 索引点之间的间隔（字节）
+        """
+        self.index_dir = index_dir
+        self.spacing = spacing
+
+    def index_path(self, path):
+        return os.path.join(self.index_dir, f"{os.path.basename(path)}.gzidx")
+
+    def read_slab(self, path, slice_deep, slice_size):
+        index_file = None
+        if self.index_dir is not None and os.path.exists(self.index_path(path)):
+            index_file = self.index_path(path)
+        with igzip.IndexedGzipFile(path, spacing=self.spacing, index_file=index_file) as f:
+            header = nib.Nifti1Header.from_fileobj(f)
+            width, height, depth = header.get_data_shape()[:3]
+            dtype = header.get_data_dtype()
+            start_d, end_d, start_h, end_h, start_w, end_w = crop_region((depth, height, width), slice_deep, slice_size)
+
+            # 体素按 x 最快、z 最慢的顺序存放，需要的切片范围是一段连续的数据
+            slice_bytes = width * height * dtype.itemsize
+            f.seek(int(header['vox_offset']) + start_d * slice_bytes)
+            data = f.read((end_d - start_d) * slice_bytes)
+
+            if self.index_dir is not None and index_file is None:
+                os.makedirs(self.index_dir, exist_ok=True)
+                f.export_index(self.index_path(path))
+
+        slab = np.frombuffer(data, dtype=dtype).reshape(end_d - start_d, height, width)
+        slab = slab[:, start_h:end_h, start_w:end_w]
+        slope, inter = header.get_slope_inter()
+        if slope is not None:
+            # header 中的 slope / inter 为 float64 标量，与其他后端一致保持 float32
+            slab = (slab * slope + (inter or 0)).astype(np.float32, copy=False)
+        return np.ascontiguousarray(slab)
+
+
+READERS = {
+    SitkReader.name: SitkReader,
+    SitkRegionReader.name: SitkRegionReader,
+    NibabelReader.name: NibabelReader,
+    IndexedGzipReader.name: IndexedGzipReader,
+}
+
+
+def available_readers():
+    """
+    返回当前环境中依赖已安装的后端名称。
+    """
+    names = [SitkReader.name, SitkRegionReader.name]
+    if nib is not None:
+        names.append(NibabelReader.name)
+        if igzip is not None:
+            names.append(IndexedGzipReader.name)
+    return names
+
+
+def get_reader(name, **kwargs):
+    if name not in READERS:
+        raise ValueError(f"Invalid reader: {name}. Expected one of: {list(READERS)}")
+    if name not in available_readers():
+        raise ImportError(f"Reader '{name}' requires nibabel" + (" and indexed_gzip" if name == 'indexed_gzip' else ""))
+    return READERS[name](**kwargs)
+
+
+def benchmark_readers(paths, slice_deep, slice_size, names=None, repeats=1):
+    """
+    测量各后端读取给定文件的耗时。
+    :param paths: 用于测量的 .nii.gz 文件
+    :param names: 要测量的后端，为 None 时测量所有可用后端
+    :return: {后端名称: 平均每个文件的耗时（秒）}
+    """
+    names = available_readers() if names is None else names
+    # 预先读取一次文件，避免第一个后端承担冷缓存的开销
+    for path in paths:
+        with open(path, 'rb') as f:
+            f.read()
+
+    timings = {}
+    for name in names:
+        reader = get_reader(name)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for path in paths:
+                reader.read_slab(path, slice_deep, slice_size)
+        timings[name] = (time.perf_counter() - start) / (repeats * len(paths))
+    return timings
+
+
+def select_fastest_reader(paths, slice_deep, slice_size, repeats=1, full_volume=None):
+    """
+    在当前机器上选择读取最快的后端。
+    :param full_volume: 为 True / False 时只在 full_volume 相同的后端中选择，为 None 时不限制
+    """
+    names = [name for name in available_readers() if full_volume is None or READERS[name].full_volume == full_volume]
+    if len(names) == 1:
+        return names[0]
+    timings = benchmark_readers(paths, slice_deep, slice_size, names=names, repeats=repeats)
+    return min(timings, key=timings.get)
@@ -0,0 +1,97 @@
+"""
+前景索引与信息切片采样
+中心剪裁后的切片中有相当一部分几乎全是背景，损失函数对背景的权重只有 0.01，但每个切片的前向、反向计算量相同。
+- 前景索引: 记录每个患者、每个切片、每个模态的前景比例（与 LossFunctions 相同的 y > 0 判断），保存为 .npz 文件，
+  fractions 为 (患者数, slice_deep, 4) 的前景比例，patients 为对应的患者名，加载时与数据集的患者逐个比较
+- InformativeSliceSampler: 切片级数据集的采样器，前景比例低于阈值的切片按 empty_weight 降低采样权重，empty_weight 为 0 时直接跳过
+"""
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+from tqdm import tqdm
+
+
+def foreground_path(foreground_dir, list_dir, mode, slice_deep, slice_size):
+    """
+    根据划分目录、模式和剪裁参数得到前景索引的路径，例如 data/foreground/pre-test-50_train_96_192.npz
+    """
+    name = os.path.basename(os.path.normpath(list_dir))
+    return os.path.join(foreground_dir, f"{name}_{mode}_{slice_deep}_{slice_size}.npz")
+
+
+def foreground_fractions(volumes):
+    """
+    计算每个切片、每个模态的前景比例。
+    :param volumes: 按模态顺序排列的图像，每个形状为 (slice_deep, slice_size, slice_size)
+    :return: 形状为 (slice_deep, 模态数量) 的 float32 数组
+    """
+    return np.stack([(np.asarray(volume) > 0).mean(axis=(1, 2)) for volume in volumes], axis=1).astype(np.float32)
+
+
+def build_foreground_index(dataset, output):
+    """
+    计算数据集中所有患者的前景比例并保存。
+    :param dataset: Dataset_brats，使用其 load_patient 读取归一化、剪裁后的图像（可以复用缓存或打包文件）
+    :param output: 输出的 .npz 文件
+    :return: 形状为 (患者数, slice_deep, 4) 的前景比例
+    """
+    index = np.stack([foreground_fractions(dataset.load_patient(patient_path))
+                      for patient_path in tqdm(dataset.patients, desc="Foreground index", unit="person")])
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    patients = np.array([os.path.basename(patient_path) for patient_path in dataset.patients])
+    with open(output, 'wb') as f:
+        np.savez(f, fractions=index, patients=patients)
+    return index
+
+
+def load_foreground_index(path, patients, slice_deep):
+    """
+    加载前景索引并检查是否与数据集一致，划分文件改变（患者增减或顺序变化）后需要重新生成。
+    :param patients: 数据集的患者目录列表（Dataset_brats.patients）
+    :return: 形状为 (患者数, slice_deep, 4) 的前景比例
+    """
+    with np.load(path) as index:
+        fractions, indexed = index['fractions'], index['patients'].tolist()
+    names = [os.path.basename(patient_path) for patient_path in patients]
+    if indexed != names:
+        mismatch = next((i for i, (a, b) in enumerate(zip(indexed, names)) if a != b), min(len(indexed), len(names)))
+        raise ValueError(f"Foreground index {path} was built for a different split ({len(indexed)} patients, "
+                         f"first difference at position {mismatch}), rebuild it with utils/build_foreground_index.py")
+    if fractions.shape[1] != slice_deep:
+        raise ValueError(f"Foreground index {path} has {fractions.shape[1]} slices per patient, expected {slice_deep}")
+    return fractions
+
+
+class InformativeSliceSampler(Sampler):
+    def __init__(self, foreground, threshold=0.01, empty_weight=0.0, shuffle=True, num_samples=None, seed=None):
+        """
+        切片级数据集（Dataset_brats_slice）的采样器，索引顺序为 患者 * slice_deep + 切片。
+        :param foreground: 前景索引，形状为 (患者数, slice_deep, 4)
+        :param threshold: 切片中前景比例最高的模态低于该值时视为空切片
+        :param empty_weight: 空切片相对于其他切片的采样权重，0 时跳过空切片
+        :param shuffle: 是否打乱顺序，不打乱时依次返回所有权重大于 0 的切片（验证、统计等需要完整遍历的场景）
+        :param num_samples: 打乱时每个 epoch 按权重采样的样本数量，为 None 时为采样权重之和（四舍五入）
+        :param seed: 随机种子
+        """
+        super().__init__()
+        fraction = np.asarray(foreground).max(axis=-1).reshape(-1)
+        informative = fraction >= threshold
+        self.weights = torch.from_numpy(np.where(informative, 1.0, empty_weight))
+        self.indices = torch.from_numpy(np.flatnonzero(self.weights > 0))
+        self.shuffle = shuffle
+        if num_samples is None:
+            num_samples = int(round(float(self.weights.sum())))
+        self.num_samples = max(1, min(num_samples, len(self.indices)))
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
+
+    def __len__(self):
+        return self.num_samples if self.shuffle else len(self.indices)
+
+    def __iter__(self):
+        if not self.shuffle:
+            return iter(self.indices.tolist())
+        # 按权重不放回采样，空切片以 empty_weight 的概率出现
+        chosen = torch.multinomial(self.weights, self.num_samples, replacement=False, generator=self.generator)
+        return iter(chosen.tolist())
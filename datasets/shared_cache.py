@@ -0,0 +1,152 @@
+"""
+跨 DataLoader worker 共享的内存缓存
+主进程创建一块共享内存（multiprocessing.shared_memory），划分为固定大小的槽位，每个槽位保存一个患者归一化、剪裁后的四个模态。
+所有 worker 映射同一块内存，一个 worker 读取过的患者其他 worker 直接命中；
+Dataset 对象属于主进程，DataLoader 每个 epoch 重新创建 worker 时缓存内容仍然保留。
+共享内存的结构如下
+|--槽位表    每个槽位的 患者索引(int64，-1 为空) + 序号(int64) + 最近使用时间(float64)
+|--数据      num_slots * (4, slice_deep, slice_size, slice_size)
+- 读取不加锁（seqlock）: 写入槽位前后各将序号加一，序号为奇数表示正在写入；读取时先记录序号，复制数据后再检查序号和患者索引，
+  任意一项变化说明读取期间槽位被改写，按未命中处理
+- 写入使用一个跨进程锁，选择空槽位或最近最少使用的槽位
+- Linux 上共享内存位于 /dev/shm（tmpfs），超出可用空间时 worker 写入会收到 SIGBUS，因此创建前检查可用空间
+"""
+import os
+import time
+import weakref
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 槽位表中每个槽位的字段
+_TABLE_FIELDS = ('key', 'seq', 'last_used')
+SHM_DIR = '/dev/shm'
+
+
+def shm_free_bytes():
+    """
+    :return: /dev/shm 的可用字节数，没有 /dev/shm 的系统（macOS、Windows）返回 None
+    """
+    if not os.path.isdir(SHM_DIR):
+        return None
+    stat = os.statvfs(SHM_DIR)
+    return stat.f_bavail * stat.f_frsize
+
+
+class SharedVolumeCache:
+    def __init__(self, budget_bytes, volume_shape, num_modalities=4, dtype='float32', max_entries=None):
+        """
+        在主进程中创建共享内存缓存。
+        :param budget_bytes: 数据部分的字节预算，槽位数量为 budget_bytes // 每个患者的字节数
+        :param volume_shape: 每个模态的形状 (slice_deep, slice_size, slice_size)
+        :param num_modalities: 模态数量
+        :param dtype: 存储精度
+        :param max_entries: 最多需要缓存的患者数量（数据集的患者总数），槽位数量不超过该值，为 None 时不限制
+        """
+        self.dtype = np.dtype(dtype)
+        self.entry_shape = (num_modalities,) + tuple(volume_shape)
+        entry_bytes = int(np.prod(self.entry_shape)) * self.dtype.itemsize
+        self.num_slots = int(budget_bytes // entry_bytes)
+        if self.num_slots < 1:
+            raise ValueError(f"Shared cache budget {budget_bytes} bytes is smaller than one patient "
+                             f"({entry_bytes} bytes)")
+        if max_entries is not None:
+            self.num_slots = max(min(self.num_slots, max_entries), 1)
+
+        self.table_bytes = len(_TABLE_FIELDS) * 8 * self.num_slots
+        size = self.table_bytes + self.num_slots * entry_bytes
+        free = shm_free_bytes()
+        if free is not None and size > free:
+            raise ValueError(f"Shared cache needs {size / 1024 ** 2:.0f} MB but {SHM_DIR} has only "
+                             f"{free / 1024 ** 2:.0f} MB free; reduce data.shared_cache_mb or enlarge {SHM_DIR} "
+                             f"(e.g. docker run --shm-size)")
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.lock = mp.Lock()
+        self._attach()
+        self.keys[:] = -1
+        self.seqs[:] = 0
+        self.last_used[:] = 0
+        # 只有创建共享内存的主进程负责释放
+        self._finalizer = weakref.finalize(self, SharedVolumeCache._release, self.shm, os.getpid())
+
+    @staticmethod
+    def _release(shm, owner_pid):
+        if os.getpid() != owner_pid:
+            return
+        try:
+            shm.close()
+        except BufferError:
+            # 仍有 numpy 视图引用共享内存，映射在进程退出时释放
+            pass
+        shm.unlink()
+
+    def _attach(self):
+        buf = self.shm.buf
+        n = self.num_slots
+        self.keys = np.ndarray((n,), dtype=np.int64, buffer=buf, offset=0)
+        self.seqs = np.ndarray((n,), dtype=np.int64, buffer=buf, offset=8 * n)
+        self.last_used = np.ndarray((n,), dtype=np.float64, buffer=buf, offset=16 * n)
+        self.data = np.ndarray((n,) + self.entry_shape, dtype=self.dtype, buffer=buf, offset=self.table_bytes)
+
+    def __getstate__(self):
+        # 以 spawn 方式创建 worker 时按名称重新映射共享内存，numpy 视图和释放函数不传递
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ('shm', 'keys', 'seqs', 'last_used', 'data', '_finalizer')}
+        state['shm_name'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        shm_name = state.pop('shm_name')
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self._attach()
+
+    def get(self, key, index=slice(None)):
+        """
+        读取缓存项，不加锁。
+        :param key: 患者索引
+        :param index: 切片范围，默认为全部切片
+        :return: 按模态顺序排列的图像列表（复制后的数据），未命中时返回 None
+        """
+        slots = np.flatnonzero(self.keys == key)
+        if len(slots) == 0:
+            return None
+        slot = slots[0]
+        seq = self.seqs[slot]
+        if seq % 2:
+            return None
+        volumes = np.array(self.data[slot][:, index])
+        if self.seqs[slot] != seq or self.keys[slot] != key:
+            return None
+        # 最近使用时间只用于近似的 LRU，不需要加锁
+        self.last_used[slot] = time.monotonic()
+        return list(volumes)
+
+    def put(self, key, volumes):
+        """
+        写入缓存项，缓存已满时替换最近最少使用的槽位。
+        :param volumes: 按模态顺序排列的图像，形状与 volume_shape 不一致时不写入
+        :return: 是否写入
+        """
+        if any(np.shape(volume) != self.entry_shape[1:] for volume in volumes):
+            return False
+        with self.lock:
+            if (self.keys == key).any():
+                return True
+            empty = np.flatnonzero(self.keys == -1)
+            slot = empty[0] if len(empty) else int(np.argmin(self.last_used))
+            self.seqs[slot] += 1
+            self.keys[slot] = -1
+            for modality_index, volume in enumerate(volumes):
+                np.copyto(self.data[slot, modality_index], volume, casting='same_kind')
+            self.keys[slot] = key
+            self.last_used[slot] = time.monotonic()
+            self.seqs[slot] += 1
+        return True
+
+    def close(self):
+        """
+        释放共享内存，只在主进程中调用。
+        """
+        self._finalizer()
@@ -1,9 +1,16 @@
+import time
+
 from datasets import get_brats_dataloader
+from datasets.packed_store import packed_path
+from datasets.manifest import manifest_path
 from evaluations.metrics import *
 from utils import show_mask_origin, Logger
 from tqdm import tqdm
 
-from utils.convert_shape import swap_batch_slice_dimensions, delete_batch_dimensions
+from utils.convert_shape import iter_step_batches
+from mask_generator.torch_masker import DeviceMasker
+from mask_generator.mask_bank import mask_bank_path
+from training.precision import Precision
 
 
 def extract_region(img, quadrant, size):
@@ -82,7 +89,8 @@ def calculate_metrics(target, ref, device='cuda', binary_masks=None, concat_meth
     return avg_psnr, avg_ssim
 
 
-def evaluation(config, net, device, criterion, show_image=False, concat_method='plane'):
+def evaluation(config, net, device, criterion, show_image=False, concat_method='plane', precision=None,
+               compiled=None):
     # 剪裁后切片的数量
     slice_deep = config['train']['slice_deep']
     # 剪裁后切片的宽高尺寸
@@ -91,6 +99,11 @@ def evaluation(config, net, device, criterion, show_image=False, concat_method='
     batch_size = config['train']['batch_size']
     # 每步使用的切片数量，默认小于slice_deep
     step_slice = config['train']['step_slice']
+    # 数据集的粒度，'patient'、'slice' 或 'stream'
+    level = config['train'].get('level', 'patient')
+    slice_level = level in ('slice', 'stream')
+    # 切片级数据集中 DataLoader 的 batch 即为一个 step
+    loader_batch_size = step_slice if slice_level else batch_size
 
     # 遮蔽块的宽高尺寸
     mask_kernel_size = config['mask']['mask_kernel_size']
@@ -98,15 +111,64 @@ def evaluation(config, net, device, criterion, show_image=False, concat_method='
     test_binary_mask = config['mask']['test_binary_mask']
     # 测试时候的遮蔽率
     test_mask_rate = config['mask']['test_mask_rate']
+    # 遮蔽掩码的传输方式，'block' 时 DataLoader 只输出块级别掩码，在设备上展开；'device' 时在设备上生成掩码
+    mask_transport = config['mask'].get('transport', 'dense')
+    # 混合精度，'fp32'、'bf16' 或 'fp16'（只支持 CUDA）
+    if precision is None:
+        precision = Precision(config['test'].get('precision', 'fp32'), device)
+    # torch.compile 编译后的函数，编译（预热）step 的时间单独统计
+    compiled = compiled or []
+    test_masker = DeviceMasker(mask_kernel_size, test_binary_mask, test_mask_rate, False, concat_method)
+    # 预先生成的掩码库，按样本索引使用固定的掩码，不同运行的结果可以直接比较
+    mask_bank_dir = config['mask'].get('bank_dir')
+    test_bank = mask_bank_path(mask_bank_dir, slice_size, mask_kernel_size, test_binary_mask, test_mask_rate, False,
+                               config['mask'].get('bank_seed', 0),
+                               config['mask'].get('bank_size', 65536)) if mask_bank_dir else None
 
     brats_test_root = config['data']['test']
-
-    test_loader = get_brats_dataloader(root_dir=brats_test_root, batch_size=batch_size, slice_deep=slice_deep,
+    # 预处理结果的缓存目录与存储精度
+    cache_dir = config['data'].get('cache_dir')
+    cache_dtype = config['data'].get('cache_dtype', 'float32')
+    # NIfTI 读取后端，'auto' 时自动选择当前机器上最快的后端
+    reader = config['data'].get('reader', 'sitk')
+    reader_index_dir = config['data'].get('reader_index_dir')
+    # 强度归一化: 统计索引、百分位数计算方法和计算精度
+    stats_file = config['data'].get('stats_file')
+    # 数据集清单目录，开始评估前检查缺失或损坏的文件
+    manifest_dir = config['data'].get('manifest_dir')
+    test_manifest = manifest_path(manifest_dir, brats_test_root) if manifest_dir else None
+    norm_method = config['data'].get('norm_method', 'partition')
+    norm_dtype = config['data'].get('norm_dtype', 'float32')
+    # 样本的精度，float16 可以减少 worker 到主进程的传输量，传输到设备后再转换为 float32
+    sample_dtype = config['data'].get('sample_dtype', 'float32')
+    # 每个 worker 内并发读取四个模态的线程数量，'auto' 时根据 CPU 核数和 worker 数量分配
+    decode_threads = config['data'].get('decode_threads', 0)
+    # DataLoader worker 数量，'auto' 时预热测量后选择 worker 数量和预取深度
+    num_workers = config['data'].get('test_num_workers', 2)
+    prefetch_factor = config['data'].get('prefetch_factor')
+    tune_batches = config['data'].get('tune_batches', 8)
+    # 跨 worker 共享的内存缓存大小（MB），0 时不使用
+    shared_cache_mb = config['data'].get('shared_cache_mb', 0)
+    # 数据划分目录，以及打包后单文件数据的目录
+    list_dir = config['data'].get('list_dir', "data/list/pre-test-50")
+    packed_dir = config['data'].get('packed_dir')
+    test_packed = packed_path(packed_dir, list_dir, 'test') if packed_dir else None
+
+    test_loader = get_brats_dataloader(root_dir=brats_test_root, batch_size=loader_batch_size, slice_deep=slice_deep,
                                        slice_size=slice_size,
                                        mask_kernel_size=mask_kernel_size, binary_mask=test_binary_mask,
                                        mask_rate=test_mask_rate,
-                                       num_workers=2, mode='test', concat_method=concat_method)
+                                       num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                       tune_batches=tune_batches, mode='test', concat_method=concat_method,
+                                       cache_dir=cache_dir, cache_dtype=cache_dtype,
+                                       list_dir=list_dir, packed_file=test_packed, level=level,
+                                       reader=reader, reader_index_dir=reader_index_dir,
+                                       stats_file=stats_file, norm_method=norm_method, norm_dtype=norm_dtype,
+                                       decode_threads=decode_threads, sample_dtype=sample_dtype,
+                                       mask_transport=mask_transport, mask_bank=test_bank,
+                                       shared_cache_mb=shared_cache_mb, manifest=test_manifest)
     logger_c = Logger(None, dst='console')
+    logger_c.info(f"Precision: {precision.name}")
 
     # 每个epoch包含的step数量
     step_per_epoch = slice_deep // step_slice
@@ -118,39 +180,42 @@ def evaluation(config, net, device, criterion, show_image=False, concat_method='
     avg_ssim = [0.0] * 4
     count = 0
     loop = 3
+    step_time = 0.0
+    compile_time = 0.0
+    compile_steps = 0
     torch.cuda.empty_cache()
     with torch.no_grad():  # 关闭梯度计算
         with tqdm(test_loader, desc="Validation", unit="batch_person") as pbar_test:
-            for masked_images, original_images in pbar_test:
-                if concat_method == 'plane':
-                    masked_images = swap_batch_slice_dimensions(masked_images).to(device)
-                    original_images = swap_batch_slice_dimensions(original_images).to(device)
-                elif concat_method == 'channels':
-                    masked_images = delete_batch_dimensions(masked_images).to(device)
-                    original_images = delete_batch_dimensions(original_images).to(device)
-                for step in range(step_per_epoch):
-                    masked_images_step = masked_images[range(step, masked_images.shape[0],
-                                                             step_per_epoch), :, :, :]
-                    original_images_step = original_images[range(step, original_images.shape[0],
-                                                                 step_per_epoch), :, :, :]
+            for masked_images_step, original_images_step in iter_step_batches(pbar_test, concat_method,
+                                                                              step_per_epoch, device, slice_level,
+                                                                              mask_transport, test_masker):
+                step_start = time.perf_counter()
+                with precision.autocast():
                     outputs = net(masked_images_step)
-
-                    # 计算损失
-                    test_loss += criterion.calculate_loss_regions(outputs, original_images_step,
-                                                                  binary_masks=test_binary_mask)
-                    # test_loss = criterion.calculate_loss_no_background(outputs, original_images_step)
-                    # 计算 PSNR 和 SSIM
-                    current_psnr, current_ssim = calculate_metrics(outputs, original_images_step, binary_masks=test_binary_mask,
-                                                     concat_method=concat_method)
-                    if show_image and loop > 0:
-                        show_mask_origin(outputs, masked_images_step, original_images_step, index,
-                                         concat_method=concat_method)
-                        loop -= 1
-                    # 累加每个象限的 PSNR 和 SSIM
-                    for j in range(4):
-                        avg_psnr[j] += current_psnr[j]
-                        avg_ssim[j] += current_ssim[j]
-                    count += 1
+                # 损失、指标和图像显示使用 float32
+                outputs = outputs.float()
+
+                # 计算损失，item() 等待设备完成计算
+                test_loss += criterion.calculate_loss_regions(outputs, original_images_step,
+                                                              binary_masks=test_binary_mask).item()
+                if any(function.warmup for function in compiled):
+                    compile_time += time.perf_counter() - step_start
+                    compile_steps += 1
+                else:
+                    step_time += time.perf_counter() - step_start
+                # test_loss = criterion.calculate_loss_no_background(outputs, original_images_step)
+                # 计算 PSNR 和 SSIM
+                current_psnr, current_ssim = calculate_metrics(outputs, original_images_step, binary_masks=test_binary_mask,
+                                                 concat_method=concat_method)
+                if show_image and loop > 0:
+                    show_mask_origin(outputs, masked_images_step, original_images_step, index,
+                                     concat_method=concat_method)
+                    loop -= 1
+                # 累加每个象限的 PSNR 和 SSIM
+                for j in range(4):
+                    avg_psnr[j] += current_psnr[j]
+                    avg_ssim[j] += current_ssim[j]
+                count += 1
             pbar_test.update()
 
     test_loss /= len(test_loader)
@@ -159,6 +224,10 @@ def evaluation(config, net, device, criterion, show_image=False, concat_method='
 
     # 打印结果和写入信息
     logger_c.info(f"Test/Loss: {test_loss:.4f}")
+    step_message = f"Step time: {step_time:.2f}s ({step_time / max(count - compile_steps, 1) * 1000:.1f} ms/step)"
+    if compile_steps:
+        step_message += f", compile time: {compile_time:.2f}s in {compile_steps} warm-up steps"
+    logger_c.info(step_message)
 
     # 打印每种模态的详细 PSNR 和 SSIM
     psnr_message = (f"Test/PSNR "
@@ -1,3 +1,3 @@
-from .masker import random_masked_area
+from .masker import random_masked_area, random_masked_channels, random_block_mask
 
-__all__ = ['random_masked_area']
+__all__ = ['random_masked_area', 'random_masked_channels', 'random_block_mask']
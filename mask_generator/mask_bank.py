@@ -0,0 +1,147 @@
+"""
+预先生成的遮蔽掩码库
+对一组遮蔽设置（mask_kernel_size、binary_mask、mask_rate、is_random）预先生成大量单个切片的掩码，按位压缩（np.packbits）后
+保存为内存映射的 .npy 文件，Dataset 直接按索引读取，不再逐个样本生成掩码。
+- 固定遮蔽块尺寸时保存块级别掩码 (4, grid_size, grid_size)，is_random 时遮蔽块尺寸不固定，保存完整分辨率的掩码 (4, slice_size, slice_size)
+- 掩码库按块并行生成，每个块的随机数由 np.random.SeedSequence(seed).spawn 派生，结果与进程数量无关
+- 评估时按样本索引读取固定的掩码，不同运行之间可以直接比较；训练时随机选择掩码
+文件结构如下
+bank_dir
+|--k12_1111_r0.75_s192_seed0_n65536.npy    (按位压缩的掩码，形状为 (num_entries, 每个掩码的字节数))
+|--k12_1111_r0.75_s192_seed0_n65536.json   (遮蔽设置和掩码形状)
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mask_generator.masker import random_block_mask, expand_block_grid, _random_channel_masks
+
+
+def mask_bank_path(bank_dir, slice_size, mask_kernel_size, binary_mask, mask_rate, is_random=False, seed=0,
+                   num_entries=65536):
+    """
+    根据遮蔽设置得到掩码库的路径，例如 data/masks/k12_1111_r0.75_s192_seed0_n65536.npy
+    """
+    kernel_tag = 'random' if is_random else f"k{mask_kernel_size}"
+    name = f"{kernel_tag}_{binary_mask}_r{mask_rate}_s{slice_size}_seed{seed}_n{num_entries}.npy"
+    return os.path.join(bank_dir, name)
+
+
+def _fill_chunk(args):
+    """
+    生成掩码库中的一段掩码并写入内存映射文件。
+    """
+    path, start, stop, seed_seq, meta = args
+    rng = np.random.default_rng(seed_seq)
+    num = stop - start
+    if meta['is_random']:
+        masks = _random_channel_masks(num, meta['mask_kernel_size'], meta['slice_size'], meta['binary_mask'],
+                                      meta['mask_rate'], True, rng) > 0
+    else:
+        masks = random_block_mask(num, meta['grid_size'], meta['binary_mask'], meta['mask_rate'], rng=rng)
+    bank = np.load(path, mmap_mode='r+')
+    bank[start:stop] = np.packbits(masks.reshape(num, -1), axis=1)
+    bank.flush()
+    return stop - start
+
+
+def build_mask_bank(output, slice_size, mask_kernel_size, binary_mask, mask_rate, is_random=False, seed=0,
+                    num_entries=65536, chunk_size=1024, workers=None):
+    """
+    并行生成掩码库。
+    :param output: 输出的 .npy 文件，遮蔽设置保存在同名的 .json 文件中
+    :param num_entries: 掩码数量，每个掩码对应一个切片
+    :param chunk_size: 每个进程每次生成的掩码数量
+    :param workers: 进程数量，为 None 时使用 CPU 核数
+    :return: 输出文件路径
+    """
+    grid_size = slice_size if is_random else slice_size // mask_kernel_size
+    meta = {
+        'slice_size': slice_size,
+        'mask_kernel_size': mask_kernel_size,
+        'binary_mask': binary_mask,
+        'mask_rate': mask_rate,
+        'is_random': is_random,
+        'seed': seed,
+        'num_entries': num_entries,
+        # 掩码中每个元素对应的像素尺寸
+        'unit': 1 if is_random else mask_kernel_size,
+        'grid_size': grid_size,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp_path = f"{output}.tmp.npy"
+    num_bytes = (4 * grid_size * grid_size + 7) // 8
+    np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(num_entries, num_bytes)).flush()
+
+    starts = list(range(0, num_entries, chunk_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(tmp_path, start, min(start + chunk_size, num_entries), seed_seq, meta)
+             for start, seed_seq in zip(starts, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_fill_chunk, tasks))
+
+    os.replace(tmp_path, output)
+    with open(os.path.splitext(output)[0] + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    return output
+
+
+class MaskBank:
+    def __init__(self, path):
+        """
+        打开掩码库，掩码以只读内存映射的方式读取。内存映射在第一次读取时才打开，传递给 DataLoader 的子进程时不会复制数据。
+        """
+        self.path = path
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            self.meta = json.load(f)
+        self.masks = None
+        self.grid_size = self.meta['grid_size']
+        self.unit = self.meta['unit']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['masks'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_entries']
+
+    def check(self, slice_size, mask_kernel_size, binary_mask, mask_rate, is_random):
+        """
+        检查掩码库的遮蔽设置与 Dataset 是否一致。
+        """
+        expected = {'slice_size': slice_size, 'mask_kernel_size': mask_kernel_size, 'binary_mask': binary_mask,
+                    'mask_rate': mask_rate, 'is_random': is_random}
+        actual = {key: self.meta[key] for key in expected}
+        if actual != expected:
+            raise ValueError(f"Mask bank {self.path} was built with {actual}, expected {expected}")
+
+    def indices(self, num, start=None, rng=None):
+        """
+        选择掩码的索引。
+        :param num: 掩码数量
+        :param start: 为 None 时随机选择；否则从 start 开始连续选择，用于评估时固定每个样本的掩码
+        """
+        if start is None:
+            rng = np.random.default_rng() if rng is None else rng
+            return rng.integers(0, len(self), num)
+        return (start + np.arange(num)) % len(self)
+
+    def block(self, indices):
+        """
+        :return: 形状为 (num, 4, grid_size, grid_size) 的布尔数组，True 表示保留
+        """
+        if self.masks is None:
+            self.masks = np.load(self.path, mmap_mode='r')
+        packed = self.masks[indices]
+        size = 4 * self.grid_size * self.grid_size
+        return np.unpackbits(packed, axis=1, count=size).reshape(len(indices), 4, self.grid_size,
+                                                                  self.grid_size).astype(bool)
+
+    def dense(self, indices, dtype=np.float32):
+        """
+        :return: 形状为 (num, 4, slice_size, slice_size) 的完整分辨率掩码
+        """
+        return expand_block_grid(self.block(indices), self.unit, self.meta['slice_size'], dtype)
@@ -1,148 +1,169 @@
-import math
-import random
 import numpy as np
 import time
-import torch
 
-# from datasets import BraTsData
-def random_masked_area(image_batch, mask_kernel_size, slice_size, binary_mask, mask_rate):
+# 遮蔽掩码的传输方式: 'dense' 完整分辨率的遮蔽后图像，'block' 块级别的布尔掩码，'device' 不传输掩码，在设备上生成
+MASK_TRANSPORTS = ('dense', 'block', 'device')
+# is_random 时可选的遮蔽块尺寸
+PRO_SIZE = [3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96]
+# is_random 时只遮蔽单个模态的遮蔽选项
+BINARY_MASK_RANDOM = ['1000', '0100', '0010', '0001']
+
+
+def _binary_mask_array(binary_masks, slice_num):
     """
-    为图像批次创建遮蔽区域。
-    :param method:
-    :param image_batch: ndarray, 图像的批次，形状为 (slice_num, height, width)
-    :param mask_kernel_size: int, 遮蔽块的尺寸
-    :param slice_size: tuple, 每个子图的尺寸 (height, width)
-    :param binary_mask: str, 四位二进制字符串，表示哪些区域需要遮蔽
-    :param mask_rate: float, 遮蔽的比例
-    :return: ndarray, 遮蔽后的图像批次
+    将遮蔽选项转换为布尔数组。
+    :param binary_masks: str 或 str 列表, 四位二进制字符串
+    :return: ndarray, 形状为 (slice_num, 4)，True 表示该模态需要遮蔽
     """
+    if isinstance(binary_masks, str):
+        binary_masks = [binary_masks]
+    binary = np.array([[c == '1' for c in binary_mask] for binary_mask in binary_masks], dtype=bool)
+    return np.broadcast_to(binary, (slice_num, 4))
 
-    slice_num = image_batch.shape[0]
-    # 初始化原图的遮蔽掩码
 
-    masked_image = np.zeros(image_batch.shape)
+def sample_mask_params(slice_num, mask_kernel_size, binary_mask, mask_rate, is_random=False, rng=None):
+    """
+    确定每个切片的遮蔽参数。
+    is_random 时每个切片独立选择遮蔽块尺寸；以 0.2 的概率只遮蔽一个模态，遮蔽率在 [0.75, 1.0) 中选择，
+    否则使用 binary_mask，遮蔽率在 [0.0, 1.0) 中选择。
+    :return: (遮蔽块尺寸 (slice_num,), 遮蔽选项 (slice_num, 4), 遮蔽率 (slice_num,))
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    binary = _binary_mask_array(binary_mask, slice_num)
+    if not is_random:
+        return np.full(slice_num, mask_kernel_size), binary, np.full(slice_num, float(mask_rate))
 
-    # 构建遮蔽块计数图的维度
-    masked_sub_image_size = slice_size // mask_kernel_size
+    kernel_sizes = np.asarray(PRO_SIZE)[rng.integers(0, len(PRO_SIZE), slice_num)]
+    single = rng.random(slice_num) > 0.8
+    single_binary = _binary_mask_array(BINARY_MASK_RANDOM, len(BINARY_MASK_RANDOM))[
+        rng.integers(0, len(BINARY_MASK_RANDOM), slice_num)]
+    binary = np.where(single[:, np.newaxis], single_binary, binary)
+    mask_rates = np.where(single, rng.uniform(0.75, 1.0, slice_num), rng.uniform(0.0, 1.0, slice_num))
+    return kernel_sizes, binary, mask_rates
 
-    total_block_count = masked_sub_image_size ** 2
 
-    # 检查每一子图是否需要遮蔽
-    # for index in range(batch_size):
-    for slice_index in range(slice_num):
+def block_keep_grid(grid_size, binary, mask_rates, rng=None):
+    """
+    在遮蔽块网格上选择保留的块。每个模态保留 ceil(块数 * (1 - 遮蔽率)) 个块；
+    遮蔽率不小于0.75时，同一切片中各模态保留的块互不重叠。
+    对随机数取 argsort 得到每个切片的随机排列，不重叠时所有模态共用一个排列，第 j 个被遮蔽的模态保留排名在
+    [j * k, (j + 1) * k) 的块，否则每个模态使用独立的排列，保留排名小于 k 的块。
+    :param grid_size: int, 每个方向上的遮蔽块数量
+    :param binary: ndarray, 形状为 (slice_num, 4) 的遮蔽选项
+    :param mask_rates: ndarray, 形状为 (slice_num,) 的遮蔽率
+    :return: ndarray, 形状为 (slice_num, 4, grid_size, grid_size) 的布尔数组，True 表示保留
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    slice_num = len(mask_rates)
+    num_blocks = grid_size * grid_size
+    num_keep = np.ceil(num_blocks * (1 - np.asarray(mask_rates))).astype(np.int64)
+    disjoint = np.asarray(mask_rates) >= 0.75
+
+    keys = rng.random((slice_num, 4, num_blocks))
+    keys = np.where(disjoint[:, np.newaxis, np.newaxis], keys[:, :1], keys)
+    # 每个块在随机排列中的排名
+    ranks = np.empty(keys.shape, dtype=np.int64)
+    np.put_along_axis(ranks, keys.argsort(axis=-1), np.arange(num_blocks), axis=-1)
+
+    slot = np.cumsum(binary, axis=1) - 1
+    lower = np.where(disjoint[:, np.newaxis], slot, 0) * num_keep[:, np.newaxis]
+    upper = lower + num_keep[:, np.newaxis]
+    keep = (ranks >= lower[..., np.newaxis]) & (ranks < upper[..., np.newaxis])
+    # 不需要遮蔽的模态全部保留
+    keep |= ~binary[..., np.newaxis]
+    return keep.reshape(slice_num, 4, grid_size, grid_size)
+
+
+def expand_block_grid(block_mask, mask_kernel_size, slice_size, dtype=np.float32):
+    """
+    将块级别掩码展开为完整分辨率，不能被 mask_kernel_size 整除时余下的边缘部分为遮蔽。
+    :param block_mask: ndarray, 形状为 (..., grid_size, grid_size)
+    :return: ndarray, 形状为 (..., slice_size, slice_size)
+    """
+    masked_image = np.zeros(block_mask.shape[:-2] + (slice_size, slice_size), dtype=dtype)
+    size = block_mask.shape[-1] * mask_kernel_size
+    masked_image[..., :size, :size] = block_mask.repeat(mask_kernel_size, axis=-2).repeat(mask_kernel_size, axis=-1)
+    return masked_image
 
-        masked_sub_image_count = np.ones((masked_sub_image_size, masked_sub_image_size))
 
-        for i in range(4):
-            if binary_mask[i] == '0':
-                continue
-                # 计算子图的位置
-            if method == 'plane':
-                row_start = (i // 2) * slice_size
-                col_start = (i % 2) * slice_size
+def masks_to_plane(masked_image):
+    """
+    将 'channels' 排列的掩码 (slice_num, 4, H, W) 按左上、右上、左下、右下的顺序拼接为 'plane' 排列 (slice_num, 2H, 2W)。
+    """
+    slice_num, _, height, width = masked_image.shape
+    return masked_image.reshape(slice_num, 2, 2, height, width).transpose(0, 1, 3, 2, 4).reshape(
+        slice_num, 2 * height, 2 * width)
 
-            # 收集所有可以被选择为保留块的位置
-            all_blocks = [(r, c) for r in range(0, slice_size, mask_kernel_size)
-                          for c in range(0, slice_size, mask_kernel_size)
-                          if masked_sub_image_count[r // mask_kernel_size, c // mask_kernel_size] > 0]
 
-            random.shuffle(all_blocks)  # 随机化块的顺序
+def _random_channel_masks(slice_num, mask_kernel_size, slice_size, binary_mask, mask_rate, is_random, rng):
+    """
+    生成 'channels' 排列的完整分辨率掩码，is_random 时按遮蔽块尺寸分组生成。
+    :return: ndarray, 形状为 (slice_num, 4, slice_size, slice_size) 的 float32 数组
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    kernel_sizes, binary, mask_rates = sample_mask_params(slice_num, mask_kernel_size, binary_mask, mask_rate,
+                                                          is_random, rng)
+    masked_image = np.empty((slice_num, 4, slice_size, slice_size), dtype=np.float32)
+    for kernel_size in np.unique(kernel_sizes):
+        index = np.flatnonzero(kernel_sizes == kernel_size)
+        grid = block_keep_grid(slice_size // kernel_size, binary[index], mask_rates[index], rng)
+        masked_image[index] = expand_block_grid(grid, kernel_size, slice_size)
+    return masked_image
 
-            # 根据rate计算需要保留的块数
-            keep_count = min(int((1 - mask_rate) * total_block_count), len(all_blocks))
 
-            # 选择块并设置保留
-            selected_blocks = all_blocks[:keep_count]
-            if method == 'channels':
-                for row, col in selected_blocks:
-                    masked_image[slice_index, i, row:row + mask_kernel_size,
-                                 col:col + mask_kernel_size] = 1  # 设置保留块
-                    masked_sub_image_count[row // mask_kernel_size:(row // mask_kernel_size) + 1,
-                                           col // mask_kernel_size:(col // mask_kernel_size) + 1] -= 1
-            elif method == 'plane':
-                for row, col in selected_blocks:
-                    masked_image[slice_index, row_start + row:row_start + row + mask_kernel_size,
-                                 col_start + col:col_start + col + mask_kernel_size] = 1  # 设置保留块
-                    masked_sub_image_count[row // mask_kernel_size:(row // mask_kernel_size) + 1,
-                                           col // mask_kernel_size:(col // mask_kernel_size) + 1] -= 1
+def random_masked_area(image_batch, mask_kernel_size, slice_size, binary_mask, mask_rate, is_random=False, rng=None):
+    """
+    为 'plane' 排列的图像批次创建遮蔽区域，遮蔽规则与 random_masked_channels 相同，
+    四个模态的掩码按左上t1c、右上t1n、左下t2w、右下t2f拼接。
+    :param image_batch: ndarray, 图像的批次，形状为 (slice_num, 2 * slice_size, 2 * slice_size)
+    :param mask_kernel_size: int, 遮蔽块的尺寸
+    :param slice_size: int, 每个子图的高度、宽度
+    :param binary_mask: str, 四位二进制字符串，表示哪些区域需要遮蔽
+    :param mask_rate: float, 遮蔽的比例
+    :param is_random: bool, 每个切片随机选择遮蔽块尺寸、遮蔽率和遮蔽选项
+    :param rng: np.random.Generator, 为 None 时使用新的随机数生成器
+    :return: ndarray, float32 的掩码，形状与 image_batch 相同，1 表示保留
+    """
+    masked_image = _random_channel_masks(image_batch.shape[0], mask_kernel_size, slice_size, binary_mask, mask_rate,
+                                         is_random, rng)
+    return masks_to_plane(masked_image)
 
-    return masked_image
 
-def random_masked_channels(image_batch, mask_kernel_size, slice_size, binary_mask, mask_rate, is_random=False):
-    """
-        为图像批次创建遮蔽区域。
-        :param method:
-        :param image_batch: ndarray, 图像的批次，形状为 (slice_num, height, width)
-        :param mask_kernel_size: int, 遮蔽块的尺寸
-        :param slice_size: tuple, 每个子图的尺寸 (height, width)
-        :param binary_mask: str, 四位二进制字符串，表示哪些区域需要遮蔽
-        :param mask_rate: float, 遮蔽的比例
-        :return: ndarray, 遮蔽后的图像批次
-        """
-    pro_size = [3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96]
-    binary_mask_random = ['1000', '0100', '0010', '0001']
-    slice_binary_mask = binary_mask
-    slice_num = image_batch.shape[0]
-    # 初始化原图的遮蔽掩码
-
-    masked_image = np.zeros(image_batch.shape)
-
-    # 检查每一子图是否需要遮蔽
-    # for index in range(batch_size):
-    for slice_index in range(slice_num):
-
-        if is_random:
-            mask_kernel_size = pro_size[random.randint(0, 10)]
-            if random.uniform(0.0, 1.0) > 0.8:
-                slice_binary_mask = binary_mask_random[random.randint(0, 3)]
-                mask_rate = random.uniform(0.75, 1.0)
-            else :
-                mask_rate = random.uniform(0.0, 1.0)
-        else:
-            slice_binary_mask = binary_mask
-        # 构建遮蔽块计数图的维度
-        masked_sub_image_size = slice_size // mask_kernel_size
-        # print(mask_rate, mask_kernel_size, slice_binary_mask)
-        masked_sub_image_count = np.zeros((masked_sub_image_size, masked_sub_image_size), dtype=bool)
-
-
-
-        for i in range(4):
-            if slice_binary_mask[i] == '0':
-                masked_image[slice_index, i, :, :] = 1
-                continue
-                # 计算子图的位置
-
-
-            num_blocks = masked_sub_image_count.size
-            num_keep = math.ceil(num_blocks * (1 - mask_rate))
-
-            # 获取当前未被选择的块索引
-            available_blocks = np.argwhere(masked_sub_image_count == 0)
-            np.random.shuffle(available_blocks)
-
-            keep_blocks = available_blocks[:num_keep]
-
-            channel_mask = torch.zeros((slice_size, slice_size), dtype=torch.float32)
-            for block in keep_blocks:
-                block_h, block_w = block
-                if mask_rate >= 0.75:
-                    masked_sub_image_count[block_h, block_w] = 1
-
-                h_start = block_h * mask_kernel_size
-                h_end = h_start + mask_kernel_size
-                w_start = block_w * mask_kernel_size
-                w_end = w_start + mask_kernel_size
-
-                # 设置遮蔽块为0
-                channel_mask[h_start:h_end, w_start:w_end] = 1
-
-            masked_image[slice_index, i, :, :] = channel_mask
+def random_masked_channels(image_batch, mask_kernel_size, slice_size, binary_mask, mask_rate, is_random=False,
+                           rng=None):
+    """
+    为 'channels' 排列的图像批次创建遮蔽区域。
+    :param image_batch: ndarray, 图像的批次，形状为 (slice_num, 4, slice_size, slice_size)
+    :param mask_kernel_size: int, 遮蔽块的尺寸
+    :param slice_size: int, 每个子图的高度、宽度
+    :param binary_mask: str, 四位二进制字符串，表示哪些区域需要遮蔽
+    :param mask_rate: float, 遮蔽的比例
+    :param is_random: bool, 每个切片随机选择遮蔽块尺寸、遮蔽率和遮蔽选项
+    :param rng: np.random.Generator, 为 None 时使用新的随机数生成器
+    :return: ndarray, float32 的掩码，形状与 image_batch 相同，1 表示保留
+    """
+    return _random_channel_masks(image_batch.shape[0], mask_kernel_size, slice_size, binary_mask, mask_rate,
+                                 is_random, rng)
+
+
+def random_block_mask(slice_num, grid_size, binary_mask, mask_rate, rng=None):
+    """
+    生成块级别的遮蔽掩码，每个遮蔽块只用一个布尔值表示，选择规则与 random_masked_channels 相同。
+    与完整分辨率的掩码相比数据量缩小 mask_kernel_size**2 倍（再乘以 4 倍的 float32->bool），
+    在设备上通过 expand_block_mask 展开。
+    :param slice_num: int, 切片数量
+    :param grid_size: int, 每个模态每个方向上的遮蔽块数量，即 slice_size // mask_kernel_size
+    :param binary_mask: str, 四位二进制字符串，表示哪些模态需要遮蔽
+    :param mask_rate: float, 遮蔽的比例
+    :param rng: np.random.Generator, 为 None 时使用新的随机数生成器
+    :return: ndarray, 形状为 (slice_num, 4, grid_size, grid_size) 的布尔数组，True 表示保留
+    """
+    return block_keep_grid(grid_size, _binary_mask_array(binary_mask, slice_num),
+                           np.full(slice_num, float(mask_rate)), rng)
+
 
-    return masked_image
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
-    import torch
 
     image_batch = np.random.rand(1, 4, 192, 192).astype(np.float32)
     # image_shape = (6, 6)  # 原图大小
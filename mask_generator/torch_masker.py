@@ -0,0 +1,140 @@
+"""
+设备上的遮蔽掩码
+- 'block':  Dataset 只返回块级别的布尔掩码（见 masker.random_block_mask），在训练/评估循环中传输到设备后再展开为完整分辨率，
+            每个 step 从主机传输到设备的数据量约减少一半。
+- 'device': Dataset 只返回原始图像，遮蔽掩码在设备上按 step 批量生成，DataLoader worker 不再运行遮蔽算法，
+            修改遮蔽设置也不需要改动数据管道。
+遮蔽规则与 masker.random_masked_channels 相同，每个切片的遮蔽参数由 masker.sample_mask_params 决定。
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from mask_generator.masker import sample_mask_params
+from utils.convert_shape import channels_to_plane
+
+
+def expand_block_mask(block_mask, mask_kernel_size, slice_size, concat_method='channels', dtype=torch.float32):
+    """
+    将块级别掩码展开为完整分辨率的掩码。
+    :param block_mask: 形状为 (N, 4, grid_size, grid_size) 的布尔张量
+    :param mask_kernel_size: 遮蔽块的尺寸
+    :param slice_size: 每个模态的高度、宽度，不能被 mask_kernel_size 整除时余下的边缘部分为遮蔽
+    :param concat_method: 'channels' 返回 (N, 4, H, W)，'plane' 返回 (N, 1, 2H, 2W)
+    :param dtype: 输出掩码的精度
+    :return: 展开后的掩码，1 表示保留
+    """
+    mask = block_mask.to(dtype)
+    mask = mask.repeat_interleave(mask_kernel_size, dim=-2).repeat_interleave(mask_kernel_size, dim=-1)
+    pad = slice_size - mask.shape[-1]
+    if pad > 0:
+        mask = F.pad(mask, (0, pad, 0, pad))
+    if concat_method == 'plane':
+        mask = channels_to_plane(mask)
+    return mask
+
+
+def block_keep_grid(grid_size, binary, mask_rates, generator=None):
+    """
+    masker.block_keep_grid 的 torch 实现，在 binary 所在的设备上选择保留的块。
+    :param grid_size: int, 每个方向上的遮蔽块数量
+    :param binary: 形状为 (N, 4) 的布尔张量，True 表示该模态需要遮蔽
+    :param mask_rates: 形状为 (N,) 的遮蔽率
+    :param generator: torch.Generator, 与 binary 位于同一设备
+    :return: 形状为 (N, 4, grid_size, grid_size) 的布尔张量，True 表示保留
+    """
+    device = binary.device
+    num = binary.shape[0]
+    num_blocks = grid_size * grid_size
+    num_keep = torch.ceil(num_blocks * (1 - mask_rates)).long()
+    disjoint = mask_rates >= 0.75
+
+    keys = torch.rand((num, 4, num_blocks), generator=generator, device=device)
+    keys = torch.where(disjoint[:, None, None], keys[:, :1], keys)
+    # 每个块在随机排列中的排名
+    order = keys.argsort(dim=-1)
+    ranks = torch.empty_like(order).scatter_(-1, order, torch.arange(num_blocks, device=device).expand_as(order))
+
+    slot = torch.cumsum(binary.long(), dim=1) - 1
+    lower = torch.where(disjoint[:, None], slot, torch.zeros_like(slot)) * num_keep[:, None]
+    upper = lower + num_keep[:, None]
+    keep = (ranks >= lower[..., None]) & (ranks < upper[..., None])
+    # 不需要遮蔽的模态全部保留
+    keep |= ~binary[..., None]
+    return keep.reshape(num, 4, grid_size, grid_size)
+
+
+def random_masks(num, mask_kernel_size, slice_size, binary_mask, mask_rate, is_random=False, device='cpu',
+                 rng=None, generator=None, dtype=torch.float32):
+    """
+    在设备上一次生成一个 step 的遮蔽掩码。
+    :param num: 切片数量 N
+    :param mask_kernel_size: 遮蔽块的尺寸
+    :param slice_size: 每个模态的高度、宽度
+    :param binary_mask: 四位二进制字符串，表示哪些模态需要遮蔽
+    :param mask_rate: 遮蔽的比例
+    :param is_random: 每个切片随机选择遮蔽块尺寸、遮蔽率和遮蔽选项，按遮蔽块尺寸分组生成
+    :param rng: np.random.Generator, 用于在主机上选择每个切片的遮蔽参数
+    :param generator: torch.Generator, 用于在设备上选择保留的块
+    :return: 形状为 (N, 4, slice_size, slice_size) 的掩码，1 表示保留
+    """
+    kernel_sizes, binary, mask_rates = sample_mask_params(num, mask_kernel_size, binary_mask, mask_rate, is_random, rng)
+    binary = torch.from_numpy(np.ascontiguousarray(binary)).to(device)
+    mask_rates = torch.from_numpy(mask_rates).to(device)
+    if not is_random:
+        grid = block_keep_grid(slice_size // mask_kernel_size, binary, mask_rates, generator)
+        return expand_block_mask(grid, mask_kernel_size, slice_size, dtype=dtype)
+
+    masks = torch.empty((num, 4, slice_size, slice_size), dtype=dtype, device=device)
+    for kernel_size in np.unique(kernel_sizes):
+        index = torch.from_numpy(np.flatnonzero(kernel_sizes == kernel_size)).to(device)
+        grid = block_keep_grid(slice_size // int(kernel_size), binary[index], mask_rates[index], generator)
+        masks[index] = expand_block_mask(grid, int(kernel_size), slice_size, dtype=dtype)
+    return masks
+
+
+class DeviceMasker:
+    def __init__(self, mask_kernel_size, binary_mask, mask_rate, is_random=False, concat_method='channels',
+                 seed=None):
+        """
+        训练/评估循环中在设备上遮蔽图像。
+        :param seed: 随机种子，为 None 时每次运行生成不同的掩码
+        """
+        self.mask_kernel_size = mask_kernel_size
+        self.binary_mask = binary_mask
+        self.mask_rate = mask_rate
+        self.is_random = is_random
+        self.concat_method = concat_method
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.generators = {}
+
+    def generator(self, device):
+        if self.seed is None:
+            return None
+        device = torch.device(device)
+        if device not in self.generators:
+            self.generators[device] = torch.Generator(device=device).manual_seed(self.seed)
+        return self.generators[device]
+
+    def slice_size(self, original_images):
+        return original_images.shape[-1] // (2 if self.concat_method == 'plane' else 1)
+
+    def __call__(self, original_images):
+        """
+        :param original_images: 'channels' 为 (N, 4, H, W)，'plane' 为 (N, 1, 2H, 2W)
+        :return: 遮蔽后图像
+        """
+        masks = random_masks(original_images.shape[0], self.mask_kernel_size, self.slice_size(original_images),
+                             self.binary_mask, self.mask_rate, self.is_random, original_images.device, self.rng,
+                             self.generator(original_images.device), original_images.dtype)
+        if self.concat_method == 'plane':
+            masks = channels_to_plane(masks)
+        return original_images * masks
+
+    def apply_block(self, block_mask, original_images):
+        """
+        展开 DataLoader 输出的块级别掩码并遮蔽图像。
+        """
+        return original_images * expand_block_mask(block_mask, self.mask_kernel_size, self.slice_size(original_images),
+                                                   self.concat_method, original_images.dtype)
@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 from torchinfo import summary
 
+from networks.recompute import checkpoint_module
+
 
 class DoubleConv(nn.Module):
     def __init__(self, in_channels, out_channels, mid_channels=None, padding=1, dropout=0.0, bias=False):
@@ -15,8 +17,13 @@ class DoubleConv(nn.Module):
             nn.Conv2d(mid_channels, out_channels, kernel_size=3, stride=2, padding=padding, bias=bias),
             nn.ReLU(inplace=True)
         )
+        # 激活检查点，由 networks.checkpointing.apply_checkpointing 设置
+        self.use_checkpoint = False
 
     def forward(self, x):
+        if self.use_checkpoint and torch.is_grad_enabled():
+            # 只保存输入，反向传播时重新计算（保存随机数状态，Dropout 的掩码与前向传播相同；BN 的统计量只更新一次）
+            return checkpoint_module(self.double_conv, x)
         return self.double_conv(x)
 
 
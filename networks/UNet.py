@@ -3,6 +3,8 @@ from torch import nn
 from torch.nn import functional as F
 from torchinfo import summary
 
+from networks.recompute import checkpoint_module
+
 
 class DoubleConv(nn.Module):
     """(convolution => [BN] => ReLU) * 2"""
@@ -18,8 +20,13 @@ class DoubleConv(nn.Module):
             nn.BatchNorm2d(out_channels),
             nn.LeakyReLU(inplace=True)
         )
+        # 激活检查点，由 networks.checkpointing.apply_checkpointing 设置
+        self.use_checkpoint = False
 
     def forward(self, x):
+        if self.use_checkpoint and torch.is_grad_enabled():
+            # 只保存输入，反向传播时重新计算两组卷积、BN 和激活（BN 的统计量只在前向传播时更新一次）
+            return checkpoint_module(self.double_conv, x)
         return self.double_conv(x)
 
 
@@ -112,15 +119,3 @@ if __name__ == '__main__':
     X = torch.randn((10, 1, 384, 384))
     net = UNet(in_channels=1, out_channels=1)
     summary(net, input_size=(32, 1, 384, 384))
-
-    # def use_checkpointing(self):
-    #     self.inc = torch.utilss.checkpoint(self.inc)
-    #     self.down1 = torch.utilss.checkpoint(self.down1)
-    #     self.down2 = torch.utilss.checkpoint(self.down2)
-    #     self.down3 = torch.utilss.checkpoint(self.down3)
-    #     self.down4 = torch.utilss.checkpoint(self.down4)
-    #     self.up1 = torch.utilss.checkpoint(self.up1)
-    #     self.up2 = torch.utilss.checkpoint(self.up2)
-    #     self.up3 = torch.utilss.checkpoint(self.up3)
-    #     self.up4 = torch.utilss.checkpoint(self.up4)
-    #     self.outc = torch.utilss.checkpoint(self.outc)
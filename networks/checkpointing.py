@@ -0,0 +1,178 @@
+"""
+激活检查点
+UNet 和 S_UNet 的 DoubleConv 启用检查点后只保存输入，反向传播时重新计算块内的卷积、BN 和激活，
+用额外的前向计算换取激活显存。策略:
+- 'none': 不使用
+- 'encoder' / 'decoder': 编码器（inc、down）或解码器（up）中的全部 DoubleConv
+- 'every': 按前向顺序每 every 个 DoubleConv 选择一个
+- 'auto': 在 batch_size=1 的样本上测量每个块保存的激活和计算量，按 节省的显存 / 重新计算的计算量 从高到低选择，
+  直到估计的激活显存不超过 memory_budget_mb
+BN 的 running_mean / running_var 只在前向传播时更新，重新计算时恢复（networks.recompute），eval 的输出与不使用检查点时相同。
+"""
+import torch
+from torch import nn
+
+from networks.S_UNet import DoubleConv as S_DoubleConv
+from networks.UNet import DoubleConv
+
+CHECKPOINT_POLICIES = ('none', 'encoder', 'decoder', 'every', 'auto')
+
+
+def double_conv_blocks(net):
+    """
+    :return: [(名称, DoubleConv, 'encoder' 或 'decoder')]，按前向传播的顺序
+    """
+    blocks = []
+    for name, module in net.named_modules():
+        if isinstance(module, (DoubleConv, S_DoubleConv)):
+            part = 'encoder' if name.split('.')[0] in ('inc', 'encoder') or name.startswith('down') else 'decoder'
+            blocks.append((name, module, part))
+    return blocks
+
+
+def profile_blocks(net, sample_shape):
+    """
+    在一个样本上执行一次前向传播，统计整个网络和每个 DoubleConv 为反向传播保存的激活（字节）和乘加次数。
+    只有块内保存的激活计入该块；块的输入、以及块外也保存的输出（例如之后的 MaxPool）在启用检查点后仍然需要保存。
+    参数、BN 的统计量在测量后恢复。
+    :param sample_shape: 单个样本的形状，例如 (1, 4, 192, 192)
+    :return: (网络的激活字节数, 网络的乘加次数, {块名称: (激活字节数, 乘加次数)})
+    """
+    blocks = double_conv_blocks(net)
+    device = next(net.parameters()).device
+    parameters = {parameter.untyped_storage().data_ptr() for parameter in net.parameters()}
+    # 保存的每块存储: 字节数和保存它的块（块外为 None）
+    saved = {}
+    current = {'block': None, 'input': None}
+    totals = {'macs': 0}
+    block_stats = {name: [0, 0] for name, _, _ in blocks}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        key = storage.data_ptr()
+        if key not in parameters:
+            owner = current['block'] if key != current['input'] else None
+            saved.setdefault(key, (storage.nbytes(), set()))[1].add(owner)
+        return tensor
+
+    def block_hooks(name):
+        def pre_hook(module, inputs):
+            current['block'] = name
+            current['input'] = inputs[0].untyped_storage().data_ptr()
+
+        def post_hook(module, inputs, output):
+            current['block'] = None
+        return pre_hook, post_hook
+
+    def conv_hook(module, inputs, output):
+        # 每个输出元素（转置卷积为每个输入元素）的乘加次数为 weight[0] 的元素数量
+        count = inputs[0].numel() if isinstance(module, nn.ConvTranspose2d) else output.numel()
+        macs = count * module.weight[0].numel()
+        totals['macs'] += macs
+        if current['block'] is not None:
+            block_stats[current['block']][1] += macs
+
+    handles = []
+    for name, module, _ in blocks:
+        pre_hook, post_hook = block_hooks(name)
+        handles.append(module.register_forward_pre_hook(pre_hook))
+        handles.append(module.register_forward_hook(post_hook))
+    for module in net.modules():
+        if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d)):
+            handles.append(module.register_forward_hook(conv_hook))
+    buffers = [buffer.clone() for buffer in net.buffers()]
+    flags = [module.use_checkpoint for _, module, _ in blocks]
+    try:
+        for _, module, _ in blocks:
+            module.use_checkpoint = False
+        # 编译后的网络也以 eager 模式执行，钩子才能生效
+        with torch.enable_grad(), torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor), \
+                torch.compiler.set_stance('force_eager'):
+            net(torch.rand(sample_shape, device=device))
+    finally:
+        for handle in handles:
+            handle.remove()
+        for (_, module, _), flag in zip(blocks, flags):
+            module.use_checkpoint = flag
+        with torch.no_grad():
+            for buffer, backup in zip(net.buffers(), buffers):
+                buffer.copy_(backup)
+    for nbytes, owners in saved.values():
+        if len(owners) == 1 and None not in owners:
+            block_stats[next(iter(owners))][0] += nbytes
+    total_bytes = sum(nbytes for nbytes, _ in saved.values())
+    return total_bytes, totals['macs'], {name: tuple(stats) for name, stats in block_stats.items()}
+
+
+def select_blocks(blocks, policy, every=2, budget_bytes=None, profile=None):
+    """
+    :param blocks: double_conv_blocks 的结果
+    :param budget_bytes: 'auto' 时一次前向传播的激活显存预算
+    :param profile: 'auto' 时按 batch_size 放大后的 profile_blocks 结果
+    :return: 启用检查点的块名称集合
+    """
+    if policy not in CHECKPOINT_POLICIES:
+        raise ValueError(f"Invalid checkpointing policy: {policy}, expected one of {CHECKPOINT_POLICIES}")
+    if policy == 'none':
+        return set()
+    if policy in ('encoder', 'decoder'):
+        return {name for name, _, part in blocks if part == policy}
+    if policy == 'every':
+        if every < 1:
+            raise ValueError(f"every must be at least 1, got {every}")
+        return {name for index, (name, _, _) in enumerate(blocks) if index % every == every - 1}
+    if not budget_bytes or profile is None:
+        raise ValueError("The 'auto' checkpointing policy requires memory_budget_mb")
+    total_bytes, _, block_stats = profile
+    selected = set()
+    # 每单位重新计算节省的显存最多的块优先
+    for name in sorted(block_stats, key=lambda name: block_stats[name][0] / max(block_stats[name][1], 1),
+                       reverse=True):
+        if total_bytes <= budget_bytes:
+            break
+        selected.add(name)
+        total_bytes -= block_stats[name][0]
+    return selected
+
+
+def checkpointing_report(profile, selected, batch_size):
+    """
+    :param profile: 按 batch_size 放大后的 profile_blocks 结果
+    :return: 报告的每一行，第一行为汇总
+    """
+    total_bytes, total_macs, block_stats = profile
+    saved_bytes = sum(block_stats[name][0] for name in selected)
+    recomputed_macs = sum(block_stats[name][1] for name in selected)
+    mb = 1024 ** 2
+    # 一次训练 step 约为 1 次前向 + 2 倍前向计算量的反向传播
+    lines = [f"Activation checkpointing: {len(selected)}/{len(block_stats)} DoubleConv blocks, "
+             f"activations {total_bytes / mb:.1f} MB -> {(total_bytes - saved_bytes) / mb:.1f} MB per forward "
+             f"pass of {batch_size} samples (-{saved_bytes / max(total_bytes, 1) * 100:.1f}%), "
+             f"extra compute +{recomputed_macs / max(3 * total_macs, 1) * 100:.1f}%"]
+    for name, (block_bytes, block_macs) in block_stats.items():
+        lines.append(f"  {'*' if name in selected else ' '} {name}: {block_bytes / mb:.1f} MB, "
+                     f"{block_macs / 1e9:.2f} GMAC")
+    return lines
+
+
+def apply_checkpointing(net, policy='none', every=2, memory_budget_mb=0, sample_shape=None, batch_size=1):
+    """
+    为 UNet / S_UNet 的 DoubleConv 设置激活检查点。
+    :param policy: 'none'、'encoder'、'decoder'、'every' 或 'auto'
+    :param every: 'every' 时每 every 个块选择一个
+    :param memory_budget_mb: 'auto' 时一次前向传播的激活显存预算（MB，float32）
+    :param sample_shape: 单个样本的形状，为 None 时不测量也不生成报告（'auto' 时必须提供）
+    :param batch_size: 一次前向传播的样本数量，用于把测量结果换算到一次前向传播
+    :return: checkpointing_report 的报告，没有测量时为空列表
+    """
+    blocks = double_conv_blocks(net)
+    profile = None
+    if sample_shape is not None and policy != 'none':
+        # 激活和计算量都与样本数量成正比
+        total_bytes, total_macs, block_stats = profile_blocks(net, sample_shape)
+        profile = (total_bytes * batch_size, total_macs * batch_size,
+                   {name: (nbytes * batch_size, macs * batch_size) for name, (nbytes, macs) in block_stats.items()})
+    selected = select_blocks(blocks, policy, every, memory_budget_mb * 1024 ** 2, profile)
+    for name, module, _ in blocks:
+        module.use_checkpoint = name in selected
+    return checkpointing_report(profile, selected, batch_size) if profile is not None else []
@@ -0,0 +1,35 @@
+"""
+检查点块的重新计算
+torch.utils.checkpoint 在反向传播时用同一批数据重新执行一次前向传播，训练模式下 BN 会再更新一次
+running_mean / running_var / num_batches_tracked，相当于 momentum 从 0.1 变为 0.19，改变 eval 的输出。
+重新计算前保存块内全部 buffer，结束后恢复，使检查点块与普通块的统计量完全相同。
+"""
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+@contextmanager
+def preserve_buffers(module):
+    """
+    退出时把 module 的全部 buffer 恢复为进入时的值（提前停止的重新计算也会恢复）。
+    """
+    buffers = [(buffer, buffer.clone()) for buffer in module.buffers()]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for buffer, backup in buffers:
+                buffer.copy_(backup)
+
+
+def checkpoint_module(module, x):
+    """
+    以激活检查点执行 module(x)，只保存输入，重新计算时不更新 BN 的统计量。
+    """
+    if torch.compiler.is_compiling():
+        # torch.compile 把 buffer 的更新函数化后只在前向传播中执行一次，反向传播只重新计算不修改状态的运算
+        return checkpoint(module, x, use_reentrant=False)
+    return checkpoint(module, x, use_reentrant=False,
+                      context_fn=lambda: (nullcontext(), preserve_buffers(module)))
@@ -6,6 +6,8 @@ from evaluations import calculate_metrics
 from evaluations.eval import evaluation
 from networks import get_network
 from training import LossFunctions
+from training.precision import Precision
+from training.compiler import compile_model
 from utils import load_config, get_args, load_checkpoint
 
 
@@ -19,6 +21,8 @@ def main(args):
     ckpt = Path(args.load_dir if args.load_dir else config['test']['ckpt'])
 
     concat = args.concat if args.concat else config['data']['concat']
+    if args.num_works is not None:
+        config['data']['test_num_workers'] = args.num_works
 
     net = get_network(model_name, 'channels').to(device)
     # get network weights from file
@@ -32,13 +36,27 @@ def main(args):
     # loss function
     criterion = LossFunctions(concat)
 
+    # 混合精度
+    precision = Precision(args.precision if args.precision else config['test'].get('precision', 'fp32'), device)
+
+    # torch.compile，失败时回退到 eager
+    compile_config = config['test'].get('compile') or {}
+    if args.compile:
+        compile_config = {**compile_config, 'enabled': True, 'mode': args.compile}
+    compiled = None
+    if compile_config.get('enabled', False):
+        compiled = compile_model(net, criterion, compile_config.get('mode', 'default'),
+                                 compile_config.get('dynamic', 'batch'))
+
     try:
         evaluation(config=config,
                    net=net,
                    device=device,
                    criterion=criterion,
                    show_image=True,
-                   concat_method=concat)
+                   concat_method=concat,
+                   precision=precision,
+                   compiled=compiled)
     except KeyboardInterrupt:
         sys.exit(0)
 
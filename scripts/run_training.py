@@ -8,6 +8,8 @@ from training import ModelInitializer
 from training import LossFunctions
 from training import OptimizerFactory
 from training import SchedulerFactory
+from training.precision import Precision
+from training.compiler import compile_model
 from evaluations import calculate_metrics
 from training import train
 from utils import load_config, get_args, load_checkpoint
@@ -38,6 +40,9 @@ def main(args):
 
     config['train']['description'] = args.description
 
+    if args.num_works is not None:
+        config['data']['num_workers'] = args.num_works
+
     # loss function
     criterion = LossFunctions(concat)
 
@@ -47,6 +52,9 @@ def main(args):
     # learning rate scheduler
     scheduler_f = SchedulerFactory(optimizer_f.optimizer, scheduler)
 
+    # 混合精度
+    precision = Precision(args.precision if args.precision else config['train'].get('precision', 'fp32'), device)
+
     # eval
     # metric = MetricFactory
     metric = calculate_metrics
@@ -54,7 +62,8 @@ def main(args):
     # 是否从继续训练
     if args.resume:
         try:
-            last_epoch, best_loss, lr = load_checkpoint(args.resume_root, net, optimizer_f, scheduler_f, method='resume')
+            last_epoch, best_loss, lr = load_checkpoint(args.resume_root, net, optimizer_f, scheduler_f,
+                                                     method='resume', precision=precision)
             config['train']['last_epoch'] = last_epoch
             config['train']['best_loss'] = best_loss
             config['train']['last_learning_rate'] = lr
@@ -75,6 +84,16 @@ def main(args):
         initializer = ModelInitializer(method=config['train']['init_method'], uniform=True)
         initializer.initialize(net)
 
+    # torch.compile，在加载权重之后编译，失败时回退到 eager
+    compile_config = config['train'].get('compile') or {}
+    if args.compile:
+        compile_config = {**compile_config, 'enabled': True, 'mode': args.compile}
+        config['train']['compile'] = compile_config
+    compiled = None
+    if compile_config.get('enabled', False):
+        compiled = compile_model(net, criterion, compile_config.get('mode', 'default'),
+                                 compile_config.get('dynamic', 'batch'))
+
     try:
         train(config=config,
               net=net,
@@ -82,7 +101,9 @@ def main(args):
               criterion=criterion,
               optimizer_f=optimizer_f, scheduler_f=scheduler_f,
               metric=metric, resume=args.resume,
-              concat_method=concat
+              concat_method=concat,
+              precision=precision,
+              compiled=compiled
               )
     except KeyboardInterrupt:
         sys.exit(0)
@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+
+from datasets.sampler import InformativeSliceSampler
+
+
+def _foreground(patients=3, slice_deep=4, informative=2):
+    # 每个患者前 informative 个切片有前景，其余为空切片
+    foreground = np.zeros((patients, slice_deep, 4), dtype=np.float32)
+    foreground[:, :informative] = 0.5
+    return foreground
+
+
+def test_ordered_returns_every_selected_slice():
+    sampler = InformativeSliceSampler(_foreground(), empty_weight=0.5, shuffle=False)
+    assert list(sampler) == list(range(12))
+    assert len(sampler) == 12
+
+    sampler = InformativeSliceSampler(_foreground(), empty_weight=0.0, shuffle=False)
+    assert list(sampler) == [0, 1, 4, 5, 8, 9]
+    assert len(sampler) == 6
+
+
+def test_shuffled_samples_weighted_count():
+    sampler = InformativeSliceSampler(_foreground(), empty_weight=0.5, shuffle=True, seed=0)
+    indices = list(sampler)
+    # 权重之和 6 * 1 + 6 * 0.5 = 9
+    assert len(sampler) == len(indices) == 9
+    assert len(set(indices)) == 9
+    assert set(indices) <= set(range(12))
+
+    sampler = InformativeSliceSampler(_foreground(), empty_weight=0.0, shuffle=True, seed=0)
+    assert sorted(sampler) == [0, 1, 4, 5, 8, 9]
+    assert torch.equal(sampler.indices, torch.tensor([0, 1, 4, 5, 8, 9]))
@@ -0,0 +1,102 @@
+"""
+设备上的批量数据增强
+每个 step 传输到设备后（见 utils.convert_shape.iter_step_batches），对整个 step 的切片一次完成增强，DataLoader worker 不再随机翻转。
+- 几何变换: 随机水平翻转、垂直翻转、旋转90度的整数倍，同一切片的四个模态使用相同的变换
+- 强度变换: gamma、缩放和前景平移，每个切片独立选择参数，四个模态使用相同的参数
+所有变换都满足 f(0) = 0，遮蔽区域（值为 0）变换后仍为 0，因此对遮蔽后图像和原始图像分别做相同的变换，
+等价于先增强原始图像再遮蔽，遮蔽掩码不需要重新生成。
+'plane' 排列的图像先转换为 'channels' 排列，几何变换作用在每个模态上而不是整个拼接后的平面。
+"""
+import torch
+
+from utils.convert_shape import channels_to_plane, plane_to_channels
+
+
+class DeviceAugmentation:
+    def __init__(self, flip=True, rot90=False, scale=0.0, shift=0.0, gamma=0.0, concat_method='channels',
+                 seed=None):
+        """
+        :param flip: 每个切片以 0.5 的概率水平翻转、以 0.5 的概率垂直翻转
+        :param rot90: 每个切片随机旋转 0、90、180、270 度
+        :param scale: 强度乘以 [1 - scale, 1 + scale] 中的随机值，0 时不缩放
+        :param shift: 前景（大于 0 的像素）强度加上 [-shift, shift] 中的随机值，背景保持为 0
+        :param gamma: gamma 取 exp([-gamma, gamma]) 中的随机值，0 时不做 gamma 变换
+        :param concat_method: 图像的排列方式，'channels' 或 'plane'
+        :param seed: 随机种子，为 None 时每次运行使用不同的参数
+        """
+        self.flip = flip
+        self.rot90 = rot90
+        self.scale = scale
+        self.shift = shift
+        self.gamma = gamma
+        self.concat_method = concat_method
+        self.seed = seed
+        self.generators = {}
+
+    def generator(self, device):
+        if self.seed is None:
+            return None
+        device = torch.device(device)
+        if device not in self.generators:
+            self.generators[device] = torch.Generator(device=device).manual_seed(self.seed)
+        return self.generators[device]
+
+    def uniform(self, num, low, high, device, generator):
+        return torch.rand((num, 1, 1, 1), generator=generator, device=device) * (high - low) + low
+
+    def sample_params(self, num, device):
+        """
+        为一个 step 的每个切片选择增强参数，参数在设备上生成，不需要与主机同步。
+        :return: dict，几何参数形状为 (N, 1, 1, 1) 的布尔张量或整数张量，强度参数形状为 (N, 1, 1, 1)
+        """
+        generator = self.generator(device)
+        params = {}
+        if self.flip:
+            params['flip_w'] = torch.rand((num, 1, 1, 1), generator=generator, device=device) < 0.5
+            params['flip_h'] = torch.rand((num, 1, 1, 1), generator=generator, device=device) < 0.5
+        if self.rot90:
+            params['rot90'] = torch.randint(0, 4, (num, 1, 1, 1), generator=generator, device=device)
+        if self.gamma:
+            params['gamma'] = torch.exp(self.uniform(num, -self.gamma, self.gamma, device, generator))
+        if self.scale:
+            params['scale'] = self.uniform(num, 1 - self.scale, 1 + self.scale, device, generator)
+        if self.shift:
+            params['shift'] = self.uniform(num, -self.shift, self.shift, device, generator)
+        return params
+
+    def transform(self, images, params):
+        """
+        按给定参数变换一个 step 的图像。
+        :param images: 'channels' 为 (N, 4, H, W)，'plane' 为 (N, 1, 2H, 2W)
+        """
+        if self.concat_method == 'plane':
+            images = plane_to_channels(images)
+        if 'flip_w' in params:
+            images = torch.where(params['flip_w'], images.flip(-1), images)
+            images = torch.where(params['flip_h'], images.flip(-2), images)
+        if 'rot90' in params:
+            # 每个旋转角度计算一次整个 step，按切片选择结果，避免按切片索引带来的主机同步
+            rotated = images
+            for k in range(1, 4):
+                rotated = torch.where(params['rot90'] == k, torch.rot90(images, k, dims=(-2, -1)), rotated)
+            images = rotated
+        if 'gamma' in params:
+            images = images.clamp(min=0) ** params['gamma'].to(images.dtype)
+        if 'scale' in params:
+            images = images * params['scale'].to(images.dtype)
+        if 'shift' in params:
+            images = images + (images > 0) * params['shift'].to(images.dtype)
+        if 'gamma' in params or 'scale' in params or 'shift' in params:
+            # 归一化后的图像范围为 [0, 1]
+            images = images.clamp(0, 1)
+        if self.concat_method == 'plane':
+            images = channels_to_plane(images)
+        return images
+
+    def __call__(self, masked_images, original_images):
+        """
+        对遮蔽后图像和原始图像做相同的增强。
+        :return: 增强后的遮蔽后图像和原始图像
+        """
+        params = self.sample_params(original_images.shape[0], original_images.device)
+        return self.transform(masked_images, params), self.transform(original_images, params)
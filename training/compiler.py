@@ -0,0 +1,65 @@
+"""
+torch.compile
+编译网络的前向传播（DoubleConv 中 BN + LeakyReLU 等逐元素运算可以与卷积融合）和 LossFunctions 的分区域损失
+（大量小的逐元素运算和求和融合为少数几个 kernel）。
+- 网络替换的是实例的 forward，state_dict 的键、train()/eval() 和检查点都不受影响
+- dynamic='batch' 时只把第 0 维（切片数量）标记为动态，最后一个不完整的 step 一般不需要重新编译；
+  True 时所有维度都是动态的（渐进分辨率、图像块训练会改变宽高），False 时每种形状分别编译
+- 编译或第一次执行失败时打印原因并回退到 eager 模式，之后不再尝试编译
+- 编译出新计算图的调用（第一次调用、guard 失效后的重新编译）记为预热，用于把编译时间和 step 时间分开统计；
+  CPU 上切片数量为 1 以及跨过 16 时卷积的实现不同，各自编译一次
+"""
+import torch
+
+COMPILE_MODES = ('default', 'reduce-overhead', 'max-autotune')
+
+
+class CompiledFunction:
+    def __init__(self, function, name, mode='default', dynamic='batch', log=print):
+        """
+        :param function: 需要编译的函数或绑定方法
+        :param name: 打印信息时使用的名称
+        :param mode: 'default'、'reduce-overhead'（CUDA Graphs）或 'max-autotune'
+        :param dynamic: 'batch'、True、False 或 None（PyTorch 默认：形状变化后重新编译为动态形状）
+        """
+        if mode not in COMPILE_MODES:
+            raise ValueError(f"Invalid compile mode: {mode}, expected one of {COMPILE_MODES}")
+        self.function = function
+        self.name = name
+        self.mark_batch = dynamic == 'batch'
+        self.compiled = torch.compile(function, mode=mode, dynamic=None if self.mark_batch else dynamic)
+        self.log = log
+        self.failed = False
+        # 最近一次调用是否编译了新的计算图（预热）
+        self.warmup = False
+
+    def __call__(self, *args, **kwargs):
+        if self.failed:
+            self.warmup = False
+            return self.function(*args, **kwargs)
+        if self.mark_batch:
+            for arg in args:
+                if isinstance(arg, torch.Tensor) and arg.dim() > 0:
+                    torch._dynamo.maybe_mark_dynamic(arg, 0)
+        # 新的形状、train/eval 模式等使已有计算图的 guard 失效时会重新编译，通过计算图数量判断本次调用是否编译
+        graphs = torch._dynamo.utils.counters['stats']['unique_graphs']
+        try:
+            outputs = self.compiled(*args, **kwargs)
+        except Exception as e:
+            self.log(f"torch.compile of {self.name} failed, falling back to eager: {type(e).__name__}: {e}")
+            self.failed = True
+            outputs = self.function(*args, **kwargs)
+        self.warmup = self.failed or torch._dynamo.utils.counters['stats']['unique_graphs'] != graphs
+        return outputs
+
+
+def compile_model(net, criterion, mode='default', dynamic='batch', log=print):
+    """
+    编译网络的前向传播和分区域损失，原地替换 net.forward 和 criterion._loss_regions。
+    :return: [CompiledFunction]，train() 和 evaluation() 用于区分预热 step 和统计编译时间
+    """
+    compiled = [CompiledFunction(net.forward, type(net).__name__, mode, dynamic, log),
+                CompiledFunction(criterion._loss_regions, 'calculate_loss_regions', mode, dynamic, log)]
+    net.forward = compiled[0]
+    criterion._loss_regions = compiled[1]
+    return compiled
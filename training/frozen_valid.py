@@ -0,0 +1,118 @@
+"""
+固定的常驻内存验证集
+验证集只读取一次: 不翻转，每个切片使用固定的带种子掩码（或掩码库中按索引固定的掩码），
+以紧凑的张量保存在主机内存或设备上，之后每个 epoch 的验证只有计算，不同 epoch 的结果可以直接比较。
+- 原始图像: float16，'channels' 排列 (N, 4, H, W)，N 为验证集的切片总数
+- 掩码: 块级别的布尔掩码 (N, 4, grid, grid)，每个 step 在设备上展开（见 mask_generator.torch_masker.expand_block_mask）
+"""
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset
+from tqdm import tqdm
+
+from mask_generator.masker import random_block_mask
+from mask_generator.mask_bank import MaskBank
+from mask_generator.torch_masker import expand_block_mask
+from utils.convert_shape import channels_to_plane
+
+FROZEN_STORAGES = ('host', 'device', 'auto')
+
+
+class FrozenValidationSet:
+    def __init__(self, original_images, block_masks, mask_kernel_size, concat_method='channels'):
+        """
+        :param original_images: 形状为 (N, 4, H, W) 的原始图像
+        :param block_masks: 形状为 (N, 4, grid, grid) 的布尔掩码，True 表示保留
+        :param mask_kernel_size: 遮蔽块的尺寸
+        :param concat_method: 输出的排列方式，'channels' 或 'plane'
+        """
+        self.original_images = original_images
+        self.block_masks = block_masks
+        self.mask_kernel_size = mask_kernel_size
+        self.concat_method = concat_method
+
+    @classmethod
+    def from_loader(cls, loader, mask_kernel_size, binary_mask, mask_rate, mask_bank=None, seed=0,
+                    concat_method='channels', dtype=torch.float16):
+        """
+        读取验证集并生成固定的掩码。
+        :param loader: 验证集的 DataLoader，数据集需要使用 concat_method='channels'、mask_transport='device'、
+                       worker_flip=False，并且不打乱顺序；'stream' 数据集的多个 worker 交错输出不同患者的切片，
+                       读取顺序不再是切片的全局索引，需要使用不超过 1 个 worker
+        :param mask_bank: 掩码库文件，按切片的全局索引选择掩码，与不固定验证集时使用掩码库的结果相同；为 None 时由 seed 生成
+        :param seed: 生成掩码的随机种子
+        :param dtype: 原始图像的存储精度
+        """
+        if isinstance(loader.dataset, IterableDataset) and loader.num_workers > 1:
+            raise ValueError(f"Freezing a stream validation set requires at most 1 worker, got {loader.num_workers}: "
+                             f"interleaved workers would break the patient * slice_deep + slice mask indices")
+        slice_size = loader.dataset.slice_size
+        bank = None
+        if mask_bank is not None:
+            bank = MaskBank(mask_bank)
+            bank.check(slice_size, mask_kernel_size, binary_mask, mask_rate, False)
+        rng = np.random.default_rng(seed)
+        grid_size = slice_size // mask_kernel_size
+        originals, masks = [], []
+        num = 0
+        for _, original_images in tqdm(loader, desc="Freezing validation set", unit="batch"):
+            # 患者级 (B, D, 4, H, W) 与切片级 (B, 4, H, W) 统一为 (N, 4, H, W)
+            original_images = original_images.reshape(-1, *original_images.shape[-3:])
+            count = original_images.shape[0]
+            if bank is not None:
+                block_mask = bank.block(bank.indices(count, num))
+            else:
+                block_mask = random_block_mask(count, grid_size, binary_mask, mask_rate, rng=rng)
+            originals.append(original_images.to(dtype))
+            masks.append(torch.from_numpy(block_mask))
+            num += count
+        return cls(torch.cat(originals), torch.cat(masks), mask_kernel_size, concat_method)
+
+    def __len__(self):
+        return self.original_images.shape[0]
+
+    def num_steps(self, step_slice):
+        return -(-len(self) // step_slice)
+
+    def nbytes(self):
+        return sum(tensor.numel() * tensor.element_size() for tensor in (self.original_images, self.block_masks))
+
+    def to(self, storage='auto', device='cpu'):
+        """
+        选择保存位置。
+        :param storage: 'host' 保存在主机内存（有 GPU 时使用锁页内存）；'device' 保存在设备上；
+                        'auto' 时设备空闲显存的一半足够保存时放在设备上，否则保存在主机内存
+        :return: 实际的保存位置，'host' 或 'device'
+        """
+        if storage not in FROZEN_STORAGES:
+            raise ValueError(f"Invalid frozen validation storage: {storage}. Expected one of: {FROZEN_STORAGES}")
+        device = torch.device(device)
+        if storage == 'auto':
+            storage = 'host'
+            if device.type == 'cuda':
+                free, _ = torch.cuda.mem_get_info(device)
+                storage = 'device' if self.nbytes() < free // 2 else 'host'
+        if storage == 'device':
+            self.original_images = self.original_images.to(device)
+            self.block_masks = self.block_masks.to(device)
+        elif torch.cuda.is_available():
+            self.original_images = self.original_images.pin_memory()
+            self.block_masks = self.block_masks.pin_memory()
+        return storage
+
+    def iter_steps(self, step_slice, device, dtype=torch.float32):
+        """
+        按 step 输出遮蔽后图像和原始图像，与 utils.convert_shape.iter_step_batches 的输出相同。
+        :param step_slice: 每个 step 的切片数量
+        :return: 遮蔽后图像和原始图像，'channels' 为 (step_slice, 4, H, W)，'plane' 为 (step_slice, 1, 2H, 2W)
+        """
+        slice_size = self.original_images.shape[-1]
+        for start in range(0, len(self), step_slice):
+            original_images = self.original_images[start:start + step_slice].to(device, dtype, non_blocking=True)
+            block_mask = self.block_masks[start:start + step_slice].to(device, non_blocking=True)
+            masked_images = original_images * expand_block_mask(block_mask, self.mask_kernel_size, slice_size,
+                                                                dtype=dtype)
+            if self.concat_method == 'plane':
+                original_images = channels_to_plane(original_images)
+                masked_images = channels_to_plane(masked_images)
+            yield masked_images, original_images
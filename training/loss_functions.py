@@ -29,23 +29,33 @@ class LossFunctions:
         self.ssim_loss = pytorch_msssim.SSIM(data_range=1, channel=1)
         self.concat = concat_method
 
-    def calculate_loss_regions(self, y_hat, y, binary_masks):
+    def calculate_loss_regions(self, y_hat, y, binary_masks, counts=None, share=1.0):
+        """
+        :param counts: region_counts 的结果；一个 step 拆分为多个 micro-batch 时传入完整 step 的前景和背景体素数量，
+                       为 None 时使用 y 本身的数量
+        :param share: micro-batch 的样本数量占完整 step 的比例，用于 SSIM（样本平均）
+        传入 counts 和 share 时，各 micro-batch 的损失之和等于完整 step 的损失。
+        """
         assert binary_masks is not None, "Binary masks must be provided"
+        # 混合精度时网络输出为 bf16/fp16，SSIM 的方差项（E[x^2] - E[x]^2）在低精度下误差很大，
+        # 因此关闭 autocast，全部损失在 float32 中计算
+        with torch.autocast(y.device.type, enabled=False):
+            mse_loss, ssim_loss = self._loss_regions(y_hat.float(), y.float(), binary_masks, counts)
+        return mse_loss + share * ssim_loss
 
-        background_masks = (y > 0).float()
-        total_loss = 0
+    def regions(self, y):
         if self.concat == "plane":
             # 假设输入的尺寸为 [batch_size, 1, 2*w, 2*h]
             w, h = y.shape[2] // 2, y.shape[3] // 2
             # 从y_hat和y中提取四个区域
-            regions = {
+            return {
                 't1c': (slice(None), slice(None), slice(0, w), slice(0, h)),  # 左上
                 't1n': (slice(None), slice(None), slice(0, w), slice(h, 2 * h)),  # 右上
                 't2w': (slice(None), slice(None), slice(w, 2 * w), slice(0, h)),  # 左下
                 't2f': (slice(None), slice(None), slice(w, 2 * w), slice(h, 2 * h)),  # 右下
             }
         elif self.concat == "channels":
-            regions = {
+            return {
                 't1c': (slice(None), slice(0, 1), slice(None), slice(None)),  # 第1个通道
                 't1n': (slice(None), slice(1, 2), slice(None), slice(None)),  # 第2个通道
                 't2w': (slice(None), slice(2, 3), slice(None), slice(None)),  # 第3个通道
@@ -54,6 +64,28 @@ class LossFunctions:
         else:
             raise ValueError(f"Invalid concat mode: {self.concat}")
 
+    def region_counts(self, y):
+        """
+        每个区域的前景（y > 0）和背景体素数量。
+        :return: 形状为 (4, 2) 的张量
+        """
+        background_masks = (y > 0).float()
+        regions = self.regions(y)
+        return torch.stack([torch.stack([torch.sum(background_masks[regions[region]]),
+                                         torch.sum(1 - background_masks[regions[region]])])
+                            for region in ['t1c', 't1n', 't2w', 't2f']])
+
+    def _loss_regions(self, y_hat, y, binary_masks, counts=None):
+        """
+        :return: (加权的 MSE 损失, 加权的 1 - SSIM)；share 在外部相乘，torch.compile 不会因为 share 变化重新编译
+        """
+        background_masks = (y > 0).float()
+        total_mse_loss = 0
+        total_ssim_loss = 0
+        regions = self.regions(y)
+        if counts is None:
+            counts = self.region_counts(y)
+
         # 计算每个区域的权重
         weights = calculate_weights(binary_masks)
 
@@ -68,11 +100,11 @@ class LossFunctions:
 
             # 计算非背景部分的 MSE 损失
             non_background_mse = mse * region_background_mask
-            non_background_loss = torch.sum(non_background_mse) / (torch.sum(region_background_mask) + 1e-8)
+            non_background_loss = torch.sum(non_background_mse) / (counts[idx, 0] + 1e-8)
 
             # 计算背景部分的 MSE 损失
             background_mse = mse * (1 - region_background_mask)
-            background_loss = torch.sum(background_mse) / (torch.sum(1 - region_background_mask) + 1e-8)
+            background_loss = torch.sum(background_mse) / (counts[idx, 1] + 1e-8)
 
             # 加权非背景和背景损失
             combined_mse_loss = (1 - self.background_weight) * non_background_loss + self.background_weight * background_loss
@@ -81,10 +113,11 @@ class LossFunctions:
             # 你可以根据需要调整损失的权重或合并策略
             # combined_loss = mse + (1 - ssim)
             # total_loss += combined_loss
-            total_loss += weights[idx] * (combined_mse_loss + (1 - ssim))
+            total_mse_loss += weights[idx] * combined_mse_loss
+            total_ssim_loss += weights[idx] * (1 - ssim)
             # total_loss += weights[idx] * mse.mean()/
 
-        return total_loss
+        return total_mse_loss, total_ssim_loss
 
     # def calculate_loss_no_background(self, y_hat, y):
     #     """
@@ -0,0 +1,104 @@
+"""
+随机图像块训练
+每个 step 传输到设备后，从每个切片中随机剪裁若干个 patch_size*patch_size 的图像块代替完整切片输入 UNet（全卷积网络）。
+- 图像块的左上角位于遮蔽块网格上（mask_kernel_size 的整数倍），patch_size 也是 mask_kernel_size 的整数倍，
+  图像块中只包含完整的遮蔽块
+- 按每个位置的前景比例（任意模态 > 0，与 LossFunctions 的判断相同）加权采样，foreground_bias 控制偏向前景的程度
+- 同一切片的四个模态使用相同的位置，'plane' 排列先转换为 'channels' 排列再剪裁
+- mask.is_random 时遮蔽块的尺寸从 PRO_SIZE 中随机选择，图像块的网格无法与所有尺寸对齐，不能同时使用
+验证和推理仍然使用完整切片。
+"""
+import torch
+import torch.nn.functional as F
+
+from utils.convert_shape import channels_to_plane, plane_to_channels
+
+
+class PatchSampler:
+    def __init__(self, patch_size, patches_per_slice=4, mask_kernel_size=1, foreground_bias=0.8,
+                 concat_method='channels', seed=None, mask_is_random=False):
+        """
+        :param patch_size: 图像块的尺寸，需要是 mask_kernel_size 的整数倍
+        :param patches_per_slice: 每个切片剪裁的图像块数量，一个 step 的样本数量为 切片数量 * patches_per_slice
+        :param mask_kernel_size: 遮蔽块的尺寸，图像块的位置按该尺寸对齐
+        :param foreground_bias: 0 时均匀采样位置，1 时完全按前景比例采样
+        :param concat_method: 图像的排列方式，'channels' 或 'plane'
+        :param seed: 随机种子，为 None 时每次运行使用不同的位置
+        :param mask_is_random: 遮蔽块的尺寸是否随机，为 True 时抛出异常
+        """
+        if mask_is_random:
+            raise ValueError("Patch training cannot be combined with mask.is_random: patches aligned to "
+                             "mask_kernel_size would cut through random mask blocks (PRO_SIZE, including 3)")
+        if patch_size % mask_kernel_size:
+            raise ValueError(f"patch_size={patch_size} must be a multiple of mask_kernel_size={mask_kernel_size}")
+        self.patch_size = patch_size
+        self.patches_per_slice = patches_per_slice
+        self.mask_kernel_size = mask_kernel_size
+        self.foreground_bias = foreground_bias
+        self.concat_method = concat_method
+        self.seed = seed
+        self.generators = {}
+
+    def generator(self, device):
+        if self.seed is None:
+            return None
+        device = torch.device(device)
+        if device not in self.generators:
+            self.generators[device] = torch.Generator(device=device).manual_seed(self.seed)
+        return self.generators[device]
+
+    def sample_positions(self, original_images):
+        """
+        为每个切片选择图像块的位置。
+        :param original_images: 'channels' 排列的原始图像 (N, 4, S, S)
+        :return: 左上角的行、列坐标，形状均为 (N * patches_per_slice,)
+        """
+        k = self.mask_kernel_size
+        blocks = self.patch_size // k
+        num = original_images.shape[0]
+        slice_size = original_images.shape[-1]
+        if self.patch_size > slice_size:
+            raise ValueError(f"patch_size={self.patch_size} is larger than the slice ({slice_size})")
+        # 每个遮蔽块的前景比例，再对图像块覆盖的 blocks*blocks 个遮蔽块求平均，得到每个候选位置的前景比例 (N, G, G)
+        foreground = (original_images > 0).any(dim=1, keepdim=True).to(original_images.dtype)
+        block_foreground = F.avg_pool2d(foreground[..., :slice_size // k * k, :slice_size // k * k], k)
+        scores = F.avg_pool2d(block_foreground, blocks, stride=1)[:, 0]
+        grid = scores.shape[-1]
+        scores = scores.reshape(num, -1)
+        # 前景比例归一化后与均匀分布混合，全部为背景的切片均匀采样
+        total = scores.sum(dim=1, keepdim=True)
+        foreground_weights = torch.where(total > 0, scores / total.clamp(min=1e-8), 1.0 / scores.shape[1])
+        weights = (1 - self.foreground_bias) / scores.shape[1] + self.foreground_bias * foreground_weights
+        index = torch.multinomial(weights.float(), self.patches_per_slice, replacement=True,
+                                  generator=self.generator(original_images.device)).reshape(-1)
+        return index // grid * k, index % grid * k
+
+    def crop(self, images, rows, cols):
+        """
+        按位置剪裁图像块，每个切片对应 patches_per_slice 个连续的图像块。
+        :param images: 'channels' 排列的图像 (N, 4, S, S)
+        :return: (N * patches_per_slice, 4, patch_size, patch_size)
+        """
+        offsets = torch.arange(self.patch_size, device=images.device)
+        slice_index = torch.arange(images.shape[0], device=images.device).repeat_interleave(self.patches_per_slice)
+        row_index = (rows[:, None] + offsets)[:, :, None]
+        col_index = (cols[:, None] + offsets)[:, None, :]
+        # 高级索引被切片隔开时结果的维度为 (N * P, patch_size, patch_size, 4)
+        return images[slice_index[:, None, None], :, row_index, col_index].permute(0, 3, 1, 2)
+
+    def __call__(self, masked_images, original_images):
+        """
+        :param masked_images: 遮蔽后图像，'channels' 为 (N, 4, S, S)，'plane' 为 (N, 1, 2S, 2S)
+        :param original_images: 原始图像，形状与 masked_images 相同
+        :return: 遮蔽后图像块和原始图像块，'channels' 为 (N * P, 4, K, K)，'plane' 为 (N * P, 1, 2K, 2K)
+        """
+        if self.concat_method == 'plane':
+            masked_images = plane_to_channels(masked_images)
+            original_images = plane_to_channels(original_images)
+        rows, cols = self.sample_positions(original_images)
+        masked_patches = self.crop(masked_images, rows, cols)
+        original_patches = self.crop(original_images, rows, cols)
+        if self.concat_method == 'plane':
+            masked_patches = channels_to_plane(masked_patches.contiguous())
+            original_patches = channels_to_plane(original_patches.contiguous())
+        return masked_patches, original_patches
@@ -0,0 +1,54 @@
+"""
+混合精度
+'fp32' 全部使用 float32；'bf16' 在 autocast 中以 bfloat16 计算卷积和矩阵乘法（CPU 和支持 bf16 的 GPU）；
+'fp16' 以 float16 计算（只支持 CUDA），float16 的指数范围小，反向传播前用 GradScaler 放大损失防止梯度下溢。
+bf16 与 float32 的指数范围相同，不需要缩放。
+网络参数和优化器状态始终为 float32，LossFunctions 和验证指标在 float32 中计算。
+"""
+import torch
+
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+PRECISION_DTYPES = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+class Precision:
+    def __init__(self, name='fp32', device='cpu'):
+        """
+        :param name: 'fp32'、'bf16' 或 'fp16'
+        :param device: 运行设备，决定 autocast 和 GradScaler 的设备类型
+        """
+        if name not in PRECISIONS:
+            raise ValueError(f"Invalid precision: {name}, expected one of {PRECISIONS}")
+        self.device_type = torch.device(device).type
+        if name == 'fp16' and self.device_type != 'cuda':
+            raise ValueError("fp16 requires a CUDA device, use bf16 on CPU")
+        if name == 'bf16' and self.device_type == 'cuda' and not torch.cuda.is_bf16_supported():
+            raise ValueError("This GPU does not support bf16, use fp16")
+        self.name = name
+        self.dtype = PRECISION_DTYPES[name]
+        self.enabled = name != 'fp32'
+        # 未启用时 scale 直接返回损失，step 直接调用 optimizer.step()
+        self.scaler = torch.amp.GradScaler(self.device_type, enabled=name == 'fp16')
+
+    def autocast(self):
+        """
+        前向传播和损失计算的上下文，fp32 时不做任何转换。
+        """
+        return torch.autocast(self.device_type, dtype=self.dtype, enabled=self.enabled)
+
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+
+    def step(self, optimizer_f):
+        """
+        更新模型参数，fp16 时先还原梯度的缩放，出现 inf/nan 的 step 会被跳过并减小缩放系数。
+        """
+        self.scaler.step(optimizer_f.optimizer)
+        self.scaler.update()
+
+    def state_dict(self):
+        return self.scaler.state_dict()
+
+    def load_state_dict(self, state_dict):
+        if state_dict:
+            self.scaler.load_state_dict(state_dict)
@@ -0,0 +1,53 @@
+"""
+渐进分辨率训练
+前几个 epoch 使用较小的切片尺寸（例如 96 或 128），之后切换到完整的 slice_size。
+每个 step 传输到设备后按面积下采样（整数倍的均值池化），DataLoader、缓存和遮蔽算法都不需要改动；
+UNet 是全卷积网络，不同分辨率使用同一组权重。切片尺寸减半时每个 step 的计算量约为 1/4。
+下采样倍数需要整除 mask_kernel_size，遮蔽块的边界与池化窗口对齐，下采样后遮蔽区域仍然为 0，
+等价于在低分辨率上使用 mask_kernel_size / 倍数 的遮蔽块。
+mask.is_random 时每个切片的遮蔽块尺寸从 PRO_SIZE 中随机选择（包括 3），没有与任何下采样倍数对齐的尺寸，不能同时使用。
+"""
+import torch.nn.functional as F
+
+
+class ResolutionSchedule:
+    def __init__(self, stages, slice_size, mask_kernel_size=None, mask_is_random=False):
+        """
+        :param stages: [[起始 epoch, 切片尺寸], ...]，例如 [[0, 96], [20, 192]]，第一个阶段之前使用 slice_size
+        :param slice_size: 完整的切片尺寸
+        :param mask_kernel_size: 遮蔽块的尺寸，用于检查下采样倍数是否与遮蔽块对齐，为 None 时不检查
+        :param mask_is_random: 遮蔽块的尺寸是否随机，为 True 时不允许下采样
+        """
+        self.slice_size = slice_size
+        self.stages = sorted((int(epoch), int(size)) for epoch, size in stages)
+        for epoch, size in self.stages:
+            if size > slice_size or slice_size % size:
+                raise ValueError(f"Resolution {size} at epoch {epoch} must divide slice_size={slice_size}")
+            factor = slice_size // size
+            if mask_is_random and factor > 1:
+                raise ValueError(f"Resolution {size} at epoch {epoch} cannot be combined with mask.is_random: "
+                                 f"random mask blocks (PRO_SIZE, including 3) would not stay aligned")
+            if mask_kernel_size is not None and mask_kernel_size % factor:
+                raise ValueError(f"Resolution {size} at epoch {epoch} downsamples by {factor}, which does not divide "
+                                 f"mask_kernel_size={mask_kernel_size}; mask blocks would not stay aligned")
+
+    def size(self, epoch):
+        """
+        :return: 该 epoch 的切片尺寸
+        """
+        size = self.slice_size
+        for start, stage_size in self.stages:
+            if epoch >= start:
+                size = stage_size
+        return size
+
+    def resize(self, images, size):
+        """
+        将一个 step 的图像下采样到 size。
+        :param images: 'channels' 为 (N, 4, slice_size, slice_size)，'plane' 为 (N, 1, 2 * slice_size, 2 * slice_size)
+        """
+        factor = self.slice_size // size
+        if factor == 1:
+            return images
+        # 整数倍下采样时面积插值即为不重叠的均值池化，'plane' 的四个象限边界同样对齐
+        return F.avg_pool2d(images, factor)
@@ -1,5 +1,6 @@
 import datetime
 import os
+import time
 from pathlib import Path
 
 import torch
@@ -8,11 +9,23 @@ from tqdm import tqdm
 from utils import Logger, TensorboardLogger, create_checkpoint
 
 from datasets import get_brats_dataloader
-from utils.convert_shape import swap_batch_slice_dimensions, delete_batch_dimensions
+from datasets.packed_store import packed_path
+from datasets.sampler import foreground_path
+from datasets.manifest import manifest_path
+from utils.convert_shape import iter_step_batches
+from training.augmentation import DeviceAugmentation
+from training.frozen_valid import FrozenValidationSet
+from training.resolution import ResolutionSchedule
+from training.patches import PatchSampler
+from training.precision import Precision
+from networks.checkpointing import apply_checkpointing
+from mask_generator.torch_masker import DeviceMasker
+from mask_generator.mask_bank import mask_bank_path
 from mask_generator import random_masked_area
 
 
-def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resume, concat_method='plane'):
+def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resume, concat_method='plane',
+          precision=None, compiled=None):
     # 剪裁后切片的数量
     slice_deep = config['train']['slice_deep']
     # 剪裁后切片的宽高尺寸
@@ -21,6 +34,11 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
     batch_size = config['train']['batch_size']
     # 每步使用的切片数量，默认小于slice_deep
     step_slice = config['train']['step_slice']
+    # 数据集的粒度，'patient' 每个样本为一个人，'slice' 每个样本为一个切片，同一个 step 可以混合多个人的切片
+    level = config['train'].get('level', 'patient')
+    slice_level = level in ('slice', 'stream')
+    # 切片级（包括流式）数据集中 DataLoader 的 batch 即为一个 step
+    loader_batch_size = step_slice if slice_level else batch_size
 
     # 遮蔽块的宽高尺寸
     mask_kernel_size = config['mask']['mask_kernel_size']
@@ -34,24 +52,163 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
     test_mask_rate = config['mask']['test_mask_rate']
 
     mask_is_random = config['mask']['is_random']
+    # 遮蔽掩码的传输方式，'block' 时 DataLoader 只输出块级别掩码，在设备上展开；'device' 时在设备上生成掩码
+    mask_transport = config['mask'].get('transport', 'dense')
+    train_masker = DeviceMasker(mask_kernel_size, train_binary_mask, train_mask_rate, mask_is_random, concat_method)
+    valid_masker = DeviceMasker(mask_kernel_size, test_binary_mask, test_mask_rate, False, concat_method)
+    # 预先生成的掩码库，训练随机选择掩码，验证使用固定的掩码
+    mask_bank_dir = config['mask'].get('bank_dir')
+    bank_size = config['mask'].get('bank_size', 65536)
+    bank_seed = config['mask'].get('bank_seed', 0)
+    train_bank = mask_bank_path(mask_bank_dir, slice_size, mask_kernel_size, train_binary_mask, train_mask_rate,
+                                mask_is_random, bank_seed, bank_size) if mask_bank_dir else None
+    valid_bank = mask_bank_path(mask_bank_dir, slice_size, mask_kernel_size, test_binary_mask, test_mask_rate,
+                                False, bank_seed, bank_size) if mask_bank_dir else None
 
     # 训练轮数
     epochs = config['train']['epochs']
+    # 梯度累积: 每个 step 拆分为 micro_batch 个样本的前向/反向传播（0 时不拆分），
+    # 每 accumulation_steps 个 step 更新一次模型参数，一次更新覆盖 step_slice * accumulation_steps 个切片
+    micro_batch = config['train'].get('micro_batch', 0)
+    accumulation_steps = config['train'].get('accumulation_steps', 1)
+    if micro_batch < 0 or accumulation_steps < 1:
+        raise ValueError(f"Invalid micro_batch={micro_batch} or accumulation_steps={accumulation_steps}")
+    # 混合精度，'fp32'、'bf16' 或 'fp16'（只支持 CUDA）
+    if precision is None:
+        precision = Precision(config['train'].get('precision', 'fp32'), device)
+    # torch.compile 编译后的函数（training.compiler.compile_model），用于区分编译（预热）step 和正常 step 的时间
+    compiled = compiled or []
 
 
     # 训练数据集与验证数据集
     brats_train_root = config['data']['train']
     brats_valid_root = config['data']['valid']
-    train_loader = get_brats_dataloader(root_dir=brats_train_root, batch_size=batch_size, slice_deep=slice_deep,
+    # 预处理结果的缓存目录与存储精度
+    cache_dir = config['data'].get('cache_dir')
+    cache_dtype = config['data'].get('cache_dtype', 'float32')
+    # NIfTI 读取后端，'auto' 时自动选择当前机器上最快的后端
+    reader = config['data'].get('reader', 'sitk')
+    reader_index_dir = config['data'].get('reader_index_dir')
+    # 强度归一化: 统计索引、百分位数计算方法和计算精度
+    stats_file = config['data'].get('stats_file')
+    # 数据集清单目录（python utils/build_manifest.py 生成），开始训练前检查缺失或损坏的文件，并按内容指纹使缓存失效
+    manifest_dir = config['data'].get('manifest_dir')
+    train_manifest = manifest_path(manifest_dir, brats_train_root) if manifest_dir else None
+    valid_manifest = manifest_path(manifest_dir, brats_valid_root) if manifest_dir else None
+    norm_method = config['data'].get('norm_method', 'partition')
+    norm_dtype = config['data'].get('norm_dtype', 'float32')
+    # 样本的精度，float16 可以减少 worker 到主进程的传输量，传输到设备后再转换为 float32
+    sample_dtype = config['data'].get('sample_dtype', 'float32')
+    # 每个 worker 内并发读取四个模态的线程数量，'auto' 时根据 CPU 核数和 worker 数量分配
+    decode_threads = config['data'].get('decode_threads', 0)
+    # DataLoader worker 数量，'auto' 时预热测量后选择 worker 数量和预取深度
+    num_workers = config['data'].get('num_workers', 6)
+    valid_num_workers = config['data'].get('valid_num_workers', 4)
+    persistent_workers = config['data'].get('persistent_workers', False)
+    prefetch_factor = config['data'].get('prefetch_factor')
+    tune_batches = config['data'].get('tune_batches', 8)
+    # 跨 worker 共享的内存缓存大小（MB），训练集和验证集各自使用一块，0 时不使用
+    shared_cache_mb = config['data'].get('shared_cache_mb', 0)
+    # 数据划分目录，以及打包后单文件数据的目录
+    list_dir = config['data'].get('list_dir', "data/list/pre-test-50")
+    packed_dir = config['data'].get('packed_dir')
+    train_packed = packed_path(packed_dir, list_dir, 'train') if packed_dir else None
+    valid_packed = packed_path(packed_dir, list_dir, 'valid') if packed_dir else None
+    # 前景索引目录，切片级训练时跳过或降低空切片的采样权重，验证集使用全部切片；
+    # 只用于 level='slice'，流式数据集按患者顺序读取、没有采样器，忽略前景索引
+    foreground_dir = config['data'].get('foreground_dir')
+    train_foreground = foreground_path(foreground_dir, list_dir, 'train', slice_deep,
+                                       slice_size) if foreground_dir and level == 'slice' else None
+    foreground_threshold = config['train'].get('foreground_threshold', 0.01)
+    empty_weight = config['train'].get('empty_weight', 0.0)
+    # 流式数据集的随机缓冲区大小
+    shuffle_buffer = config['train'].get('shuffle_buffer', 256)
+    # 设备上的批量数据增强，启用后训练集的 DataLoader worker 不再随机翻转
+    augment_config = config['train'].get('augmentation') or {}
+    augmentation = None
+    if augment_config.get('enabled', False):
+        augmentation = DeviceAugmentation(flip=augment_config.get('flip', True),
+                                          rot90=augment_config.get('rot90', False),
+                                          scale=augment_config.get('scale', 0.0),
+                                          shift=augment_config.get('shift', 0.0),
+                                          gamma=augment_config.get('gamma', 0.0),
+                                          concat_method=concat_method)
+    # 渐进分辨率: [[起始 epoch, 切片尺寸], ...]，在设备上下采样，验证始终使用完整分辨率
+    resolution_stages = config['train'].get('resolution_schedule') or []
+    resolution = ResolutionSchedule(resolution_stages, slice_size, mask_kernel_size,
+                                    mask_is_random) if resolution_stages else None
+    # 随机图像块训练: 每个切片剪裁 per_slice 个 size*size 的图像块（与遮蔽块对齐、偏向前景），size 为 0 时使用完整切片
+    patch_config = config['train'].get('patch') or {}
+    patch_sampler = None
+    if patch_config.get('size', 0):
+        patch_sampler = PatchSampler(patch_config['size'], patch_config.get('per_slice', 4), mask_kernel_size,
+                                     patch_config.get('foreground_bias', 0.8), concat_method,
+                                     mask_is_random=mask_is_random)
+    # 激活检查点: none / encoder / decoder / every / auto，按一次前向传播的样本数量（完整分辨率）估计显存和额外计算量
+    checkpoint_config = config['train'].get('checkpointing') or {}
+    patch_size = patch_sampler.patch_size if patch_sampler is not None else slice_size
+    forward_samples = micro_batch or step_slice * (patch_sampler.patches_per_slice if patch_sampler is not None else 1)
+    checkpoint_report = apply_checkpointing(
+        net, checkpoint_config.get('policy', 'none'), checkpoint_config.get('every', 2),
+        checkpoint_config.get('memory_budget_mb', 0),
+        (1, 4, patch_size, patch_size) if concat_method == 'channels' else (1, 1, 2 * patch_size, 2 * patch_size),
+        forward_samples)
+    # 固定的验证集: 只读取一次，不翻转，使用固定的掩码，保存为紧凑的张量；保存位置 host / device / auto
+    frozen_valid = config['train'].get('frozen_valid', False)
+    frozen_valid_storage = config['train'].get('frozen_valid_storage', 'auto')
+    valid_seed = config['train'].get('valid_seed', 0)
+    train_loader = get_brats_dataloader(root_dir=brats_train_root, batch_size=loader_batch_size, slice_deep=slice_deep,
                                         slice_size=slice_size,
                                         mask_kernel_size=mask_kernel_size, binary_mask=train_binary_mask,
                                         mask_rate=train_mask_rate, is_random=mask_is_random,
-                                        num_workers=6, mode='train', concat_method=concat_method)
-    valid_loader = get_brats_dataloader(root_dir=brats_valid_root, batch_size=batch_size, slice_deep=slice_deep,
-                                        slice_size=slice_size,
-                                        mask_kernel_size=mask_kernel_size, binary_mask=test_binary_mask,
-                                        mask_rate=test_mask_rate,
-                                        num_workers=4, mode='valid', concat_method=concat_method)
+                                        num_workers=num_workers, persistent_workers=persistent_workers,
+                                        prefetch_factor=prefetch_factor, tune_batches=tune_batches,
+                                        mode='train', concat_method=concat_method,
+                                        cache_dir=cache_dir, cache_dtype=cache_dtype,
+                                        list_dir=list_dir, packed_file=train_packed, level=level,
+                                        reader=reader, reader_index_dir=reader_index_dir,
+                                        stats_file=stats_file, norm_method=norm_method, norm_dtype=norm_dtype,
+                                        decode_threads=decode_threads, sample_dtype=sample_dtype,
+                                        mask_transport=mask_transport, mask_bank=train_bank,
+                                        shared_cache_mb=shared_cache_mb, foreground_index=train_foreground,
+                                        foreground_threshold=foreground_threshold, empty_weight=empty_weight,
+                                        shuffle_buffer=shuffle_buffer, worker_flip=augmentation is None,
+                                        manifest=train_manifest)
+    if frozen_valid:
+        # 只读取原始图像（'channels' 排列，不翻转），掩码由 FrozenValidationSet 固定生成；
+        # 'stream' 只用一个 worker 按顺序读取，切片的顺序即为掩码库的全局索引（只读取一次）
+        valid_loader = get_brats_dataloader(root_dir=brats_valid_root, batch_size=loader_batch_size,
+                                            slice_deep=slice_deep, slice_size=slice_size,
+                                            mask_kernel_size=mask_kernel_size, binary_mask=test_binary_mask,
+                                            mask_rate=test_mask_rate,
+                                            num_workers=1 if level == 'stream' else valid_num_workers,
+                                            prefetch_factor=prefetch_factor, tune_batches=tune_batches,
+                                            mode='valid', concat_method='channels',
+                                            cache_dir=cache_dir, cache_dtype=cache_dtype,
+                                            list_dir=list_dir, packed_file=valid_packed, level=level,
+                                            reader=reader, reader_index_dir=reader_index_dir,
+                                            stats_file=stats_file, norm_method=norm_method, norm_dtype=norm_dtype,
+                                            decode_threads=decode_threads, sample_dtype=sample_dtype,
+                                            mask_transport='device', worker_flip=False, manifest=valid_manifest)
+        frozen_valid = FrozenValidationSet.from_loader(valid_loader, mask_kernel_size, test_binary_mask,
+                                                       test_mask_rate, valid_bank, valid_seed, concat_method)
+        frozen_valid_storage = frozen_valid.to(frozen_valid_storage, device)
+    else:
+        frozen_valid = None
+        valid_loader = get_brats_dataloader(root_dir=brats_valid_root, batch_size=loader_batch_size,
+                                            slice_deep=slice_deep, slice_size=slice_size,
+                                            mask_kernel_size=mask_kernel_size, binary_mask=test_binary_mask,
+                                            mask_rate=test_mask_rate,
+                                            num_workers=valid_num_workers, persistent_workers=persistent_workers,
+                                            prefetch_factor=prefetch_factor, tune_batches=tune_batches,
+                                            mode='valid', concat_method=concat_method,
+                                            cache_dir=cache_dir, cache_dtype=cache_dtype,
+                                            list_dir=list_dir, packed_file=valid_packed, level=level,
+                                            reader=reader, reader_index_dir=reader_index_dir,
+                                            stats_file=stats_file, norm_method=norm_method, norm_dtype=norm_dtype,
+                                            decode_threads=decode_threads, sample_dtype=sample_dtype,
+                                            mask_transport=mask_transport, mask_bank=valid_bank,
+                                            shared_cache_mb=shared_cache_mb, manifest=valid_manifest)
 
     # 定义模型保存路径
     save_root = "result/models/" + config['train']['model']
@@ -69,12 +226,44 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
         'slice_size': slice_size,
         'batch_size': batch_size,
         'step_slice': step_slice,
+        'level': level,
 
         'mask_kernel_size': mask_kernel_size,
         'train_binary_mask': train_binary_mask,
         'test_binary_mask': test_binary_mask,
         'train_mask_rate': train_mask_rate,
         'test_mask_rate': test_mask_rate,
+        'mask_transport': mask_transport,
+        'mask_bank_dir': mask_bank_dir,
+        'cache_dir': cache_dir,
+        'list_dir': list_dir,
+        'packed_dir': packed_dir,
+        'reader': reader,
+        'stats_file': stats_file,
+        'manifest_dir': manifest_dir,
+        'norm_method': norm_method,
+        'norm_dtype': norm_dtype,
+        'decode_threads': decode_threads,
+        'num_workers': train_loader.num_workers,
+        'valid_num_workers': valid_loader.num_workers,
+        'persistent_workers': persistent_workers,
+        'prefetch_factor': train_loader.prefetch_factor,
+        'shared_cache_mb': shared_cache_mb,
+        'frozen_valid': f"{frozen_valid_storage}, {frozen_valid.nbytes() / 1024 ** 2:.1f} MB"
+                        if frozen_valid is not None else False,
+        'foreground_index': train_foreground,
+        'foreground_threshold': foreground_threshold,
+        'empty_weight': empty_weight,
+        'shuffle_buffer': shuffle_buffer,
+        'augmentation': augment_config if augmentation is not None else None,
+        'sample_dtype': sample_dtype,
+        'resolution_schedule': resolution_stages,
+        'patch': patch_config if patch_sampler is not None else None,
+        'precision': precision.name,
+        'micro_batch': micro_batch,
+        'accumulation_steps': accumulation_steps,
+        'checkpointing': checkpoint_config.get('policy', 'none'),
+        'compile': config['train'].get('compile') if compiled else None,
 
         'epochs': epochs,
         'device': device,
@@ -85,6 +274,10 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
         'scheduler': config['train']['scheduler'],
     }
     logger_fac.log_config(training_settings)
+    if checkpoint_report:
+        logger_fac.info(checkpoint_report[0])
+        for line in checkpoint_report[1:]:
+            logger_f.info(line)
 
     # 创建 TensorBoard 记录器
     tb_logger = TensorboardLogger(save_root)
@@ -92,10 +285,14 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
     # 训练网络
     logger_fac.info("Training Start")
 
-    # 训练所需的所有2D图像数量=训练数据集长度（人数） * 剪裁后的切片数量
-    epoch_slice = train_loader.dataset.__len__() * slice_deep
-    # 每个epoch包含的step数量
+    # 每个人划分的step数量
     step_per_epoch = slice_deep // step_slice
+    if slice_level:
+        # 切片级数据集每个 epoch 的切片数量由采样器决定，使用前景索引时不包含被跳过的空切片；流式数据集为全部切片
+        epoch_slice = len(train_loader.dataset) if level == 'stream' else len(train_loader.sampler)
+    else:
+        # 训练所需的所有2D图像数量=训练数据集长度（人数） * 剪裁后的切片数量
+        epoch_slice = train_loader.dataset.__len__() * slice_deep
 
     if resume:
         start_epoch = config['train']['last_epoch']
@@ -111,8 +308,8 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
 
     # 已处理的step数量
     processed_step = 0
-    # 总共的step数量
-    total_step = step_per_epoch * train_loader.dataset.__len__()
+    # 每个epoch的step数量
+    total_step = len(train_loader) if slice_level else step_per_epoch * train_loader.dataset.__len__()
     for epoch in range(start_epoch, epochs):
         # 确保模型处于训练模式
         net.train()
@@ -121,67 +318,110 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
         # 计数当前epoch的step数量，每个epoch清零
         epoch_processed_step = 0
         epoch_processed_slices = 0
+        # 正常 step 的时间和编译（预热）step 的时间
+        step_time = 0.0
+        compile_time = 0.0
+        compile_steps = 0
+        # 当前已累积梯度的 step 数量和本 epoch 的参数更新次数
+        accumulated_steps = 0
+        optimizer_steps = 0
+        optimizer_f.zero_grad()
         logger_f.info(f"Epoch: {epoch + 1} - Current lr: {optimizer_f.get_learning_rate()}")
+        train_size = resolution.size(epoch) if resolution is not None else slice_size
+        if train_size != slice_size:
+            logger_f.info(f"Epoch: {epoch + 1} - Training resolution: {train_size}")
         with tqdm(train_loader, desc=f"Epoch {epoch + 1}/{epochs}", unit="batch_person") as pbar:
-            for masked_images, original_images in pbar:
-                # 将数据和标签移动到设备上
-                # 交换维度Batch_size和slice_size
-                # 将slice_size作为真实的Batch_size
-                # Batch_size设置为1，交换后代表单通道图像)
-                if concat_method == 'plane':
-                    masked_images = swap_batch_slice_dimensions(masked_images).to(device)
-                    original_images = swap_batch_slice_dimensions(original_images).to(device)
-                elif concat_method == 'channels':
-                    masked_images = delete_batch_dimensions(masked_images).to(device)
-                    original_images = delete_batch_dimensions(original_images).to(device)
-                # 每个epoch下的step
-                # step的数量=一个人总切片数量 // 每次step训练的切片数量
-
-                # 默认整除
-                for step in range(step_per_epoch):
-                    masked_images_step = masked_images[range(step, masked_images.shape[0],
-                                                             step_per_epoch), :, :, :]
-                    original_images_step = original_images[range(step, original_images.shape[0],
-                                                                 step_per_epoch), :, :, :]
-
-                    # 清空之前的梯度
-                    optimizer_f.zero_grad()
-
-                    # 前向传播
-                    outputs = net(masked_images_step)
+            # 每个epoch下的step
+            # 患者级: step的数量=一个人总切片数量 // 每次step训练的切片数量，默认整除
+            for masked_images_step, original_images_step in iter_step_batches(pbar, concat_method, step_per_epoch,
+                                                                              device, slice_level, mask_transport,
+                                                                              train_masker):
+                step_slices = original_images_step.shape[0]
+                if patch_sampler is not None:
+                    masked_images_step, original_images_step = patch_sampler(masked_images_step, original_images_step)
+                if train_size != slice_size:
+                    masked_images_step = resolution.resize(masked_images_step, train_size)
+                    original_images_step = resolution.resize(original_images_step, train_size)
+                if augmentation is not None:
+                    # 遮蔽后图像和原始图像使用相同的增强参数
+                    masked_images_step, original_images_step = augmentation(masked_images_step, original_images_step)
+                step_start = time.perf_counter()
+                step_samples = masked_images_step.shape[0]
+                step_loss = 0.0
+                warmup = False
+                # 拆分为 micro-batch 时 MSE 的分母使用完整 step 的前景和背景体素数量
+                step_counts = criterion.region_counts(original_images_step) if micro_batch else None
+                for masked_images_micro, original_images_micro in zip(
+                        masked_images_step.split(micro_batch or step_samples),
+                        original_images_step.split(micro_batch or step_samples)):
+                    with precision.autocast():
+                        # 前向传播
+                        outputs = net(masked_images_micro)
 
-                    # 计算损失
-                    # loss_value = criterion.calculate_loss_regions(outputs, original_images_step, binary_masks=train_binary_mask)
-                    loss_value = criterion.calculate_loss_regions(outputs, original_images_step,
-                                                                  binary_masks=train_binary_mask)
+                        # 计算损失
+                        # loss_value = criterion.calculate_loss_regions(outputs, original_images_step, binary_masks=train_binary_mask)
+                        # 各 micro-batch 的损失之和等于完整 step 的损失，累积后的梯度等于 accumulation_steps 个完整 step
+                        # 的平均损失的梯度
+                        loss_value = criterion.calculate_loss_regions(
+                            outputs, original_images_micro, binary_masks=train_binary_mask, counts=step_counts,
+                            share=masked_images_micro.shape[0] / step_samples)
 
                     # 反向传播
-                    loss_value.backward()
-
-                    # 更新模型参数
-                    optimizer_f.step()
-
-                    # 累计损失并显示批次损失均值
-                    running_loss += loss_value.item()
-                    # 更新进度条描述
-                    avg_loss = running_loss / (epoch_processed_step + 1)  # 计算当前平均损失
-                    # 更新进度变量
-                    epoch_processed_step += 1
-                    epoch_processed_slices += step_slice
-                    # 更新进度条
-                    pbar.set_description(
-                        f"Epoch {epoch + 1}/{epochs}; Step: {epoch_processed_step}/{total_step}; "
-                        f"Slice: {epoch_processed_slices}/{epoch_slice} ")
-                    pbar.set_postfix(loss=avg_loss)  # 显示当前step的平均损失
-
-                    # 更新总Step
-                    processed_step += 1
-                    # 记录训练损失到 TensorBoard
-                    logger_f.info(f"Step: {processed_step} - Train/Loss: {avg_loss}")
-                    tb_logger.log_scalar('Train/Loss', avg_loss, processed_step)
+                    precision.backward(loss_value / accumulation_steps)
+                    step_loss += loss_value.detach()
+                    warmup = warmup or any(function.warmup for function in compiled)
+
+                accumulated_steps += 1
+                if accumulated_steps == accumulation_steps:
+                    # 更新模型参数并清空梯度
+                    precision.step(optimizer_f)
+                    optimizer_f.zero_grad()
+                    accumulated_steps = 0
+                    optimizer_steps += 1
+
+                # 累计损失并显示批次损失均值
+                running_loss += step_loss.item()
+                # item() 已经等待设备完成计算
+                if warmup:
+                    compile_time += time.perf_counter() - step_start
+                    compile_steps += 1
+                else:
+                    step_time += time.perf_counter() - step_start
+                # 更新进度条描述
+                avg_loss = running_loss / (epoch_processed_step + 1)  # 计算当前平均损失
+                # 更新进度变量
+                epoch_processed_step += 1
+                epoch_processed_slices += step_slices
+                # 更新进度条
+                pbar.set_description(
+                    f"Epoch {epoch + 1}/{epochs}; Step: {epoch_processed_step}/{total_step}; "
+                    f"Slice: {epoch_processed_slices}/{epoch_slice} ")
+                pbar.set_postfix(loss=avg_loss)  # 显示当前step的平均损失
+
+                # 更新总Step
+                processed_step += 1
+                # 记录训练损失到 TensorBoard
+                logger_f.info(f"Step: {processed_step} - Train/Loss: {avg_loss}")
+                tb_logger.log_scalar('Train/Loss', avg_loss, processed_step)
             pbar.update()
+            if accumulated_steps:
+                # epoch 末尾不足 accumulation_steps 的梯度也更新一次，梯度不跨越验证和学习率调整；
+                # 按实际累积的 step 数量重新求平均
+                for parameter in net.parameters():
+                    if parameter.grad is not None:
+                        parameter.grad.mul_(accumulation_steps / accumulated_steps)
+                precision.step(optimizer_f)
+                optimizer_f.zero_grad()
+                optimizer_steps += 1
             # 调整学习率
             scheduler_f.step()
+        timed_steps = max(epoch_processed_step - compile_steps, 1)
+        step_message = (f"Epoch: {epoch + 1} - Step time: {step_time:.2f}s"
+                        f" ({step_time / timed_steps * 1000:.1f} ms/step), optimizer steps: {optimizer_steps}")
+        if compile_steps:
+            # 编译时间单独统计，不计入 step 时间
+            step_message += f", compile time: {compile_time:.2f}s in {compile_steps} warm-up steps"
+        logger_fac.info(step_message)
 
         # 验证模型性能
         net.eval()  # 设置模型为评估模式
@@ -192,36 +432,38 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
 
         torch.cuda.empty_cache()
         with torch.no_grad():  # 关闭梯度计算
-            with tqdm(valid_loader, desc="Validation", unit="batch_person") as pbar_test:
-                for masked_images, original_images in pbar_test:
-                    if concat_method == 'plane':
-                        masked_images = swap_batch_slice_dimensions(masked_images).to(device)
-                        original_images = swap_batch_slice_dimensions(original_images).to(device)
-                    elif concat_method == 'channels':
-                        masked_images = delete_batch_dimensions(masked_images).to(device)
-                        original_images = delete_batch_dimensions(original_images).to(device)
-                    for step in range(slice_deep // step_slice):
-                        masked_images_step = masked_images[range(step, masked_images.shape[0],
-                                                                 step_per_epoch), :, :, :]
-                        original_images_step = original_images[range(step, original_images.shape[0],
-                                                                     step_per_epoch), :, :, :]
+            if frozen_valid is not None:
+                # 固定的验证集已经在内存中，每个 step 只需传输和展开掩码
+                pbar_test = tqdm(frozen_valid.iter_steps(step_slice, device), desc="Validation", unit="step",
+                                 total=frozen_valid.num_steps(step_slice))
+                valid_steps = pbar_test
+            else:
+                pbar_test = tqdm(valid_loader, desc="Validation", unit="batch_person")
+                valid_steps = iter_step_batches(pbar_test, concat_method, step_per_epoch, device, slice_level,
+                                                mask_transport, valid_masker)
+            with pbar_test:
+                for masked_images_step, original_images_step in valid_steps:
+                    with precision.autocast():
                         outputs = net(masked_images_step)
+                    # 损失和指标在 float32 中计算
+                    outputs = outputs.float()
 
-                        # 计算损失
-                        # test_loss += criterion.calculate_loss_regions(outputs, original_images_step,
-                        #                                               binary_masks=test_binary_mask)
-                        valid_loss += criterion.calculate_loss_regions(outputs, original_images_step,
-                                                                       binary_masks=test_binary_mask)
-                        # 计算 PSNR 和 SSIM
-                        current_psnr, current_ssim = metric(outputs, original_images_step, binary_masks=test_binary_mask,
-                                                            concat_method=concat_method)
-                        # 累加每个象限的 PSNR 和 SSIM
-                        for j in range(4):
-                            avg_psnr[j] += current_psnr[j]
-                            avg_ssim[j] += current_ssim[j]
-                        count += 1
+                    # 计算损失
+                    # test_loss += criterion.calculate_loss_regions(outputs, original_images_step,
+                    #                                               binary_masks=test_binary_mask)
+                    valid_loss += criterion.calculate_loss_regions(outputs, original_images_step,
+                                                                   binary_masks=test_binary_mask)
+                    # 计算 PSNR 和 SSIM
+                    current_psnr, current_ssim = metric(outputs, original_images_step, binary_masks=test_binary_mask,
+                                                        concat_method=concat_method)
+                    # 累加每个象限的 PSNR 和 SSIM
+                    for j in range(4):
+                        avg_psnr[j] += current_psnr[j]
+                        avg_ssim[j] += current_ssim[j]
+                    count += 1
                 pbar_test.update()
 
+        # 固定的验证集使用相同的 batch_size 和 level 读取，len(valid_loader) 与不固定时相同
         valid_loss /= len(valid_loader)
         avg_psnr_total = [x / count for x in avg_psnr]
         avg_ssim_total = [x / count for x in avg_ssim]
@@ -259,13 +501,13 @@ def train(config, net, device, criterion, optimizer_f, scheduler_f, metric, resu
             best_loss = valid_loss
             file_name = f'best_model_epoch_{epoch + 1}.ckpt'
             best_model_path = save_root / file_name
-            create_checkpoint(epoch + 1, net, optimizer_f, scheduler_f, valid_loss, best_model_path)
+            create_checkpoint(epoch + 1, net, optimizer_f, scheduler_f, valid_loss, best_model_path, precision)
             logger_fac.info(f"Saved best model at epoch {epoch + 1} to {best_model_path}")
 
         # 保存定期的检查点
         if (epoch + 1) % 10 == 0:
             checkpoint_path = save_root / f'checkpoint_epoch_{epoch + 1}.ckpt'
-            create_checkpoint(epoch + 1, net, optimizer_f, scheduler_f, valid_loss, checkpoint_path)
+            create_checkpoint(epoch + 1, net, optimizer_f, scheduler_f, valid_loss, checkpoint_path, precision)
             logger_fac.info(f"Saved checkpoint at epoch {epoch + 1}")
         logger_fac.info("---------------------------------------------------------------------------------------------")
         torch.cuda.empty_cache()
@@ -0,0 +1,37 @@
+"""
+计算数据划分中每个患者、每个切片、每个模态的前景比例，用法：
+python utils/build_foreground_index.py --root ASNR-MICCAI-BraTS2023-GLI-Challenge-TrainingData --list_dir data/list/pre-test-50 \
+    --mode train --slice_deep 96 --slice_size 192 --cache_dir data/cache
+输出文件默认为 data/foreground/<划分名>_<mode>_<slice_deep>_<slice_size>.npz（前景比例和患者名），与 config 中 data.foreground_dir 的约定一致。
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datasets.BraTsData_person import Dataset_brats
+from datasets.packed_store import packed_path
+from datasets.sampler import build_foreground_index, foreground_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record the per-slice, per-modality foreground fraction of a split.')
+    parser.add_argument('--root', type=str, required=True, help='Dataset directory under data/raw')
+    parser.add_argument('--list_dir', type=str, default='data/list/pre-test-50', help='Split directory')
+    parser.add_argument('--mode', type=str, default='train', choices=['train', 'valid', 'test'])
+    parser.add_argument('--slice_deep', type=int, default=96)
+    parser.add_argument('--slice_size', type=int, default=192)
+    parser.add_argument('--cache_dir', type=str, help='Reuse preprocessed volumes from this cache')
+    parser.add_argument('--packed_dir', type=str, help='Read volumes from the packed file in this directory')
+    parser.add_argument('--reader', type=str, default='sitk', help='NIfTI reader backend')
+    parser.add_argument('-o', '--output', type=str, help='Output file')
+    args = parser.parse_args()
+
+    packed_file = packed_path(args.packed_dir, args.list_dir, args.mode) if args.packed_dir else None
+    dataset = Dataset_brats(root_dir=args.root, slice_deep=args.slice_deep, slice_size=args.slice_size, mode=args.mode,
+                            list_dir=args.list_dir, cache_dir=args.cache_dir, packed_file=packed_file,
+                            reader=args.reader)
+    output = args.output if args.output else foreground_path('data/foreground', args.list_dir, args.mode,
+                                                             args.slice_deep, args.slice_size)
+    index = build_foreground_index(dataset, output)
+    print(f"统计完成: {output}，空切片比例（前景 < 1%）: {(index.max(axis=-1) < 0.01).mean():.2%}")
@@ -0,0 +1,37 @@
+"""
+扫描数据集目录下的所有患者，生成数据集清单（路径、大小、修改时间、形状、体素间距、统计量和内容指纹），用法：
+python utils/build_manifest.py --root ASNR-MICCAI-BraTS2023-GLI-Challenge-TrainingData
+输出文件默认为 data/manifest/<数据集目录名>.csv（-o 指定 .parquet 时保存为 parquet），config 中的 data.manifest_dir 指向输出目录即可（同名的 .parquet 优先于 .csv）。
+输出文件已存在时只重新读取大小或修改时间变化的文件，--full 时全部重新扫描。
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datasets.BraTsData_person import MODALITIES
+from datasets.manifest import build_manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a per-file manifest of a BraTS dataset directory.')
+    parser.add_argument('--root', type=str, required=True, help='Dataset directory under data/raw')
+    parser.add_argument('--percentile', type=float, default=99)
+    parser.add_argument('--workers', type=int, help='Number of processes')
+    parser.add_argument('--full', action='store_true', help='Rescan every file instead of only changed ones')
+    parser.add_argument('-o', '--output', type=str, help='Output .csv or .parquet file')
+    args = parser.parse_args()
+
+    root = os.path.join('data/raw', args.root)
+    directories = sorted(entry.path for entry in os.scandir(root) if entry.is_dir())
+    output = args.output if args.output else os.path.join('data/manifest', f'{args.root}.csv')
+    df = build_manifest(directories, output, list(MODALITIES) + ['seg'], percentile=args.percentile,
+                        workers=args.workers, previous=None if args.full else output)
+
+    problems = df[df['error'] != '']
+    print(f"清单完成: {output}，共 {len(directories)} 个患者、{len(df)} 个文件，"
+          f"{df['size'].sum() / 1024 ** 3:.2f} GB")
+    if len(problems):
+        print(f"{len(problems)} 个文件缺失或无法读取:")
+        for row in problems.itertuples(index=False):
+            print(f"  {row.patient} {row.modality}: {row.error}")
@@ -0,0 +1,42 @@
+"""
+根据配置文件中的遮蔽设置生成训练和测试使用的掩码库，用法：
+python utils/build_mask_bank.py --config config/UNet_2d.yaml
+输出目录默认为 config 中的 mask.bank_dir（未设置时为 data/masks），文件名由遮蔽设置决定，与 train()、evaluation() 的查找规则一致：
+- 训练: train_binary_mask、train_mask_rate、is_random
+- 验证/测试: test_binary_mask、test_mask_rate，不使用 is_random
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mask_generator.mask_bank import build_mask_bank, mask_bank_path
+from utils.config import load_config
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-generate seeded mask banks for training and evaluation.')
+    parser.add_argument('-c', '--config', type=str, default='config/UNet_2d.yaml', help='YAML configuration file')
+    parser.add_argument('--bank_dir', type=str, help='Output directory, overrides mask.bank_dir')
+    parser.add_argument('--modes', type=str, nargs='+', default=['train', 'test'], choices=['train', 'test'])
+    parser.add_argument('--workers', type=int, help='Number of processes')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    mask_config = config['mask']
+    bank_dir = args.bank_dir or mask_config.get('bank_dir', 'data/masks')
+    bank_size = mask_config.get('bank_size', 65536)
+    bank_seed = mask_config.get('bank_seed', 0)
+    slice_size = config['train']['slice_size']
+    settings = {
+        'train': (mask_config['train_binary_mask'], mask_config['train_mask_rate'], mask_config.get('is_random', False)),
+        'test': (mask_config['test_binary_mask'], mask_config['test_mask_rate'], False),
+    }
+
+    for mode in args.modes:
+        binary_mask, mask_rate, is_random = settings[mode]
+        output = mask_bank_path(bank_dir, slice_size, mask_config['mask_kernel_size'], binary_mask, mask_rate,
+                                is_random, bank_seed, bank_size)
+        build_mask_bank(output, slice_size, mask_config['mask_kernel_size'], binary_mask, mask_rate, is_random,
+                        seed=bank_seed, num_entries=bank_size, workers=args.workers)
+        print(f"生成完成: {output} ({os.path.getsize(output) / 1024 ** 2:.1f} MB)")
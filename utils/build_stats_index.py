@@ -0,0 +1,38 @@
+"""
+计算数据划分中所有患者完整图像的统计量（百分位数、最小值、最大值、前景体素数量），用法：
+python utils/build_stats_index.py --root ASNR-MICCAI-BraTS2023-GLI-Challenge-TrainingData --list_dir data/list/pre-test-50
+输出文件默认为 data/stats/<数据集目录名>.csv，通过 config 中的 data.stats_file 使用。
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datasets.BraTsData_person import MODALITIES
+from datasets.normalization import build_stats_index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute per-patient, per-modality intensity statistics.')
+    parser.add_argument('--root', type=str, required=True, help='Dataset directory under data/raw')
+    parser.add_argument('--list_dir', type=str, default='data/list/pre-test-50', help='Split directory')
+    parser.add_argument('--modes', type=str, nargs='+', default=['train', 'valid', 'test'], help='Splits to include')
+    parser.add_argument('--percentile', type=float, default=99)
+    parser.add_argument('--workers', type=int, help='Number of processes')
+    parser.add_argument('-o', '--output', type=str, help='Output csv file')
+    args = parser.parse_args()
+
+    names = []
+    for mode in args.modes:
+        csv_file = os.path.join(args.list_dir, f'{mode}.csv')
+        if os.path.exists(csv_file):
+            names += pd.read_csv(csv_file, header=None).iloc[:, 0].tolist()
+    # 同一个患者可能出现在多个划分中（例如训练集和验证集来自同一目录）
+    names = list(dict.fromkeys(names))
+    directories = [os.path.join('data/raw', args.root, name) for name in names]
+
+    output = args.output if args.output else os.path.join('data/stats', f'{args.root}.csv')
+    build_stats_index(directories, output, MODALITIES, percentile=args.percentile, workers=args.workers)
+    print(f"统计完成: {output}，共 {len(directories)} 个患者")
@@ -8,6 +8,11 @@ def load_config(config_path):
     return config
 
 
+def workers_arg(value):
+    # DataLoader worker 数量，整数或 'auto'
+    return value if value == 'auto' else int(value)
+
+
 def get_args():
     parser = argparse.ArgumentParser(description='Train/Test a deep learning model with specified configuration.')
     parser.add_argument('-c', '--config', type=str,
@@ -39,7 +44,14 @@ def get_args():
 
     parser.add_argument("--mask_kernel_size", type=int, help="mask kernel size")
 
-    parser.add_argument("--num_works", type=int, help="dataloader num_works")
+    parser.add_argument("--num_works", type=workers_arg, help="dataloader num_works, an integer or 'auto'")
+
+    parser.add_argument("--precision", type=str, choices=['fp32', 'bf16', 'fp16'],
+                        help="mixed precision, bf16 on CPU, fp16 or bf16 on CUDA")
+
+    parser.add_argument("--compile", type=str, nargs='?', const='default',
+                        choices=['default', 'reduce-overhead', 'max-autotune'],
+                        help="torch.compile the network and loss with the given mode (default: 'default')")
 
     parser.add_argument("-dsp", "--description", type=str, default="", help="exp description")
 
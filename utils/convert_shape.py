@@ -19,3 +19,82 @@ def delete_batch_dimensions(tensor):
     tensor = tensor.squeeze(0)
     return tensor
 
+
+def iter_step_batches(batches, concat_method, step_per_epoch, device, slice_level=False, mask_transport='dense',
+                      masker=None):
+    """
+    将 DataLoader 的输出整理为每个 step 的 (遮蔽后图像, 原始图像)，并移动到设备上。
+    float16 的样本在传输到设备之后再转换为 float32。
+    患者级数据每个 batch 为一个人的全部切片，按 step_per_epoch 的间隔划分为多个 step，使用步长切片而不是索引列表，避免复制；
+    切片级数据每个 batch 即为一个 step。
+    args:
+    batches: DataLoader 或包装了 DataLoader 的 tqdm
+    concat_method: 'plane' 或 'channels'
+    step_per_epoch: 每个人划分的 step 数量，仅患者级数据使用
+    device: 目标设备
+    slice_level: 是否为切片级数据
+    mask_transport: 'dense' DataLoader 输出遮蔽后图像；'block' DataLoader 输出块级别掩码，在设备上展开后与原始图像相乘；
+                    'device' DataLoader 只输出原始图像，在设备上生成掩码
+    masker: mask_generator.torch_masker.DeviceMasker，'block' 和 'device' 使用
+    """
+    for masked_images, original_images in batches:
+        original_images = original_images.to(device, non_blocking=True).float()
+        if mask_transport == 'device':
+            # DataLoader 输出的第一项只是占位
+            masked_images = original_images
+        elif mask_transport == 'block':
+            # 块级别掩码的形状与拼接方式无关，为 (batch_size, slice_num, 4, grid, grid) 或 (batch_size, 4, grid, grid)
+            masked_images = masked_images.to(device, non_blocking=True)
+        else:
+            masked_images = masked_images.to(device, non_blocking=True).float()
+
+        if slice_level:
+            steps = [(masked_images, original_images)]
+        else:
+            # 交换维度Batch_size和slice_size
+            # 将slice_size作为真实的Batch_size
+            if concat_method == 'plane':
+                original_images = swap_batch_slice_dimensions(original_images)
+            elif concat_method == 'channels':
+                original_images = delete_batch_dimensions(original_images)
+            if mask_transport == 'device':
+                masked_images = original_images
+            elif mask_transport == 'block' or concat_method == 'channels':
+                masked_images = delete_batch_dimensions(masked_images)
+            else:
+                masked_images = swap_batch_slice_dimensions(masked_images)
+            steps = ((masked_images[step::step_per_epoch], original_images[step::step_per_epoch])
+                     for step in range(step_per_epoch))
+
+        for masked_images_step, original_images_step in steps:
+            if mask_transport == 'block':
+                masked_images_step = masker.apply_block(masked_images_step, original_images_step)
+            elif mask_transport == 'device':
+                masked_images_step = masker(original_images_step)
+            yield masked_images_step, original_images_step
+
+
+def channels_to_plane(tensor):
+    """
+    将 'channels' 排列的张量转换为 'plane' 排列，四个模态按左上、右上、左下、右下的顺序拼接。
+    args:
+    tensor (torch.Tensor): 形状为 [batch_size, 4, height, width] 的4D张量。
+    return:
+    torch.Tensor: 形状为 [batch_size, 1, 2 * height, 2 * width] 的4D张量
+    """
+    batch_size, _, height, width = tensor.shape
+    return tensor.reshape(batch_size, 2, 2, height, width).permute(0, 1, 3, 2, 4).reshape(
+        batch_size, 1, 2 * height, 2 * width)
+
+
+def plane_to_channels(tensor):
+    """
+    channels_to_plane 的逆变换。
+    args:
+    tensor (torch.Tensor): 形状为 [batch_size, 1, 2 * height, 2 * width] 的4D张量。
+    return:
+    torch.Tensor: 形状为 [batch_size, 4, height, width] 的4D张量
+    """
+    batch_size, _, height, width = tensor.shape
+    return tensor.reshape(batch_size, 2, height // 2, 2, width // 2).permute(0, 1, 3, 2, 4).reshape(
+        batch_size, 4, height // 2, width // 2)
@@ -0,0 +1,72 @@
+"""
+将数据划分打包成单文件分块存储，用法：
+python utils/pack_dataset.py --root ASNR-MICCAI-BraTS2023-GLI-Challenge-TrainingData --list_dir data/list/pre-test-50 \
+    --mode train --slice_deep 96 --slice_size 192
+输出文件默认为 data/packed/<划分名>_<mode>.pack，与 config 中 data.packed_dir 的约定一致。
+"""
+import argparse
+import os
+import sys
+
+from tqdm import tqdm
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datasets.BraTsData_person import Dataset_brats, MODALITIES
+from datasets.packed_store import PackedStoreWriter, packed_path
+
+
+def pack_split(root_dir, list_dir, mode, slice_deep, slice_size, output=None, dtype='float32', level=1,
+               cache_dir=None, reader='sitk', stats_file=None, norm_method='partition', norm_dtype='float32'):
+    """
+    将一个划分中的所有患者打包成一个文件。
+    :param root_dir: data/raw 下的数据集目录名
+    :param list_dir: 数据划分目录
+    :param mode: 'train'、'valid' 或 'test'
+    :param output: 输出文件路径，为 None 时使用 data/packed/<划分名>_<mode>.pack
+    :param dtype: 存储精度，'float32' 或 'float16'
+    :param level: zlib 压缩等级
+    :param cache_dir: 预处理结果的缓存目录，已有缓存时直接复用
+    :param reader: NIfTI 读取后端，见 datasets/readers.py；没有统计索引时决定归一化范围（volume 或 slab）
+    :param stats_file: 统计索引（见 utils/build_stats_index.py）
+    :param norm_method: 没有统计索引时百分位数的计算方法
+    :param norm_dtype: 归一化的计算精度
+    以上归一化参数需要与训练配置一致，记录在打包文件的索引中，不一致时读取打包文件报错
+    :return: 输出文件路径
+    """
+    dataset = Dataset_brats(root_dir=root_dir, slice_deep=slice_deep, slice_size=slice_size, mode=mode,
+                            list_dir=list_dir, cache_dir=cache_dir, reader=reader, stats_file=stats_file,
+                            norm_method=norm_method, norm_dtype=norm_dtype)
+    if output is None:
+        output = packed_path('data/packed', list_dir, mode)
+
+    writer = PackedStoreWriter(output, slice_deep, slice_size, MODALITIES, percentile=dataset.percentile,
+                               dtype=dtype, level=level, **dataset.normalization())
+    for patient_path in tqdm(dataset.patients, desc=f"Packing {mode}", unit="person"):
+        writer.add_patient(os.path.basename(patient_path), dataset.load_patient(patient_path))
+    writer.close()
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a dataset split into a single chunked file.')
+    parser.add_argument('--root', type=str, required=True, help='Dataset directory under data/raw')
+    parser.add_argument('--list_dir', type=str, default='data/list/pre-test-50', help='Split directory')
+    parser.add_argument('--mode', type=str, default='train', choices=['train', 'valid', 'test'])
+    parser.add_argument('--slice_deep', type=int, default=96)
+    parser.add_argument('--slice_size', type=int, default=192)
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16'])
+    parser.add_argument('--level', type=int, default=1, help='zlib compression level')
+    parser.add_argument('--cache_dir', type=str, help='Reuse preprocessed volumes from this cache')
+    parser.add_argument('--reader', type=str, default='sitk', help='NIfTI reader backend')
+    parser.add_argument('--stats_file', type=str, help='Intensity statistics index (utils/build_stats_index.py)')
+    parser.add_argument('--norm_method', type=str, default='partition', choices=['numpy', 'partition', 'histogram'],
+                        help='Percentile method without a stats index')
+    parser.add_argument('--norm_dtype', type=str, default='float32', choices=['float32', 'float64'])
+    parser.add_argument('-o', '--output', type=str, help='Output file')
+    args = parser.parse_args()
+
+    path = pack_split(args.root, args.list_dir, args.mode, args.slice_deep, args.slice_size, output=args.output,
+                      dtype=args.dtype, level=args.level, cache_dir=args.cache_dir, reader=args.reader,
+                      stats_file=args.stats_file, norm_method=args.norm_method, norm_dtype=args.norm_dtype)
+    print(f"打包完成: {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
@@ -1,7 +1,7 @@
 import torch
 
 
-def create_checkpoint(epoch, model, optimizer_f, scheduler_f, loss, filename):
+def create_checkpoint(epoch, model, optimizer_f, scheduler_f, loss, filename, precision=None):
     checkpoint = {
         'epoch': epoch,
         'model_state_dict': model.state_dict(),
@@ -10,15 +10,21 @@ def create_checkpoint(epoch, model, optimizer_f, scheduler_f, loss, filename):
         'loss': loss,
         'learning_rate': optimizer_f.optimizer.param_groups[0]['lr']
     }
+    if precision is not None:
+        # 训练精度和 fp16 的 GradScaler 状态
+        checkpoint['precision'] = precision.name
+        checkpoint['scaler_state_dict'] = precision.state_dict()
     torch.save(checkpoint, filename)
 
 
-def load_checkpoint(filename, model, optimizer_f, scheduler_f, method='model', map_location='cpu'):
+def load_checkpoint(filename, model, optimizer_f, scheduler_f, method='model', map_location='cpu', precision=None):
     if method == 'resume':
         checkpoint = torch.load(filename, map_location=map_location)
         model.load_state_dict(checkpoint['model_state_dict'])
         optimizer_f.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         scheduler_f.scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+        if precision is not None and checkpoint.get('precision') == precision.name:
+            precision.load_state_dict(checkpoint.get('scaler_state_dict'))
         epoch = checkpoint['epoch']
         loss = checkpoint['loss']
         learning_rate = checkpoint['learning_rate']
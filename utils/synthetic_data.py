@@ -0,0 +1,215 @@
+"""
+生成与 BraTS2023 格式相同的合成数据，用于在没有患者数据的机器上对数据管道、遮蔽算法和训练循环做压力测试，用法：
+python utils/synthetic_data.py --num 1000 --root SYNTHETIC-BraTS --list_dir data/list/synthetic
+生成 data/raw/<root>/BraTS-GLI-xxxxx-000/BraTS-GLI-xxxxx-000-{t1c,t1n,t2w,t2f,seg}.nii.gz（155*240*240，1mm 体素），
+以及 <list_dir>/train.csv、valid.csv、test.csv，config 中的 data.train/valid/test 和 data.list_dir 指向它们即可。
+每个患者的图像:
+- 脑形状的前景: 扰动后的椭球，背景为 0（与去颅骨后的 BraTS 数据一致）
+- 组织: 皮层灰质、白质、脑室和脑沟中的脑脊液，四个模态使用不同的对比度，加入偏置场、噪声和部分容积平滑
+- 肿瘤: 1~2 个不规则的团块，由内到外为坏死核心（标签 1）、增强区（标签 3）和水肿（标签 2）
+每个患者的随机数只由 seed 和患者编号决定，与进程数量无关，可以分多次生成；
+患者所属的数据集只由 seed 和患者名决定，之后生成的患者不会改变已有患者的划分。
+"""
+import argparse
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+import torch
+import torch.nn.functional as F
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datasets.BraTsData_person import MODALITIES
+
+# BraTS2023 的图像尺寸 (切片, 高, 宽)
+VOLUME_SHAPE = (155, 240, 240)
+# 各组织在四个模态中的平均强度: 脑脊液、灰质、白质、坏死、增强、水肿
+TISSUES = ('csf', 'gm', 'wm', 'necrosis', 'enhancing', 'edema')
+CONTRAST = {
+    't1c': (300, 750, 950, 300, 1800, 600),
+    't1n': (300, 700, 900, 350, 700, 550),
+    't2w': (2500, 1300, 900, 2200, 1500, 2000),
+    't2f': (200, 900, 700, 600, 1100, 1600),
+}
+# 分割标签: 坏死核心、水肿、增强区
+SEG_LABELS = {'necrosis': 1, 'edema': 2, 'enhancing': 3}
+
+
+def smooth_noise(rng, shape, coarse=(6, 8, 8)):
+    """
+    低频随机场: 在粗网格上生成标准正态噪声，三线性插值到完整尺寸。
+    """
+    grid = torch.from_numpy(rng.standard_normal(coarse).astype(np.float32))[None, None]
+    return F.interpolate(grid, size=shape, mode='trilinear', align_corners=True)[0, 0].numpy()
+
+
+def ellipsoid_distance(shape, center, radii):
+    """
+    :return: 每个体素到椭球中心的归一化距离，椭球表面为 1
+    """
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    return np.sqrt(((z - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2 +
+                   ((x - center[2]) / radii[2]) ** 2, dtype=np.float32)
+
+
+def partial_volume(volume):
+    """
+    3*3*3 均值平滑，模拟部分容积效应。
+    """
+    tensor = torch.from_numpy(volume)[None, None]
+    return F.avg_pool3d(tensor, 3, stride=1, padding=1, count_include_pad=False)[0, 0].numpy()
+
+
+def synthetic_patient(rng, shape=VOLUME_SHAPE):
+    """
+    生成一个患者。
+    :return: ({模态: float32 图像}, uint8 分割标签)
+    """
+    scale = rng.uniform(0.92, 1.08, 3)
+    center = np.array(shape) / 2 + rng.normal(0, [2, 4, 3])
+    radius = np.array([64, 86, 68]) * scale
+    brain_distance = ellipsoid_distance(shape, center, radius) + 0.06 * smooth_noise(rng, shape)
+    brain = brain_distance < 1
+
+    # 组织: 外层为皮层灰质，内部为白质，中心附近为两个脑室，表面附近的脑沟为脑脊液
+    texture = smooth_noise(rng, shape, (12, 16, 16))
+    tissue = np.full(shape, TISSUES.index('wm'), dtype=np.uint8)
+    tissue[(brain_distance > 0.8 + 0.05 * texture) | (texture > 1.6)] = TISSUES.index('gm')
+    for side in (-1, 1):
+        ventricle_center = center + np.array([5, -5, side * 8]) * scale
+        ventricle = ellipsoid_distance(shape, ventricle_center, np.array([14, 24, 5]) * scale)
+        tissue[ventricle + 0.1 * texture < 1] = TISSUES.index('csf')
+    tissue[(brain_distance > 0.96) & (texture > 0.3)] = TISSUES.index('csf')
+
+    # 肿瘤: 由内到外为坏死、增强区、水肿，水肿限制在脑内
+    seg = np.zeros(shape, dtype=np.uint8)
+    for _ in range(1 if rng.random() < 0.8 else 2):
+        offset = rng.normal(0, 1, 3)
+        tumor_center = center + offset / np.linalg.norm(offset) * radius * rng.uniform(0, 0.55)
+        tumor_radius = rng.uniform(10, 28) * rng.uniform(0.8, 1.2, 3)
+        distance = ellipsoid_distance(shape, tumor_center, tumor_radius) + \
+            0.15 * smooth_noise(rng, shape, (8, 10, 10))
+        necrosis_size = rng.uniform(0, 0.5)
+        edema = brain & (distance < rng.uniform(1.4, 2.0)) & (seg == 0)
+        seg[edema] = SEG_LABELS['edema']
+        seg[distance < 1] = SEG_LABELS['enhancing']
+        seg[distance < necrosis_size] = SEG_LABELS['necrosis']
+    for name, label in SEG_LABELS.items():
+        tissue[seg == label] = TISSUES.index(name)
+    seg[~brain] = 0
+
+    bias = np.exp(0.08 * smooth_noise(rng, shape, (4, 4, 4)))
+    images = {}
+    for modality in MODALITIES:
+        contrast = np.array(CONTRAST[modality], dtype=np.float32) * rng.uniform(0.85, 1.15)
+        image = partial_volume(contrast[tissue])
+        image *= bias * (1 + 0.04 * rng.standard_normal(shape, dtype=np.float32))
+        image += 0.02 * contrast.max() * np.abs(rng.standard_normal(shape, dtype=np.float32))
+        image[~brain] = 0
+        images[modality] = np.clip(image, 0, None)
+    return images, seg
+
+
+def write_volume(array, path):
+    image = sitk.GetImageFromArray(array)
+    # 与 BraTS2023 相同的 1mm 体素和 LPS 方向
+    image.SetSpacing((1.0, 1.0, 1.0))
+    image.SetOrigin((-0.0, -239.0, 0.0))
+    image.SetDirection((-1.0, 0.0, 0.0, 0.0, -1.0, 0.0, 0.0, 0.0, 1.0))
+    sitk.WriteImage(image, path, useCompression=True)
+
+
+def patient_name(index):
+    return f"BraTS-GLI-{index:05d}-000"
+
+
+def _write_patient(args):
+    root, index, seed, dtype, overwrite = args
+    name = patient_name(index)
+    directory = os.path.join(root, name)
+    paths = {modality: os.path.join(directory, f"{name}-{modality}.nii.gz") for modality in MODALITIES + ('seg',)}
+    if not overwrite and all(os.path.exists(path) for path in paths.values()):
+        return name
+    # 每个进程只用一个线程，由进程数量控制并行度
+    torch.set_num_threads(1)
+    images, seg = synthetic_patient(np.random.default_rng([seed, index]))
+    os.makedirs(directory, exist_ok=True)
+    for modality, image in images.items():
+        write_volume(np.rint(image).astype(dtype) if np.dtype(dtype).kind == 'i' else image.astype(dtype),
+                     paths[modality])
+    write_volume(seg, paths['seg'])
+    return name
+
+
+def generate_dataset(root, num, seed=0, workers=None, dtype='int16', start=0, overwrite=False):
+    """
+    并行生成合成数据集。
+    :param root: 输出目录，例如 data/raw/SYNTHETIC-BraTS
+    :param num: 患者数量
+    :param dtype: 模态图像的存储类型，'int16' 或 'float32'
+    :param start: 第一个患者的编号
+    :param overwrite: 为 False 时跳过已经完整生成的患者，中断后可以继续生成
+    :return: 患者名列表
+    """
+    tasks = [(root, index, seed, dtype, overwrite) for index in range(start, start + num)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_patient, tasks))
+
+
+def split_of(name, ratios=(0.7, 0.1, 0.2), seed=0):
+    """
+    由 seed 和患者名决定患者所属的数据集，与其他患者无关，分多次生成时已有患者的划分保持不变。
+    :return: 'train'、'valid' 或 'test'
+    """
+    # 患者名的哈希映射到 [0, 1)，与累计比例比较
+    position = zlib.crc32(f"{seed}:{name}".encode()) / 2 ** 32 * sum(ratios)
+    if position < ratios[0]:
+        return 'train'
+    return 'valid' if position < ratios[0] + ratios[1] else 'test'
+
+
+def write_splits(names, list_dir, ratios=(0.7, 0.1, 0.2), seed=0):
+    """
+    按 split_of 划分并写入 train.csv、valid.csv、test.csv，格式与 utils/split_dataset.py 相同（每行一个患者名，没有表头）。
+    每个数据集至少需要一个患者（空的 csv 无法由 pd.read_csv 读取），否则抛出异常且不写入任何文件。
+    """
+    splits = {'train': [], 'valid': [], 'test': []}
+    for name in sorted(names):
+        splits[split_of(name, ratios, seed)].append(name)
+    empty = [mode for mode, subset in splits.items() if not subset]
+    if empty:
+        raise ValueError(f"No patients assigned to {', '.join(empty)} out of {len(names)} patients, "
+                         f"generate more patients (--num) or change --ratios")
+    os.makedirs(list_dir, exist_ok=True)
+    for mode, subset in splits.items():
+        with open(os.path.join(list_dir, f'{mode}.csv'), 'w') as f:
+            for name in subset:
+                f.write(f"{name}\n")
+    return splits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic BraTS-2023-shaped dataset.')
+    parser.add_argument('--num', type=int, default=100, help='Number of patients')
+    parser.add_argument('--root', type=str, default='SYNTHETIC-BraTS', help='Dataset directory under data/raw')
+    parser.add_argument('--list_dir', type=str, default='data/list/synthetic', help='Split directory')
+    parser.add_argument('--ratios', type=float, nargs=3, default=[0.7, 0.1, 0.2], help='train / valid / test')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=int, default=0, help='Index of the first patient')
+    parser.add_argument('--dtype', type=str, default='int16', choices=['int16', 'float32'])
+    parser.add_argument('--workers', type=int, help='Number of processes')
+    parser.add_argument('--overwrite', action='store_true', help='Regenerate patients that already exist')
+    args = parser.parse_args()
+
+    root = os.path.join('data/raw', args.root)
+    generated = generate_dataset(root, args.num, seed=args.seed, workers=args.workers, dtype=args.dtype,
+                                 start=args.start, overwrite=args.overwrite)
+    # 分多次生成时划分包含目录下的所有患者
+    names = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    splits = write_splits(names, args.list_dir, args.ratios, args.seed)
+    print(f"生成完成: {root}，本次 {len(generated)} 个患者，共 {len(names)} 个患者")
+    print(f"训练集数量: {len(splits['train'])}，验证集数量: {len(splits['valid'])}，测试集数量: {len(splits['test'])}")